@@ -1,88 +1,287 @@
 """Tool to convert Envoy tap trace format to PCAP.
 
-Uses od and text2pcap (part of Wireshark) utilities to translate the Envoy
-tap trace proto format to a PCAP file suitable for consuming in Wireshark
-and other tools in the PCAP ecosystem. The TCP stream in the output PCAP is
-synthesized based on the known IP/port/timestamps that Envoy produces in its
-tap files; it is not a literal wire tap.
+Translates the Envoy tap trace proto format to a PCAP file suitable for
+consuming in Wireshark and other tools in the PCAP ecosystem. The TCP stream in
+the output PCAP is synthesized based on the known IP/port/timestamps that Envoy
+produces in its tap files; it is not a literal wire tap. Each read/write event
+becomes one or more Ethernet/IPv4 or IPv6/TCP packets, which are written out as
+the events are visited.
 
-Usage:
-
-bazel run @envoy_api_canonical//tools:tap2pcap <tap .pb/.pb_text> <pcap path>
+Both buffered traces and streamed trace segments are supported, in the file
+formats written by the file_per_tap sink: a single binary (.pb) or text
+(.pb_text) TraceWrapper, or a stream of length delimited TraceWrapper messages
+(.pb_length_delimited). Several tap files, or directories of them, are merged
+by event timestamp into one capture with a TCP flow per tapped connection.
+Length delimited streams are read incrementally, so memory use only depends on
+the number of files and of concurrently open connections.
 
-Known issues:
-- IPv6 PCAP generation has malformed TCP packets. This appears to be a text2pcap
-issue.
+Usage:
 
-TODO(htuch):
-- Figure out IPv6 PCAP issue above, or file a bug once the root cause is clear.
+bazel run @envoy_api_canonical//tools:tap2pcap <tap file or directory>... <pcap path>
 """
 from __future__ import print_function
 
-import datetime
-import io
-import socket
-import subprocess as sp
+import heapq
+import ipaddress
+import os
+import struct
 import sys
-import time
 
 from google.protobuf import text_format
 
 from envoy.data.tap.v2alpha import wrapper_pb2
 
+# Tap file extensions of the file_per_tap sink formats that can be converted.
+PROTO_BINARY_EXTENSION = '.pb'
+PROTO_BINARY_LENGTH_DELIMITED_EXTENSION = '.pb_length_delimited'
+PROTO_TEXT_EXTENSION = '.pb_text'
+TAP_EXTENSIONS = (
+    PROTO_BINARY_EXTENSION, PROTO_BINARY_LENGTH_DELIMITED_EXTENSION, PROTO_TEXT_EXTENSION)
+
+# Classic libpcap file format, microsecond timestamps.
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_VERSION = (2, 4)
+PCAP_SNAPLEN = 262144
+LINKTYPE_ETHERNET = 1
+
+# Synthesized link layer addresses, the same ones text2pcap uses.
+REMOTE_MAC = b'\x0a\x01\x01\x01\x01\x01'
+LOCAL_MAC = b'\x0a\x02\x02\x02\x02\x02'
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+
+IPPROTO_TCP = 6
+IP_TTL = 64
+TCP_HEADER_LENGTH = 20
+TCP_FLAGS_PSH_ACK = 0x18
+TCP_WINDOW = 0xffff
+# Payloads larger than this are split across several segments, so that the IPv4 total length
+# and IPv6 payload length fields don't overflow.
+TCP_MAX_SEGMENT = 0xffff - 20 - TCP_HEADER_LENGTH
+
+
+# RFC 1071 internet checksum over a sequence of byte strings.
+def internet_checksum(*chunks):
+    data = b''.join(chunks)
+    if len(data) % 2:
+        data += b'\0'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+class PcapWriter(object):
+    """Writes Ethernet frames to a PCAP file object as they are produced."""
+
+    def __init__(self, out):
+        self._out = out
+        self._out.write(
+            struct.pack(
+                '<IHHiIII', PCAP_MAGIC, PCAP_VERSION[0], PCAP_VERSION[1], 0, 0, PCAP_SNAPLEN,
+                LINKTYPE_ETHERNET))
+
+    def write_frame(self, timestamp, frame):
+        """Writes a frame captured at a google.protobuf.Timestamp."""
+        self._out.write(
+            struct.pack(
+                '<IIII', timestamp.seconds, timestamp.nanos // 1000, min(len(frame), PCAP_SNAPLEN),
+                len(frame)))
+        self._out.write(frame[:PCAP_SNAPLEN])
+
+
+class TcpFlow(object):
+    """Synthesizes the packets of a TCP connection between a remote and a local endpoint.
+
+    Sequence and acknowledgement numbers track the bytes sent in each direction, so that
+    reassembly in Wireshark sees a gapless stream.
+    """
 
-def dump_event(direction, timestamp, data):
-    dump = io.StringIO()
-    dump.write('%s\n' % direction)
-    # Adjust to local timezone
-    adjusted_dt = timestamp.ToDatetime() - datetime.timedelta(seconds=time.altzone)
-    dump.write('%s\n' % adjusted_dt)
-    od = sp.Popen(['od', '-Ax', '-tx1', '-v'], stdout=sp.PIPE, stdin=sp.PIPE, stderr=sp.PIPE)
-    packet_dump = od.communicate(data)[0]
-    dump.write(packet_dump.decode())
-    return dump.getvalue()
+    def __init__(self, writer, remote_address, remote_port, local_address, local_port):
+        self._writer = writer
+        remote_ip = ipaddress.ip_address(remote_address)
+        local_ip = ipaddress.ip_address(local_address)
+        # A dual stack listener can report one side as IPv4; use its IPv4-mapped IPv6 address.
+        if remote_ip.version != local_ip.version:
+            remote_ip, local_ip = (
+                ipaddress.IPv6Address('::ffff:%s' % ip) if ip.version == 4 else ip
+                for ip in (remote_ip, local_ip))
+        self._ipv6 = local_ip.version == 6
+        self._remote = (REMOTE_MAC, remote_ip.packed, remote_port)
+        self._local = (LOCAL_MAC, local_ip.packed, local_port)
+        self._remote_seq = 1
+        self._local_seq = 1
+        self._ip_id = 0
 
+    def read(self, timestamp, data):
+        """Records data received by the local endpoint."""
+        for offset in range(0, len(data), TCP_MAX_SEGMENT):
+            segment = data[offset:offset + TCP_MAX_SEGMENT]
+            self._write_segment(
+                timestamp, self._remote, self._local, self._remote_seq, self._local_seq, segment)
+            self._remote_seq = (self._remote_seq + len(segment)) & 0xffffffff
 
-def tap2pcap(tap_path, pcap_path):
-    wrapper = wrapper_pb2.TraceWrapper()
-    if tap_path.endswith('.pb_text'):
+    def write(self, timestamp, data):
+        """Records data sent by the local endpoint."""
+        for offset in range(0, len(data), TCP_MAX_SEGMENT):
+            segment = data[offset:offset + TCP_MAX_SEGMENT]
+            self._write_segment(
+                timestamp, self._local, self._remote, self._local_seq, self._remote_seq, segment)
+            self._local_seq = (self._local_seq + len(segment)) & 0xffffffff
+
+    def _write_segment(self, timestamp, src, dst, seq, ack, payload):
+        src_mac, src_ip, src_port = src
+        dst_mac, dst_ip, dst_port = dst
+        tcp_length = TCP_HEADER_LENGTH + len(payload)
+        if self._ipv6:
+            pseudo_header = struct.pack('!16s16sI3xB', src_ip, dst_ip, tcp_length, IPPROTO_TCP)
+        else:
+            pseudo_header = struct.pack('!4s4sxBH', src_ip, dst_ip, IPPROTO_TCP, tcp_length)
+        tcp_header = struct.pack(
+            '!HHIIBBH', src_port, dst_port, seq, ack, (TCP_HEADER_LENGTH // 4) << 4,
+            TCP_FLAGS_PSH_ACK, TCP_WINDOW)
+        tcp_header += struct.pack(
+            '!HH', internet_checksum(pseudo_header, tcp_header, b'\0\0\0\0', payload), 0)
+
+        if self._ipv6:
+            ethertype = ETHERTYPE_IPV6
+            ip_header = struct.pack(
+                '!IHBB16s16s', 6 << 28, tcp_length, IPPROTO_TCP, IP_TTL, src_ip, dst_ip)
+        else:
+            ethertype = ETHERTYPE_IPV4
+            ip_header = struct.pack(
+                '!BBHHHBB2x4s4s', 0x45, 0, 20 + tcp_length, self._ip_id, 0, IP_TTL, IPPROTO_TCP,
+                src_ip, dst_ip)
+            checksum = struct.pack('!H', internet_checksum(ip_header))
+            ip_header = ip_header[:10] + checksum + ip_header[12:]
+            self._ip_id = (self._ip_id + 1) & 0xffff
+
+        self._writer.write_frame(
+            timestamp, b''.join((dst_mac, src_mac, struct.pack('!H', ethertype), ip_header,
+                                 tcp_header, payload)))
+
+
+# Reads a protobuf varint from a file object, returning None at the end of the file.
+def read_varint(f):
+    value = 0
+    shift = 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            if shift:
+                raise EOFError('truncated length prefix')
+            return None
+        value |= (byte[0] & 0x7f) << shift
+        if not byte[0] & 0x80:
+            return value
+        shift += 7
+
+
+# Yields the TraceWrapper messages of a tap file, reading length delimited streams one message
+# at a time.
+def read_traces(tap_path):
+    if tap_path.endswith(PROTO_TEXT_EXTENSION):
+        wrapper = wrapper_pb2.TraceWrapper()
         with open(tap_path, 'r') as f:
             text_format.Merge(f.read(), wrapper)
+        yield wrapper
+    elif tap_path.endswith(PROTO_BINARY_LENGTH_DELIMITED_EXTENSION):
+        with open(tap_path, 'rb') as f:
+            while True:
+                try:
+                    length = read_varint(f)
+                except EOFError:
+                    length = None
+                if length is None:
+                    return
+                data = f.read(length)
+                if len(data) != length:
+                    # The tap file is still being written, or the writer was interrupted.
+                    print('Ignoring truncated trace at the end of %s' % tap_path, file=sys.stderr)
+                    return
+                wrapper = wrapper_pb2.TraceWrapper()
+                wrapper.ParseFromString(data)
+                yield wrapper
     else:
-        with open(tap_path, 'r') as f:
+        wrapper = wrapper_pb2.TraceWrapper()
+        with open(tap_path, 'rb') as f:
             wrapper.ParseFromString(f.read())
+        yield wrapper
+
+
+# Yields ((seconds, nanos), (tap_path, trace_id), connection, event) for the socket events of a
+# tap file, in file order. Connections are forgotten once they are closed.
+def read_socket_events(tap_path):
+    connections = {}
+    for wrapper in read_traces(tap_path):
+        if wrapper.HasField('socket_buffered_trace'):
+            trace = wrapper.socket_buffered_trace
+            for event in trace.events:
+                yield ((event.timestamp.seconds, event.timestamp.nanos),
+                       (tap_path, trace.trace_id), trace.connection, event)
+        elif wrapper.HasField('socket_streamed_trace_segment'):
+            segment = wrapper.socket_streamed_trace_segment
+            if segment.HasField('connection'):
+                connections[segment.trace_id] = segment.connection
+            elif segment.HasField('event'):
+                event = segment.event
+                yield ((event.timestamp.seconds, event.timestamp.nanos),
+                       (tap_path, segment.trace_id), connections.get(segment.trace_id), event)
+                if event.HasField('closed'):
+                    connections.pop(segment.trace_id, None)
+
+
+# Expands directories into the tap files they contain, in a stable order.
+def find_tap_files(tap_paths):
+    for tap_path in tap_paths:
+        if not os.path.isdir(tap_path):
+            yield tap_path
+            continue
+        for root, dirs, files in os.walk(tap_path):
+            dirs.sort()
+            for name in sorted(files):
+                if name.endswith(TAP_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def tap2pcap(tap_paths, pcap_path):
+    if isinstance(tap_paths, str):
+        tap_paths = [tap_paths]
+    # Each tap file is in timestamp order, so a k-way merge orders the whole capture while only
+    # holding the next event of each file.
+    events = heapq.merge(
+        *(read_socket_events(tap_path) for tap_path in find_tap_files(tap_paths)),
+        key=lambda socket_event: socket_event[0])
 
-    trace = wrapper.socket_buffered_trace
-    local_address = trace.connection.local_address.socket_address.address
-    local_port = trace.connection.local_address.socket_address.port_value
-    remote_address = trace.connection.remote_address.socket_address.address
-    remote_port = trace.connection.remote_address.socket_address.port_value
-
-    dumps = []
-    for event in trace.events:
-        if event.HasField('read'):
-            dumps.append(dump_event('I', event.timestamp, event.read.data.as_bytes))
-        elif event.HasField('write'):
-            dumps.append(dump_event('O', event.timestamp, event.write.data.as_bytes))
-
-    ipv6 = False
-    try:
-        socket.inet_pton(socket.AF_INET6, local_address)
-        ipv6 = True
-    except socket.error:
-        pass
-
-    text2pcap_args = [
-        'text2pcap', '-D', '-t', '%Y-%m-%d %H:%M:%S.', '-6' if ipv6 else '-4',
-        '%s,%s' % (remote_address, local_address), '-T',
-        '%d,%d' % (remote_port, local_port), '-', pcap_path
-    ]
-    text2pcap = sp.Popen(text2pcap_args, stdout=sp.PIPE, stdin=sp.PIPE)
-    text2pcap.communicate('\n'.join(dumps).encode())
+    with open(pcap_path, 'wb') as f:
+        writer = PcapWriter(f)
+        flows = {}
+        for _, flow_key, connection, event in events:
+            flow = flows.get(flow_key)
+            if flow is None:
+                if connection is None:
+                    print(
+                        'Ignoring event of trace %d in %s without a connection' %
+                        (flow_key[1], flow_key[0]),
+                        file=sys.stderr)
+                    continue
+                local_address = connection.local_address.socket_address
+                remote_address = connection.remote_address.socket_address
+                flow = flows[flow_key] = TcpFlow(
+                    writer, remote_address.address, remote_address.port_value,
+                    local_address.address, local_address.port_value)
+            if event.HasField('read'):
+                flow.read(event.timestamp, event.read.data.as_bytes)
+            elif event.HasField('write'):
+                flow.write(event.timestamp, event.write.data.as_bytes)
+            elif event.HasField('closed'):
+                del flows[flow_key]
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print('Usage: %s <tap .pb/.pb_text> <pcap path>' % sys.argv[0])
+    if len(sys.argv) < 3:
+        print(
+            'Usage: %s <tap .pb/.pb_text/.pb_length_delimited or directory>... <pcap path>' %
+            sys.argv[0])
         sys.exit(1)
-    tap2pcap(sys.argv[1], sys.argv[2])
+    tap2pcap(sys.argv[1:-1], sys.argv[-1])
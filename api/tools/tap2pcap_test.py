@@ -1,28 +1,223 @@
 """Tests for tap2pcap."""
 from __future__ import print_function
 
+import ipaddress
 import os
+import shutil
+import struct
 import subprocess as sp
-import sys
+import unittest
+
+from google.protobuf import text_format
+
+from envoy.data.tap.v2alpha import wrapper_pb2
 
 import tap2pcap
 
-# Validate that the tapped trace when run through tap2cap | tshark matches
-# a golden output file for the tshark dump. Since we run tap2pcap in a
-# subshell with a limited environment, the inferred time zone should be UTC.
+SRCDIR = os.path.join(os.getenv('TEST_SRCDIR', ''), 'envoy_api_canonical')
+TAP_PATH = os.path.join(SRCDIR, 'tools/data/tap2pcap_h2_ipv4.pb_text')
+EXPECTED_PATH = os.path.join(SRCDIR, 'tools/data/tap2pcap_h2_ipv4.txt')
+TMPDIR = os.getenv('TEST_TMPDIR')
+
+
+def load_trace(tap_path):
+    wrapper = wrapper_pb2.TraceWrapper()
+    with open(tap_path, 'r') as f:
+        text_format.Merge(f.read(), wrapper)
+    return wrapper
+
+
+# Writes a buffered socket trace as the streamed trace segments of a .pb_length_delimited tap file,
+# each prefixed with its varint length.
+def write_length_delimited(buffered_trace, trace_id, path):
+    segments = [wrapper_pb2.TraceWrapper()]
+    segments[0].socket_streamed_trace_segment.trace_id = trace_id
+    segments[0].socket_streamed_trace_segment.connection.CopyFrom(buffered_trace.connection)
+    for event in buffered_trace.events:
+        segment = wrapper_pb2.TraceWrapper()
+        segment.socket_streamed_trace_segment.trace_id = trace_id
+        segment.socket_streamed_trace_segment.event.CopyFrom(event)
+        segments.append(segment)
+    with open(path, 'wb') as f:
+        for segment in segments:
+            data = segment.SerializeToString()
+            length = len(data)
+            while length > 0x7f:
+                f.write(bytes([length & 0x7f | 0x80]))
+                length >>= 7
+            f.write(bytes([length]))
+            f.write(data)
+
+
+# Returns the (seconds, microseconds, frame) records of a PCAP file.
+def read_pcap(pcap_path):
+    records = []
+    with open(pcap_path, 'rb') as f:
+        f.read(24)
+        while True:
+            header = f.read(16)
+            if not header:
+                return records
+            seconds, micros, captured_length, _ = struct.unpack('<IIII', header)
+            records.append((seconds, micros, f.read(captured_length)))
+
+
+# Returns the TCP (source port, destination port, sequence number) of an Ethernet/IPv4 frame.
+def tcp_ports_and_seq(frame):
+    return struct.unpack('!HHI', frame[14 + 20:14 + 20 + 8])
+
+
+# One's complement sum of 16 bit words, which is 0xffff over a segment with a valid checksum.
+def ones_complement_sum(data):
+    if len(data) % 2:
+        data += b'\0'
+    total = 0
+    for (word,) in struct.iter_unpack('!H', data):
+        total += word
+        total = (total & 0xffff) + (total >> 16)
+    return total
+
+
+class FrameRecorder(object):
+    """tap2pcap.PcapWriter fake."""
+
+    def __init__(self):
+        self.frames = []
+
+    def write_frame(self, timestamp, frame):
+        self.frames.append(frame)
+
+
+def tshark(pcap_path):
+    return sp.check_output(['tshark', '-r', pcap_path, '-d', 'tcp.port==10000,http2', '-P'])
+
+
+class Tap2PcapTest(unittest.TestCase):
+
+    def path(self, name):
+        return os.path.join(TMPDIR, self.id().rsplit('.', 1)[1], name)
+
+    def setUp(self):
+        os.makedirs(self.path(''))
+
+    def tearDown(self):
+        shutil.rmtree(self.path(''))
+
+    # Validate that the tapped trace when run through tap2cap | tshark matches
+    # a golden output file for the tshark dump. The PCAP timestamps are taken
+    # verbatim from the trace, and the golden output only has relative times.
+    @unittest.skipUnless(shutil.which('tshark'), 'tshark is not installed')
+    def test_buffered_trace_matches_golden(self):
+        pcap_path = self.path('generated.pcap')
+        tap2pcap.tap2pcap(TAP_PATH, pcap_path)
+        with open(EXPECTED_PATH, 'rb') as f:
+            self.assertEqual(tshark(pcap_path), f.read())
+
+    def test_length_delimited_trace(self):
+        tap_path = self.path('trace_1.pb_length_delimited')
+        write_length_delimited(load_trace(TAP_PATH).socket_buffered_trace, 1, tap_path)
+        tap2pcap.tap2pcap(tap_path, self.path('streamed.pcap'))
+        tap2pcap.tap2pcap(TAP_PATH, self.path('buffered.pcap'))
+        with open(self.path('streamed.pcap'), 'rb') as streamed, open(self.path('buffered.pcap'),
+                                                                      'rb') as buffered:
+            self.assertEqual(streamed.read(), buffered.read())
+        if shutil.which('tshark'):
+            with open(EXPECTED_PATH, 'rb') as f:
+                self.assertEqual(tshark(self.path('streamed.pcap')), f.read())
+
+    def test_length_delimited_truncated_trace(self):
+        tap_path = self.path('trace_1.pb_length_delimited')
+        write_length_delimited(load_trace(TAP_PATH).socket_buffered_trace, 1, tap_path)
+        with open(tap_path, 'rb') as f:
+            data = f.read()
+        # A tap file still being written ends with a partial message, which is ignored.
+        with open(tap_path, 'wb') as f:
+            f.write(data[:-10])
+        tap2pcap.tap2pcap(tap_path, self.path('truncated.pcap'))
+        self.assertEqual(
+            len(read_pcap(self.path('truncated.pcap'))),
+            len(load_trace(TAP_PATH).socket_buffered_trace.events) - 1)
+
+    def test_directory_of_traces(self):
+        # Two connections, the second from another remote port and 5ms later, so that their events
+        # interleave: one as a streamed trace and the other as a buffered trace.
+        tap_dir = self.path('taps')
+        os.makedirs(tap_dir)
+        first = load_trace(TAP_PATH)
+        write_length_delimited(first.socket_buffered_trace, 1,
+                               os.path.join(tap_dir, 'trace_1.pb_length_delimited'))
+        second = load_trace(TAP_PATH)
+        second.socket_buffered_trace.trace_id = 2
+        second.socket_buffered_trace.connection.remote_address.socket_address.port_value = 53290
+        for event in second.socket_buffered_trace.events:
+            nanos = event.timestamp.nanos + 5000000
+            event.timestamp.seconds += nanos // 1000000000
+            event.timestamp.nanos = nanos % 1000000000
+        with open(os.path.join(tap_dir, 'trace_2.pb_text'), 'w') as f:
+            f.write(text_format.MessageToString(second))
+        with open(os.path.join(tap_dir, 'README'), 'w') as f:
+            f.write('not a tap file\n')
+
+        pcap_path = self.path('merged.pcap')
+        tap2pcap.tap2pcap(tap_dir, pcap_path)
+        merged = read_pcap(pcap_path)
+        separate = []
+        for name in ('trace_1.pb_length_delimited', 'trace_2.pb_text'):
+            tap2pcap.tap2pcap(os.path.join(tap_dir, name), self.path(name + '.pcap'))
+            separate += read_pcap(self.path(name + '.pcap'))
+
+        # The capture holds the packets of both connections, in timestamp order.
+        self.assertEqual(sorted(merged), sorted(separate))
+        timestamps = [(seconds, micros) for seconds, micros, _ in merged]
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual([tcp_ports_and_seq(frame)[0] for _, _, frame in merged[:2]],
+                         [53288, 53290])
+        # Each connection is its own TCP flow, with sequence numbers starting from 1.
+        first_seqs = {}
+        for _, _, frame in merged:
+            src_port, dst_port, seq = tcp_ports_and_seq(frame)
+            first_seqs.setdefault((src_port, dst_port), seq)
+        self.assertEqual(
+            first_seqs, {
+                (53288, 10000): 1,
+                (10000, 53288): 1,
+                (53290, 10000): 1,
+                (10000, 53290): 1
+            })
+
+    def test_ipv6_segment(self):
+        recorder = FrameRecorder()
+        flow = tap2pcap.TcpFlow(recorder, '2001:db8::1', 53288, '2001:db8::2', 10000)
+        flow.read(None, b'hello')
+        flow.write(None, b'world!')
+        remote_ip = ipaddress.IPv6Address('2001:db8::1').packed
+        local_ip = ipaddress.IPv6Address('2001:db8::2').packed
+
+        for frame, src, dst, seq, ack, payload in [
+            (recorder.frames[0], (remote_ip, 53288), (local_ip, 10000), 1, 1, b'hello'),
+            (recorder.frames[1], (local_ip, 10000), (remote_ip, 53288), 1, 6, b'world!'),
+        ]:
+            self.assertEqual(struct.unpack('!H', frame[12:14])[0], tap2pcap.ETHERTYPE_IPV6)
+            ip_header, segment = frame[14:14 + 40], frame[14 + 40:]
+            version_class_flow, payload_length, next_header, hop_limit, src_ip, dst_ip = (
+                struct.unpack('!IHBB16s16s', ip_header))
+            self.assertEqual(version_class_flow, 6 << 28)
+            self.assertEqual(payload_length, len(segment))
+            self.assertEqual(len(segment), 20 + len(payload))
+            self.assertEqual(next_header, 6)
+            self.assertEqual(hop_limit, 64)
+            self.assertEqual((src_ip, dst_ip), (src[0], dst[0]))
+
+            src_port, dst_port, tcp_seq, tcp_ack, offset, flags = struct.unpack(
+                '!HHIIBB', segment[:14])
+            self.assertEqual((src_port, dst_port), (src[1], dst[1]))
+            self.assertEqual((tcp_seq, tcp_ack), (seq, ack))
+            self.assertEqual(offset >> 4, 5)
+            self.assertEqual(flags, 0x18)
+            self.assertEqual(segment[20:], payload)
+            pseudo_header = src_ip + dst_ip + struct.pack('!I3xB', len(segment), 6)
+            self.assertEqual(ones_complement_sum(pseudo_header + segment), 0xffff)
+
+
 if __name__ == '__main__':
-    srcdir = os.path.join(os.getenv('TEST_SRCDIR'), 'envoy_api_canonical')
-    tap_path = os.path.join(srcdir, 'tools/data/tap2pcap_h2_ipv4.pb_text')
-    expected_path = os.path.join(srcdir, 'tools/data/tap2pcap_h2_ipv4.txt')
-    pcap_path = os.path.join(os.getenv('TEST_TMPDIR'), 'generated.pcap')
-
-    tap2pcap.tap2pcap(tap_path, pcap_path)
-    actual_output = sp.check_output(
-        ['tshark', '-r', pcap_path, '-d', 'tcp.port==10000,http2', '-P'])
-    with open(expected_path, 'rb') as f:
-        expected_output = f.read()
-    if actual_output != expected_output:
-        print('Mismatch')
-        print('Expected: %s' % expected_output)
-        print('Actual: %s' % actual_output)
-        sys.exit(1)
+    unittest.main()
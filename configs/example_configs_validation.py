@@ -1,22 +1,144 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
 import pathlib
 import sys
+import time
+from xml.etree import ElementTree
 
 from google.protobuf.json_format import ParseError
 
 sys.path = [p for p in sys.path if not p.endswith('bazel_tools')]
 
-from tools.config_validation.validate_fragment import validate_yaml
+from tools.config_validation.validate_fragment import default_descriptor_path, get_validator
+
+BOOTSTRAP_TYPE = "envoy.config.bootstrap.v3.Bootstrap"
+
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# Validates a single config, returning (path, error or None, seconds). Pool workers are forked
+# after the descriptors are loaded, so they share the parent's validator.
+def validate_path(path):
+    start = time.perf_counter()
+    error = None
+    try:
+        get_validator().validate_yaml(BOOTSTRAP_TYPE, pathlib.Path(path).read_text())
+    except (ParseError, KeyError) as e:
+        error = str(e)
+    return path, error, time.perf_counter() - start
+
+
+def load_report(report_path, descriptor_hash):
+    try:
+        with open(report_path) as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    # Results against other API descriptors can't be reused.
+    if report.get("descriptor") != descriptor_hash:
+        return {}
+    return report.get("files", {})
+
+
+def write_report(report_path, descriptor_hash, results):
+    tmp_path = report_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(descriptor=descriptor_hash, files=results), f, indent=2, sort_keys=True)
+    os.replace(tmp_path, report_path)
+
+
+def write_junit(junit_path, results):
+    suite = ElementTree.Element(
+        "testsuite",
+        name="example_configs_validation",
+        tests=str(len(results)),
+        failures=str(sum(1 for result in results.values() if result["error"] is not None)),
+        skipped=str(sum(1 for result in results.values() if result["cached"])),
+        time="%.3f" % sum(result["time"] for result in results.values()))
+    for path, result in results.items():
+        case = ElementTree.SubElement(
+            suite,
+            "testcase",
+            classname="example_configs_validation",
+            name=path,
+            time="%.3f" % result["time"])
+        if result["error"] is not None:
+            failure = ElementTree.SubElement(case, "failure", message="validation failed")
+            failure.text = result["error"]
+        elif result["cached"]:
+            ElementTree.SubElement(case, "skipped", message="unchanged since the previous report")
+    ElementTree.ElementTree(suite).write(junit_path, encoding="utf-8", xml_declaration=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Validate example configs against the v3 Bootstrap proto.")
+    parser.add_argument(
+        "-j",
+        "--num-workers",
+        type=int,
+        default=1,
+        help="number of worker processes to validate configs with.")
+    parser.add_argument(
+        "--report", help="write a JSON report with per-file results and timings to this path.")
+    parser.add_argument("--junit", help="write a JUnit XML report to this path.")
+    parser.add_argument(
+        "--changed-only",
+        action="store_true",
+        help="only validate configs whose content changed since the previous --report.")
+    parser.add_argument("paths", nargs="*", help="config files to validate.")
+    args = parser.parse_args()
+    if args.changed_only and not args.report:
+        parser.error("--changed-only requires --report")
+    return args
 
 
 def main():
+    args = parse_args()
+    # The descriptors are loaded once for all of the configs, before forking any workers.
+    get_validator()
+    descriptor_hash = content_hash(pathlib.Path(default_descriptor_path()).read_bytes())
+    previous = load_report(args.report, descriptor_hash) if args.changed_only else {}
+
+    results = {}
+    hashes = {}
+    pending = []
+    for path in args.paths:
+        hashes[path] = content_hash(pathlib.Path(path).read_bytes())
+        if path in previous and previous[path]["sha256"] == hashes[path]:
+            results[path] = dict(previous[path], cached=True)
+        else:
+            pending.append(path)
+
+    if args.num_workers > 1 and len(pending) > 1:
+        pool = multiprocessing.get_context("fork").Pool(min(args.num_workers, len(pending)))
+        validated = pool.imap_unordered(validate_path, pending)
+    else:
+        pool = None
+        validated = map(validate_path, pending)
+    for path, error, seconds in validated:
+        results[path] = dict(sha256=hashes[path], error=error, time=seconds, cached=False)
+    if pool:
+        pool.close()
+        pool.join()
+
+    # Report in argument order, independently of completion order.
+    results = {path: results[path] for path in args.paths}
     errors = []
-    for arg in sys.argv[1:]:
-        try:
-            validate_yaml("envoy.config.bootstrap.v3.Bootstrap", pathlib.Path(arg).read_text())
-        except (ParseError, KeyError) as e:
-            errors.append(arg)
-            print(f"\nERROR (validation failed): {arg}\n{e}\n\n")
+    for path, result in results.items():
+        if result["error"] is not None:
+            errors.append(path)
+            print(f"\nERROR (validation failed): {path}\n{result['error']}\n\n")
 
+    if args.report:
+        write_report(args.report, descriptor_hash, results)
+    if args.junit:
+        write_junit(args.junit, results)
     if errors:
         raise SystemExit(f"ERROR: some configuration files ({len(errors)}) failed to validate")
 
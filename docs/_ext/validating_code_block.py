@@ -1,6 +1,9 @@
+import json
 import os
 import subprocess
-from functools import cached_property
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
 
 import yaml
 
@@ -9,12 +12,29 @@ from docutils.parsers.rst import directives
 from sphinx.directives.code import CodeBlock
 from sphinx.errors import ExtensionError
 
+# A validated-code-block collected during the read phase, validated once all documents are read.
+ValidatedBlock = namedtuple('ValidatedBlock', ['docname', 'source', 'line', 'type_name', 'content'])
+
+
+@lru_cache
+def load_configs() -> dict:
+    _configs = dict(
+        descriptor_path="",
+        skip_validation=False,
+        validation_jobs=os.cpu_count() or 1,
+        validator_path="bazel-bin/tools/config_validation/validate_fragment")
+    if os.environ.get("ENVOY_DOCS_BUILD_CONFIG"):
+        with open(os.environ["ENVOY_DOCS_BUILD_CONFIG"]) as f:
+            _configs.update(yaml.safe_load(f.read()))
+    return _configs
+
 
 class ValidatingCodeBlock(CodeBlock):
     """A directive that provides protobuf yaml formatting and validation.
 
     'type-name' option is required and expected to conain full Envoy API type.
-    An ExtensionError is raised on validation failure.
+    Blocks are collected while reading and validated in batches once all documents are read;
+    an ExtensionError listing every failing block is raised on validation failure.
     Validation will be skipped if SPHINX_SKIP_CONFIG_VALIDATION environment variable is set.
     """
     has_content = True
@@ -28,37 +48,12 @@ class ValidatingCodeBlock(CodeBlock):
 
     @cached_property
     def configs(self) -> dict:
-        _configs = dict(
-            descriptor_path="",
-            skip_validation=False,
-            validator_path="bazel-bin/tools/config_validation/validate_fragment")
-        if os.environ.get("ENVOY_DOCS_BUILD_CONFIG"):
-            with open(os.environ["ENVOY_DOCS_BUILD_CONFIG"]) as f:
-                _configs.update(yaml.safe_load(f.read()))
-        return _configs
-
-    @property
-    def descriptor_path(self) -> str:
-        return self.configs["descriptor_path"]
+        return load_configs()
 
     @property
     def skip_validation(self) -> bool:
         return bool(self.configs["skip_validation"])
 
-    @property
-    def validator_args(self) -> tuple:
-        args = (
-            self.options.get('type-name'),
-            '-s',
-            '\n'.join(self.content),
-        )
-        return (
-            args + ("--descriptor_path", self.descriptor_path) if self.descriptor_path else args)
-
-    @property
-    def validator_path(self) -> str:
-        return self.configs["validator_path"]
-
     def run(self):
         source, line = self.state_machine.get_source_and_line(self.lineno)
         # built-in directives.unchanged_required option validator produces a confusing error message
@@ -66,21 +61,78 @@ class ValidatingCodeBlock(CodeBlock):
             raise ExtensionError("Expected type name in: {0} line: {1}".format(source, line))
 
         if not self.skip_validation:
-            completed = subprocess.run((self.validator_path,) + self.validator_args,
-                                       stdout=subprocess.PIPE,
-                                       stderr=subprocess.PIPE,
-                                       encoding='utf-8')
-            if completed.returncode != 0:
-                raise ExtensionError(
-                    "Failed config validation for type: '{0}' in: {1} line: {2}:\n {3}".format(
-                        self.options.get('type-name'), source, line, completed.stderr))
+            env = self.state.document.settings.env
+            if not hasattr(env, 'validated_code_blocks'):
+                env.validated_code_blocks = []
+            env.validated_code_blocks.append(
+                ValidatedBlock(
+                    env.docname, source, line, self.options.get('type-name'),
+                    '\n'.join(self.content)))
 
         self.options.pop('type-name', None)
         return list(super().run())
 
 
+def validate_batch(validator_path: str, descriptor_path: str, blocks: list) -> list:
+    """Validate blocks with a single validate_fragment server, returning (block, error) pairs."""
+    args = [validator_path, "--serve"]
+    if descriptor_path:
+        args += ["--descriptor_path", descriptor_path]
+    requests = "".join(
+        json.dumps(dict(id=n, type_name=block.type_name, content=block.content)) + "\n"
+        for n, block in enumerate(blocks))
+    completed = subprocess.run(
+        args, input=requests, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding='utf-8')
+    responses = [json.loads(line) for line in completed.stdout.splitlines() if line.strip()]
+    if completed.returncode != 0 or len(responses) != len(blocks):
+        raise ExtensionError(
+            "Config validation server {0} failed:\n {1}".format(validator_path, completed.stderr))
+    return [(blocks[response["id"]], response["error"])
+            for response in responses
+            if response["error"] is not None]
+
+
+def validate_blocks(app, env):
+    blocks = getattr(env, 'validated_code_blocks', [])
+    if not blocks:
+        return
+    configs = load_configs()
+    # Each server loads the API descriptors once for its whole batch.
+    jobs = max(1, min(int(configs["validation_jobs"]), len(blocks)))
+    batches = [blocks[n::jobs] for n in range(jobs)]
+    with ThreadPoolExecutor(jobs) as executor:
+        results = executor.map(
+            lambda batch: validate_batch(
+                configs["validator_path"], configs["descriptor_path"], batch), batches)
+        failures = [failure for result in results for failure in result]
+    env.validated_code_blocks = []
+    if failures:
+        failures.sort(key=lambda failure: (failure[0].source or "", failure[0].line or 0))
+        raise ExtensionError(
+            "\n".join(
+                "Failed config validation for type: '{0}' in: {1} line: {2}:\n {3}".format(
+                    block.type_name, block.source, block.line, error)
+                for block, error in failures))
+
+
+def purge_blocks(app, env, docname):
+    if hasattr(env, 'validated_code_blocks'):
+        env.validated_code_blocks = [
+            block for block in env.validated_code_blocks if block.docname != docname
+        ]
+
+
+def merge_blocks(app, env, docnames, other):
+    if not hasattr(env, 'validated_code_blocks'):
+        env.validated_code_blocks = []
+    env.validated_code_blocks.extend(getattr(other, 'validated_code_blocks', []))
+
+
 def setup(app):
     app.add_directive("validated-code-block", ValidatingCodeBlock)
+    app.connect("env-purge-doc", purge_blocks)
+    app.connect("env-merge-info", merge_blocks)
+    app.connect("env-updated", validate_blocks)
 
     return {
         'version': '0.1',
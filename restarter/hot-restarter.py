@@ -1,8 +1,12 @@
-#!/usr/bin/env python
-from __future__ import print_function
+#!/usr/bin/env python3
 
+import argparse
+import http.client
+import json
 import os
+import selectors
 import signal
+import socket
 import sys
 import time
 
@@ -13,196 +17,481 @@ import time
 # constant is smaller than the KILL timeout
 TERM_WAIT_SECONDS = 30
 
-restart_epoch = 0
-pid_list = []
+# The number of most recent epochs reported in the status file.
+STATUS_EPOCHS = 16
 
+# When readiness checking is enabled, the default number of seconds a new epoch has to become
+# ready before the restart is rolled back, how often its admin endpoint is polled until then, and
+# the timeout of each poll.
+READY_TIMEOUT_SECONDS = 60
+READY_POLL_SECONDS = 0.25
+READY_REQUEST_TIMEOUT_SECONDS = 1
 
-def term_all_children():
-    """ Iterate through all known child processes, send a TERM signal to each of
-  them, and then wait up to TERM_WAIT_SECONDS for them to exit gracefully,
-  exiting early if all children go away. If one or more children have not
-  exited after TERM_WAIT_SECONDS, they will be forcibly killed """
+HANDLED_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGCHLD, signal.SIGUSR1)
 
-    # First uninstall the SIGCHLD handler so that we don't get called again.
-    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
 
-    global pid_list
-    for pid in pid_list:
-        print("sending TERM to PID={}".format(pid))
-        try:
-            os.kill(pid, signal.SIGTERM)
-        except OSError:
-            print("error sending TERM to PID={} continuing".format(pid))
-
-    all_exited = False
-
-    # wait for TERM_WAIT_SECONDS seconds for children to exit cleanly
-    retries = 0
-    while not all_exited and retries < TERM_WAIT_SECONDS:
-        for pid in list(pid_list):
-            ret_pid, exit_status = os.waitpid(pid, os.WNOHANG)
-            if ret_pid == 0 and exit_status == 0:
-                # the child is still running
-                continue
-
-            pid_list.remove(pid)
-
-        if len(pid_list) == 0:
-            all_exited = True
-        else:
-            retries += 1
-            time.sleep(1)
-
-    if all_exited:
-        print("all children exited cleanly")
-    else:
-        for pid in pid_list:
-            print("child PID={} did not exit cleanly, killing".format(pid))
-        force_kill_all_children()
-        sys.exit(1)  # error status because a child did not exit cleanly
-
-
-def force_kill_all_children():
-    """ Iterate through all known child processes and force kill them. Typically
-  term_all_children() should be attempted first to give child processes an
-  opportunity to clean up state before exiting """
-
-    global pid_list
-    for pid in pid_list:
-        print("force killing PID={}".format(pid))
-        try:
-            os.kill(pid, signal.SIGKILL)
-        except OSError:
-            print("error force killing PID={} continuing".format(pid))
-
-    pid_list = []
-
-
-def shutdown():
-    """ Attempt to gracefully shutdown all child Envoy processes and then exit.
-  See term_all_children() for further discussion. """
-    term_all_children()
-    sys.exit(0)
-
-
-def sigterm_handler(signum, frame):
-    """ Handler for SIGTERM. """
-    print("got SIGTERM")
-    shutdown()
-
-
-def sigint_handler(signum, frame):
-    """ Handler for SIGINT (ctrl-c). The same as the SIGTERM handler. """
-    print("got SIGINT")
-    shutdown()
-
-
-def sighup_handler(signum, frame):
-    """ Handler for SIGHUP. This signal is used to cause the restarter to fork and exec a new
-      child. """
-
-    print("got SIGHUP")
-    fork_and_exec()
+class ReadinessProbe(object):
+    """ Checks whether an epoch is serving, through the admin endpoint at a fixed host:port or at
+      the address Envoy writes to its --admin-address-path. Until the new epoch takes over the admin
+      listener the address is still served by the previous epoch, so /server_info has to report
+      the new restart epoch before /ready is trusted. """
 
+    def __init__(self, admin_address=None, admin_address_path=None):
+        self._admin_address = admin_address
+        self._admin_address_path = admin_address_path
 
-def sigusr1_handler(signum, frame):
-    """ Handler for SIGUSR1. Propagate SIGUSR1 to all of the child processes """
+    def _address(self):
+        address = self._admin_address
+        if address is None:
+            with open(self._admin_address_path) as f:
+                address = f.read().strip()
+        host, port = address.rsplit(':', 1)
+        return host.strip('[]'), int(port)
 
-    global pid_list
-    for pid in pid_list:
-        print("sending SIGUSR1 to PID={}".format(pid))
+    def is_ready(self, restart_epoch):
+        connection = None
         try:
-            os.kill(pid, signal.SIGUSR1)
-        except OSError:
-            print("error in SIGUSR1 to PID={} continuing".format(pid))
-
-
-def sigchld_handler(signum, frame):
-    """ Handler for SIGCHLD. Iterates through all of our known child processes and figures out whether
-      the signal/exit was expected or not. Python doesn't have any of the native signal handlers
-      ability to get the child process info directly from the signal handler so we need to iterate
-      through all child processes and see what happened."""
-
-    print("got SIGCHLD")
-
-    kill_all_and_exit = False
-    global pid_list
-    pid_list_copy = list(pid_list)
-    for pid in pid_list_copy:
-        ret_pid, exit_status = os.waitpid(pid, os.WNOHANG)
-        if ret_pid == 0 and exit_status == 0:
-            # This child is still running.
-            continue
-
-        pid_list.remove(pid)
-
-        # Now we see how the child exited.
-        if os.WIFEXITED(exit_status):
-            exit_code = os.WEXITSTATUS(exit_status)
-            print("PID={} exited with code={}".format(ret_pid, exit_code))
-            if exit_code == 0:
-                # Normal exit. We assume this was on purpose.
-                pass
+            host, port = self._address()
+            connection = http.client.HTTPConnection(
+                host, port, timeout=READY_REQUEST_TIMEOUT_SECONDS)
+            connection.request('GET', '/server_info')
+            response = connection.getresponse()
+            server_info = json.loads(response.read())
+            if response.status != 200 or int(
+                    server_info['command_line_options']['restart_epoch']) != restart_epoch:
+                return False
+            connection.request('GET', '/ready')
+            response = connection.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, ValueError, KeyError, TypeError, http.client.HTTPException):
+            return False
+        finally:
+            if connection is not None:
+                connection.close()
+
+
+class Epoch(object):
+    """ A child process started by the restarter, and the times of its lifecycle events. Times are
+      from time.monotonic(), except for the wall clock start time reported in the status. """
+
+    def __init__(self, epoch, pid):
+        self.epoch = epoch
+        self.pid = pid
+        self.started = time.time()
+        self.forked_at = time.monotonic()
+        self.ready_at = None
+        # When the next epoch was forked, or became ready when readiness checking is enabled, after
+        # which this one drains and exits.
+        self.superseded_at = None
+        self.term_sent_at = None
+        self.exited_at = None
+        self.exit_status = None
+        # Set when the epoch didn't become ready in time and was stopped, leaving the previous
+        # epochs serving.
+        self.rolled_back = False
+        self.kill_sent = False
+
+    def status(self):
+
+        def seconds(start, end):
+            if start is None or end is None:
+                return None
+            return round(end - start, 6)
+
+        return {
+            'epoch': self.epoch,
+            'pid': self.pid,
+            'started': self.started,
+            'running': self.exited_at is None,
+            'exit_status': self.exit_status,
+            'rolled_back': self.rolled_back,
+            'ready_seconds': seconds(self.forked_at, self.ready_at),
+            'uptime_seconds': seconds(self.forked_at, self.exited_at or time.monotonic()),
+            'drain_seconds': seconds(self.superseded_at, self.exited_at),
+            'shutdown_seconds': seconds(self.term_sent_at, self.exited_at),
+        }
+
+
+class HotRestarter(object):
+    """ Runs the start script as a child process, hot restarting it on SIGHUP. Signal handlers only
+      wake up the event loop in run(), which reacts to signals and child exits as they happen.
+
+      With a readiness probe, a restart is in progress until the new epoch is ready: SIGHUPs
+      received meanwhile are coalesced into a single restart once it completes, and an epoch that
+      isn't ready within the ready timeout is stopped while the previous epochs keep serving. """
+
+    def __init__(
+            self,
+            start_script,
+            status_path=None,
+            readiness_probe=None,
+            ready_timeout=READY_TIMEOUT_SECONDS):
+        self._start_script = start_script
+        self._status_path = status_path
+        self._readiness_probe = readiness_probe
+        self._ready_timeout = ready_timeout
+        self._restart_epoch = 0
+        # Running children by PID, and the most recent epochs for the status file.
+        self._children = {}
+        self._epochs = []
+        # The epoch waiting to become ready, whether another restart was requested meanwhile, and
+        # when to poll its readiness next.
+        self._restarting = None
+        self._restart_pending = False
+        self._next_poll_at = None
+
+        # Python runs signal handlers in the main thread between bytecodes, and writes the signal
+        # number to the wakeup fd as soon as the signal arrives, so the handlers don't need to do
+        # anything but ensure the signals are delivered.
+        self._wakeup_recv, self._wakeup_send = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        self._wakeup_send.setblocking(False)
+        signal.set_wakeup_fd(self._wakeup_send.fileno())
+        for signum in HANDLED_SIGNALS:
+            signal.signal(signum, lambda signum, frame: None)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+
+    def wait_for_signals(self, timeout=None):
+        """ Block until signals arrive or the timeout expires, returning the signal numbers. """
+        signums = []
+        if self._selector.select(timeout):
+            while True:
+                try:
+                    data = self._wakeup_recv.recv(4096)
+                except BlockingIOError:
+                    break
+                signums.extend(data)
+        return signums
+
+    def write_status(self):
+        """ Atomically replace the status file with the timings of the most recent epochs. """
+        if not self._status_path:
+            return
+        status = {
+            'restarter_pid': os.getpid(),
+            'start_script': self._start_script,
+            'next_restart_epoch': self._restart_epoch,
+            'restart_in_progress': self._restarting is not None,
+            'restart_pending': self._restart_pending,
+            'epochs': [epoch.status() for epoch in self._epochs],
+        }
+        tmp_path = self._status_path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(status, f, indent=2)
+            os.replace(tmp_path, self._status_path)
+        except OSError as e:
+            print("error writing status to {}: {}".format(self._status_path, e))
+
+    def reap_children(self):
+        """ Reap all of the children that have exited, returning their epochs. """
+        exited = []
+        while self._children:
+            try:
+                pid, exit_status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            epoch = self._children.pop(pid, None)
+            if epoch is None:
+                continue
+            epoch.exited_at = time.monotonic()
+            epoch.exit_status = exit_status
+            exited.append(epoch)
+        if exited:
+            self.write_status()
+        return exited
+
+    def term_all_children(self):
+        """ Iterate through all known child processes, send a TERM signal to each of
+      them, and then wait up to TERM_WAIT_SECONDS for them to exit gracefully,
+      exiting early as soon as all children go away. If one or more children have not
+      exited after TERM_WAIT_SECONDS, they will be forcibly killed """
+
+        for pid, epoch in self._children.items():
+            print("sending TERM to PID={}".format(pid))
+            epoch.term_sent_at = time.monotonic()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                print("error sending TERM to PID={} continuing".format(pid))
+
+        # Wait for the children to exit cleanly; every exit wakes us up with a SIGCHLD.
+        deadline = time.monotonic() + TERM_WAIT_SECONDS
+        self.reap_children()
+        while self._children and time.monotonic() < deadline:
+            self.wait_for_signals(deadline - time.monotonic())
+            self.reap_children()
+
+        if not self._children:
+            print("all children exited cleanly")
+        else:
+            for pid in self._children:
+                print("child PID={} did not exit cleanly, killing".format(pid))
+            self.force_kill_all_children()
+            sys.exit(1)  # error status because a child did not exit cleanly
+
+    def force_kill_all_children(self):
+        """ Iterate through all known child processes and force kill them. Typically
+      term_all_children() should be attempted first to give child processes an
+      opportunity to clean up state before exiting """
+
+        for pid in self._children:
+            print("force killing PID={}".format(pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                print("error force killing PID={} continuing".format(pid))
+        self._children = {}
+        self.write_status()
+
+    def shutdown(self):
+        """ Attempt to gracefully shutdown all child Envoy processes and then exit.
+      See term_all_children() for further discussion. """
+        self.term_all_children()
+        sys.exit(0)
+
+    def forward_signal(self, signum):
+        """ Propagate a signal to all of the child processes. """
+        for pid in self._children:
+            print("sending {} to PID={}".format(signal.Signals(signum).name, pid))
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                print("error in {} to PID={} continuing".format(signal.Signals(signum).name, pid))
+
+    def handle_child_exits(self):
+        """ Figures out whether the exits of the children that went away were expected or not. """
+
+        kill_all_and_exit = False
+        for epoch in self.reap_children():
+            if epoch.rolled_back:
+                print("rolled back PID={} exited".format(epoch.pid))
+                continue
+            if epoch is self._restarting and self._children:
+                # The new epoch failed to start, but the previous ones are still serving.
+                self.roll_back(
+                    epoch, "exited with status={} before becoming ready".format(epoch.exit_status))
+                continue
+            # Now we see how the child exited.
+            exit_status = epoch.exit_status
+            if os.WIFEXITED(exit_status):
+                exit_code = os.WEXITSTATUS(exit_status)
+                print("PID={} exited with code={}".format(epoch.pid, exit_code))
+                if exit_code == 0:
+                    # Normal exit. We assume this was on purpose.
+                    pass
+                else:
+                    # Something bad happened. We need to tear everything down so that whoever started the
+                    # restarter can know about this situation and restart the whole thing.
+                    kill_all_and_exit = True
+            elif os.WIFSIGNALED(exit_status):
+                print(
+                    "PID={} was killed with signal={}".format(epoch.pid, os.WTERMSIG(exit_status)))
+                kill_all_and_exit = True
             else:
-                # Something bad happened. We need to tear everything down so that whoever started the
-                # restarter can know about this situation and restart the whole thing.
                 kill_all_and_exit = True
-        elif os.WIFSIGNALED(exit_status):
-            print("PID={} was killed with signal={}".format(ret_pid, os.WTERMSIG(exit_status)))
-            kill_all_and_exit = True
-        else:
-            kill_all_and_exit = True
-
-    if kill_all_and_exit:
-        print("Due to abnormal exit, force killing all child processes and exiting")
 
-        # First uninstall the SIGCHLD handler so that we don't get called again.
-        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        if kill_all_and_exit:
+            print("Due to abnormal exit, force killing all child processes and exiting")
+            self.force_kill_all_children()
 
-        force_kill_all_children()
+        # Our last child died, so we have no purpose. Exit.
+        if not self._children:
+            print("exiting due to lack of child processes")
+            sys.exit(1 if kill_all_and_exit else 0)
 
-    # Our last child died, so we have no purpose. Exit.
-    if not pid_list:
-        print("exiting due to lack of child processes")
-        sys.exit(1 if kill_all_and_exit else 0)
+        # The exited children may have been what a pending restart was waiting for.
+        self.start_pending_restart()
 
-
-def fork_and_exec():
-    """ This routine forks and execs a new child process and keeps track of its PID. Before we fork,
+    def fork_and_exec(self):
+        """ This routine forks and execs a new child process and keeps track of its PID. Before we fork,
       set the current restart epoch in an env variable that processes can read if they care. """
 
-    global restart_epoch
-    os.environ['RESTART_EPOCH'] = str(restart_epoch)
-    print("forking and execing new child process at epoch {}".format(restart_epoch))
-    restart_epoch += 1
+        os.environ['RESTART_EPOCH'] = str(self._restart_epoch)
+        print("forking and execing new child process at epoch {}".format(self._restart_epoch))
+
+        child_pid = os.fork()
+        if child_pid == 0:
+            # Child process
+            os.execl(self._start_script, self._start_script)
 
-    child_pid = os.fork()
-    if child_pid == 0:
-        # Child process
-        os.execl(sys.argv[1], sys.argv[1])
-    else:
         # Parent process
         print("forked new child process with PID={}".format(child_pid))
-        pid_list.append(child_pid)
+        epoch = Epoch(self._restart_epoch, child_pid)
+        if self._readiness_probe is None:
+            self.supersede_children(epoch, epoch.forked_at)
+        else:
+            self._restarting = epoch
+            self._next_poll_at = epoch.forked_at + READY_POLL_SECONDS
+        self._restart_epoch += 1
+        self._children[child_pid] = epoch
+        self._epochs = (self._epochs + [epoch])[-STATUS_EPOCHS:]
+        self.write_status()
+
+    def supersede_children(self, new_epoch, superseded_at):
+        """ Mark the running children other than the new epoch as draining in favor of it. """
+        for epoch in self._children.values():
+            if epoch.superseded_at is None and epoch is not new_epoch:
+                epoch.superseded_at = superseded_at
+
+    def check_restart(self):
+        """ Poll the readiness of the epoch being restarted into, completing the restart once it is
+      ready and rolling it back if it isn't ready within the ready timeout. """
+
+        epoch = self._restarting
+        if epoch is None or time.monotonic() < self._next_poll_at:
+            return
+        if self._readiness_probe.is_ready(epoch.epoch):
+            epoch.ready_at = time.monotonic()
+            print(
+                "PID={} ready after {:.3f}s".format(epoch.pid, epoch.ready_at - epoch.forked_at))
+            # Only now do the previous epochs start draining.
+            self.supersede_children(epoch, epoch.ready_at)
+            self.finish_restart()
+        elif time.monotonic() - epoch.forked_at >= self._ready_timeout:
+            reason = "not ready after {}s".format(self._ready_timeout)
+            if len(self._children) > 1:
+                self.roll_back(epoch, reason)
+            else:
+                # There is nothing to roll back to, so keep the first epoch running.
+                print("PID={} {}".format(epoch.pid, reason))
+                self.finish_restart()
+        else:
+            self._next_poll_at = time.monotonic() + READY_POLL_SECONDS
+
+    def roll_back(self, epoch, reason):
+        """ Stop an epoch that didn't become ready, leaving the previous epochs serving. """
+
+        print("rolling back epoch {} PID={}: {}".format(epoch.epoch, epoch.pid, reason))
+        epoch.rolled_back = True
+        # The previous epoch is still the hot restart parent, so the next restart reuses the epoch,
+        # once this child has exited and released it.
+        self._restart_epoch = epoch.epoch
+        if epoch.exited_at is None:
+            print("sending TERM to PID={}".format(epoch.pid))
+            epoch.term_sent_at = time.monotonic()
+            try:
+                os.kill(epoch.pid, signal.SIGTERM)
+            except OSError:
+                print("error sending TERM to PID={} continuing".format(epoch.pid))
+        self.finish_restart()
+
+    def finish_restart(self):
+        """ End the restart in progress, starting the restart requested meanwhile if any. """
+        self._restarting = None
+        self.write_status()
+        self.start_pending_restart()
+
+    def restart_blocker(self):
+        """ The epoch a new restart has to wait for: the restart in progress, a rolled back child
+      that still holds the restart epoch the next restart reuses or, with a readiness probe, a
+      superseded epoch that is still draining, so that at most two epochs overlap. """
+        if self._restarting is not None:
+            return self._restarting
+        for epoch in self._children.values():
+            if epoch.rolled_back or (self._readiness_probe is not None and
+                                     epoch.superseded_at is not None):
+                return epoch
+        return None
+
+    def start_pending_restart(self):
+        """ Start the restart requested while another was in progress, once nothing blocks it. """
+        if self._restart_pending and self.restart_blocker() is None:
+            self._restart_pending = False
+            print("restarting again for the SIGHUPs received while waiting")
+            self.fork_and_exec()
+
+    def kill_rolled_back_children(self):
+        """ Force kill the rolled back children that didn't exit within TERM_WAIT_SECONDS. """
+        for epoch in self._children.values():
+            if (epoch.rolled_back and not epoch.kill_sent and
+                    time.monotonic() - epoch.term_sent_at >= TERM_WAIT_SECONDS):
+                print("rolled back PID={} did not exit cleanly, killing".format(epoch.pid))
+                epoch.kill_sent = True
+                try:
+                    os.kill(epoch.pid, signal.SIGKILL)
+                except OSError:
+                    print("error force killing PID={} continuing".format(epoch.pid))
+
+    def next_timeout(self):
+        """ Seconds until the event loop has to poll readiness or kill a rolled back child. """
+        deadlines = [
+            epoch.term_sent_at + TERM_WAIT_SECONDS
+            for epoch in self._children.values()
+            if epoch.rolled_back and not epoch.kill_sent
+        ]
+        if self._restarting is not None:
+            deadlines.append(self._next_poll_at)
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+    def handle_signal(self, signum):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            # SIGINT (ctrl-c) is handled the same as SIGTERM.
+            print("got {}".format(signal.Signals(signum).name))
+            self.shutdown()
+        elif signum == signal.SIGHUP:
+            # SIGHUP is used to cause the restarter to fork and exec a new child.
+            print("got SIGHUP")
+            blocker = self.restart_blocker()
+            if blocker is None:
+                self.fork_and_exec()
+            else:
+                print(
+                    "waiting for epoch {} PID={}, restarting again once it is done".format(
+                        blocker.epoch, blocker.pid))
+                self._restart_pending = True
+                self.write_status()
+        elif signum == signal.SIGUSR1:
+            self.forward_signal(signal.SIGUSR1)
+        elif signum == signal.SIGCHLD:
+            print("got SIGCHLD")
+            self.handle_child_exits()
+
+    def run(self):
+        """ Start the first child process and then handle signals as they arrive. """
+        print("starting hot-restarter with target: {}".format(self._start_script))
+        self.fork_and_exec()
+        while True:
+            for signum in self.wait_for_signals(self.next_timeout()):
+                self.handle_signal(signum)
+            self.kill_rolled_back_children()
+            self.check_restart()
 
 
 def main():
     """ Script main. This script is designed so that a process watcher like runit or monit can watch
       this process and take corrective action if it ever goes away. """
 
-    print("starting hot-restarter with target: {}".format(sys.argv[1]))
-
-    signal.signal(signal.SIGTERM, sigterm_handler)
-    signal.signal(signal.SIGINT, sigint_handler)
-    signal.signal(signal.SIGHUP, sighup_handler)
-    signal.signal(signal.SIGCHLD, sigchld_handler)
-    signal.signal(signal.SIGUSR1, sigusr1_handler)
-
-    # Start the first child process and then go into an endless loop since everything else happens via
-    # signals.
-    fork_and_exec()
-    while True:
-        time.sleep(60)
+    parser = argparse.ArgumentParser(description='Hot restart wrapper for Envoy.')
+    parser.add_argument(
+        '--status-path',
+        help='path of a JSON file to keep updated with the timings of the most recent epochs.')
+    ready_group = parser.add_mutually_exclusive_group()
+    ready_group.add_argument(
+        '--admin-address',
+        help='host:port of the Envoy admin endpoint; restarts wait for the new epoch to be /ready.')
+    ready_group.add_argument(
+        '--admin-address-path',
+        help='file Envoy writes its admin address to (its --admin-address-path); restarts wait '
+        'for the new epoch to be /ready.')
+    parser.add_argument(
+        '--ready-timeout',
+        type=float,
+        default=READY_TIMEOUT_SECONDS,
+        help='seconds a new epoch has to become ready before the restart is rolled back.')
+    parser.add_argument('start_script', help='script that execs Envoy at $RESTART_EPOCH.')
+    args = parser.parse_args()
+
+    readiness_probe = None
+    if args.admin_address or args.admin_address_path:
+        readiness_probe = ReadinessProbe(args.admin_address, args.admin_address_path)
+    HotRestarter(args.start_script, args.status_path, readiness_probe, args.ready_timeout).run()
 
 
 if __name__ == '__main__':
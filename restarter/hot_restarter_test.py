@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""Tests for hot-restarter.py"""
+
+import http.server
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+RESTARTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hot-restarter.py')
+_spec = importlib.util.spec_from_file_location('hot_restarter', RESTARTER_PATH)
+hot_restarter = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(hot_restarter)
+
+# How long to wait for the restarter to react to a signal or a child exit.
+WAIT_SECONDS = 10
+
+# A child that runs until sent SIGTERM, recording its PID once it handles SIGTERM. While
+# hold_<epoch> exists in its directory it keeps running after SIGTERM, like an Envoy that is slow
+# to shut down.
+START_SCRIPT = """#!/bin/sh
+trap 'while [ -e "{directory}/hold_$RESTART_EPOCH" ]; do sleep 0.05; done; exit 0' TERM
+echo $$ > "{directory}/pid_$RESTART_EPOCH.tmp"
+mv "{directory}/pid_$RESTART_EPOCH.tmp" "{directory}/pid_$RESTART_EPOCH"
+while :; do sleep 0.05; done
+"""
+
+
+class FakeAdminHandler(http.server.BaseHTTPRequestHandler):
+    """Serves /server_info and /ready as the most recent epoch marked ready by the test."""
+
+    def do_GET(self):
+        ready_epochs = self.server.ready_epochs
+        if not ready_epochs:
+            self.send_error(503)
+            return
+        if self.path == '/server_info':
+            body = json.dumps({'command_line_options': {'restart_epoch': max(ready_epochs)}})
+        elif self.path == '/ready':
+            body = 'LIVE'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HotRestarterTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self._restarter = None
+        self._status_path = self.path('status.json')
+        self._start_script = self.path('start_envoy.sh')
+        with open(self._start_script, 'w') as f:
+            f.write(START_SCRIPT.format(directory=self._tmp.name))
+        os.chmod(self._start_script, 0o755)
+
+    def tearDown(self):
+        # Release and stop whatever a failed test left behind.
+        for name in os.listdir(self._tmp.name):
+            if name.startswith('hold_'):
+                os.remove(self.path(name))
+        if self._restarter is not None and self._restarter.poll() is None:
+            self._restarter.kill()
+            self._restarter.wait()
+        for name in os.listdir(self._tmp.name):
+            if name.startswith('pid_') and not name.endswith('.tmp'):
+                try:
+                    os.kill(self.child_pid(int(name[len('pid_'):])), signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def path(self, name):
+        return os.path.join(self._tmp.name, name)
+
+    def child_pid(self, epoch):
+        with open(self.path('pid_%d' % epoch)) as f:
+            return int(f.read())
+
+    def wait_for_child(self, epoch):
+        """Wait until the most recent child of an epoch handles SIGTERM, returning its PID."""
+        pid = [status['pid'] for status in self.read_status()['epochs']
+               if status['epoch'] == epoch][-1]
+        deadline = time.monotonic() + WAIT_SECONDS
+        while not os.path.exists(self.path('pid_%d' % epoch)) or self.child_pid(epoch) != pid:
+            self.assertLess(time.monotonic(), deadline, 'epoch %d did not start' % epoch)
+            time.sleep(0.05)
+        return pid
+
+    def start_restarter(self, *args):
+        with open(self.path('restarter.log'), 'w') as log:
+            self._restarter = subprocess.Popen(
+                [sys.executable, RESTARTER_PATH, '--status-path', self._status_path] +
+                list(args) + [self._start_script],
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                env=dict(os.environ, PYTHONUNBUFFERED='1'))
+        return self.wait_for_status(lambda status: status['epochs'])
+
+    def start_admin_server(self):
+        server = http.server.HTTPServer(('127.0.0.1', 0), FakeAdminHandler)
+        server.ready_epochs = set()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def signal_restarter(self, signum):
+        self._restarter.send_signal(signum)
+
+    def read_status(self):
+        try:
+            with open(self._status_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def wait_for_status(self, predicate):
+        deadline = time.monotonic() + WAIT_SECONDS
+        while time.monotonic() < deadline:
+            status = self.read_status()
+            if status is not None and predicate(status):
+                return status
+            time.sleep(0.05)
+        with open(self.path('restarter.log')) as f:
+            self.fail('timed out waiting for the restarter, status:\n%s\nlog:\n%s' %
+                      (json.dumps(self.read_status(), indent=2), f.read()))
+
+    def wait_for_exit(self):
+        start = time.monotonic()
+        exit_code = self._restarter.wait(WAIT_SECONDS)
+        return exit_code, time.monotonic() - start
+
+    def test_sighup_and_sigterm(self):
+        status = self.start_restarter()
+        self.assertEqual([epoch['epoch'] for epoch in status['epochs']], [0])
+
+        self.signal_restarter(signal.SIGHUP)
+        status = self.wait_for_status(lambda status: len(status['epochs']) == 2)
+        self.assertEqual([epoch['epoch'] for epoch in status['epochs']], [0, 1])
+        self.assertEqual(status['next_restart_epoch'], 2)
+        self.assertTrue(all(epoch['running'] for epoch in status['epochs']))
+
+        self.wait_for_child(0)
+        self.wait_for_child(1)
+        self.signal_restarter(signal.SIGTERM)
+        exit_code, elapsed = self.wait_for_exit()
+        self.assertEqual(exit_code, 0)
+        self.assertLess(elapsed, hot_restarter.TERM_WAIT_SECONDS / 2)
+
+        epochs = self.read_status()['epochs']
+        self.assertFalse(any(epoch['running'] for epoch in epochs))
+        self.assertEqual([epoch['exit_status'] for epoch in epochs], [0, 0])
+        self.assertTrue(all(epoch['shutdown_seconds'] is not None for epoch in epochs))
+        # Without a readiness probe the previous epoch drains from the time the next one is forked.
+        self.assertIsNotNone(epochs[0]['drain_seconds'])
+        self.assertIsNone(epochs[1]['drain_seconds'])
+
+    def test_readiness_coalesces_restarts_and_rolls_back(self):
+        admin = self.start_admin_server()
+        self.start_restarter(
+            '--admin-address', '127.0.0.1:%d' % admin.server_port, '--ready-timeout', '1')
+        admin.ready_epochs.add(0)
+        self.wait_for_status(lambda status: not status['restart_in_progress'])
+
+        # SIGHUPs received while epoch 1 isn't ready are coalesced into a single restart.
+        self.signal_restarter(signal.SIGHUP)
+        self.wait_for_status(lambda status: status['restart_in_progress'])
+        self.signal_restarter(signal.SIGHUP)
+        self.signal_restarter(signal.SIGHUP)
+        status = self.wait_for_status(lambda status: status['restart_pending'])
+        self.assertEqual([epoch['epoch'] for epoch in status['epochs']], [0, 1])
+
+        # Once epoch 1 is ready, the pending restart waits for the draining epoch 0 to exit.
+        admin.ready_epochs.add(1)
+        status = self.wait_for_status(lambda status: not status['restart_in_progress'])
+        self.assertTrue(status['restart_pending'])
+        self.assertEqual([epoch['epoch'] for epoch in status['epochs']], [0, 1])
+        self.assertIsNotNone(status['epochs'][1]['ready_seconds'])
+        # Epoch 2 will never become ready, and will be slow to exit once rolled back.
+        with open(self.path('hold_2'), 'w'):
+            pass
+        os.kill(self.wait_for_child(0), signal.SIGTERM)
+        status = self.wait_for_status(lambda status: len(status['epochs']) == 3)
+        self.assertEqual([epoch['running'] for epoch in status['epochs']], [False, True, True])
+        self.assertIsNotNone(status['epochs'][0]['drain_seconds'])
+        self.assertFalse(status['restart_pending'])
+
+        # A restart requested while the rolled back epoch 2 is still exiting reuses its epoch, but
+        # only once it has exited.
+        self.wait_for_child(2)
+        status = self.wait_for_status(lambda status: status['epochs'][2]['rolled_back'])
+        self.assertEqual(status['next_restart_epoch'], 2)
+        self.signal_restarter(signal.SIGHUP)
+        status = self.wait_for_status(lambda status: status['restart_pending'])
+        self.assertEqual(len(status['epochs']), 3)
+        self.assertTrue(status['epochs'][2]['running'])
+        os.remove(self.path('hold_2'))
+        status = self.wait_for_status(lambda status: len(status['epochs']) == 4)
+        self.assertFalse(status['epochs'][2]['running'])
+        self.assertEqual(status['epochs'][3]['epoch'], 2)
+        self.assertFalse(status['epochs'][3]['rolled_back'])
+        self.assertTrue(status['restart_in_progress'])
+
+        admin.ready_epochs.add(2)
+        self.wait_for_status(lambda status: not status['restart_in_progress'])
+        self.wait_for_child(1)
+        self.wait_for_child(2)
+        self.signal_restarter(signal.SIGTERM)
+        exit_code, _ = self.wait_for_exit()
+        self.assertEqual(exit_code, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,7 +53,7 @@ def api_proto_plugin_impl(target, ctx, output_group, mnemonic, output_suffixes):
     args += ["-I" + import_path for import_path in import_paths]
     args += ["--plugin=protoc-gen-api_proto_plugin=" + ctx.executable._api_proto_plugin.path, "--api_proto_plugin_out=" + output_path]
     if hasattr(ctx.attr, "_type_db"):
-        inputs = depset(transitive = [inputs] + [ctx.attr._type_db.files])
+        inputs = depset(transitive = [inputs, ctx.attr._type_db.files, ctx.attr._type_db[OutputGroupInfo].pb_index])
         if len(ctx.attr._type_db.files.to_list()) != 1:
             fail("{} must have one type database file".format(ctx.attr._type_db))
         args.append("--api_proto_plugin_opt=type_db_path=" + ctx.attr._type_db.files.to_list()[0].path)
@@ -2,10 +2,13 @@
 
 import cProfile
 from collections import namedtuple
+import hashlib
 import io
+import multiprocessing
 import os
 import pstats
 import sys
+import tempfile
 
 from tools.api_proto_plugin import traverse
 
@@ -26,12 +29,187 @@ OutputDescriptor = namedtuple(
         # Supply --//tools/api_proto_plugin CLI args as a parameters dictionary
         # to visitor_factory constructor and xform function?
         'want_params',
-    ])
+        # Paths of the data files, e.g. runfiles, that the visitor or xform read. Their
+        # content is part of the result cache key of the outputs.
+        'key_files',
+    ],
+    defaults=[()])
 
 
-def direct_output_descriptor(output_suffix, visitor, want_params=False):
+def direct_output_descriptor(output_suffix, visitor, want_params=False, key_files=()):
     return OutputDescriptor(
-        output_suffix, visitor, (lambda x, _: x) if want_params else lambda x: x, want_params)
+        output_suffix, visitor, (lambda x, _: x) if want_params else lambda x: x, want_params,
+        key_files)
+
+
+# Directory of the content-addressed result cache; caching is disabled when unset. Bazel
+# actions see it when passed with --action_env=API_PROTO_PLUGIN_CACHE_DIR=<absolute path>.
+CACHE_DIR_ENV = 'API_PROTO_PLUGIN_CACHE_DIR'
+
+
+# Hash of the Python sources the plugin is running, i.e. the plugin, its visitors and transforms
+# and everything they import. Any change to these invalidates previously cached results.
+def tool_version():
+    h = hashlib.sha256()
+    for name, module in sorted(sys.modules.copy().items()):
+        path = getattr(module, '__file__', None)
+        if not path or not path.endswith('.py') or not os.path.isfile(path):
+            continue
+        h.update(name.encode())
+        with open(path, 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """Content-addressed cache of plugin outputs.
+
+    An output is keyed by the serialized FileDescriptorProto, the output suffix, the content of
+    the output descriptor's key_files, the plugin parameters and the tool version. Parameters
+    naming a file, e.g. type_db_path, are keyed by the file's content rather than its (sandbox
+    specific) path.
+    """
+
+    def __init__(self, cache_dir, params):
+        self._cache_dir = cache_dir
+        h = hashlib.sha256(tool_version().encode())
+        for name, value in sorted(params.items()):
+            h.update(('%s=%s\0' % (name, value)).encode())
+            if os.path.isfile(value):
+                with open(value, 'rb') as f:
+                    h.update(hashlib.sha256(f.read()).digest())
+        self._base = h.digest()
+        self._file_digests = {}
+
+    def _file_digest(self, path):
+        if path not in self._file_digests:
+            with open(path, 'rb') as f:
+                self._file_digests[path] = hashlib.sha256(f.read()).digest()
+        return self._file_digests[path]
+
+    def key(self, file_proto, od):
+        h = hashlib.sha256(self._base)
+        h.update(od.output_suffix.encode() + b'\0')
+        for path in od.key_files:
+            h.update(self._file_digest(path))
+        h.update(file_proto.SerializeToString(deterministic=True))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key[:2], key)
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                content = f.read().decode('utf-8')
+        except (OSError, UnicodeDecodeError):
+            return None
+        return content
+
+    def put(self, key, content):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Concurrent protoc actions may store the same key; write atomically.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content.encode('utf-8'))
+            os.replace(tmp_path, path)
+        except OSError:
+            # The cache is an optimization only.
+            pass
+
+
+def generate(file_proto, od, params):
+    """Generate the content of a single output descriptor for a FileDescriptorProto."""
+    if params is not None and od.want_params:
+        xformed_proto = od.xform(file_proto, params)
+        visitor_factory = od.visitor_factory(params)
+    else:
+        xformed_proto = od.xform(file_proto)
+        visitor_factory = od.visitor_factory()
+    return traverse.traverse_file(xformed_proto, visitor_factory) if xformed_proto else ''
+
+
+# Number of worker processes to generate outputs with; outputs are generated in the
+# plugin process when unset or 1.
+JOBS_ENV = 'API_PROTO_PLUGIN_JOBS'
+
+# State of generate_parallel(), inherited by forked pool workers as output descriptors
+# hold closures that can't be pickled.
+_parallel_state = None
+
+
+class ProfileStats(object):
+    """Picklable cProfile results, usable as a pstats.Stats source."""
+
+    def __init__(self, profile):
+        profile.create_stats()
+        self.stats = profile.stats
+
+    def create_stats(self):
+        pass
+
+
+def _generate_job(job):
+    file_protos, output_descriptors, params, cprofile_enabled = _parallel_state
+    file_index, od_index = job
+    if cprofile_enabled:
+        pr = cProfile.Profile()
+        pr.enable()
+    content = generate(file_protos[file_index], output_descriptors[od_index], params)
+    if cprofile_enabled:
+        pr.disable()
+        return content, ProfileStats(pr)
+    return content, None
+
+
+def generate_parallel(file_protos, output_descriptors, params, cache, jobs, cprofile_enabled):
+    """Generate the outputs of (file, output descriptor) pairs on a pool of worker processes.
+
+    Args:
+        file_protos: a list of FileDescriptorProtos to generate.
+        output_descriptors: a list of OutputDescriptors.
+        params: plugin parameters dictionary or None.
+        cache: ResultCache or None.
+        jobs: maximum number of worker processes.
+        cprofile_enabled: profile the generation of each output?
+
+    Returns:
+        A dict from (file index, output descriptor index) to generated content and a dict
+        from file index to the ProfileStats of its generated outputs.
+    """
+    global _parallel_state
+    generated = {}
+    profiles = {}
+    pending = []
+    keys = {}
+    for file_index, file_proto in enumerate(file_protos):
+        # Don't run API proto plugins on things like WKT types etc.
+        if not file_proto.package.startswith('envoy.'):
+            continue
+        for od_index, od in enumerate(output_descriptors):
+            job = (file_index, od_index)
+            if cache is not None:
+                keys[job] = cache.key(file_proto, od)
+                content = cache.get(keys[job])
+                if content is not None:
+                    generated[job] = content
+                    continue
+            pending.append(job)
+    if not pending:
+        return generated, profiles
+
+    _parallel_state = (file_protos, output_descriptors, params, cprofile_enabled)
+    with multiprocessing.get_context('fork').Pool(min(jobs, len(pending))) as pool:
+        for job, (content, profile) in zip(pending, pool.imap(_generate_job, pending)):
+            generated[job] = content
+            if cache is not None:
+                cache.put(keys[job], content)
+            if profile is not None:
+                profiles.setdefault(job[0], []).append(profile)
+    _parallel_state = None
+    return generated, profiles
 
 
 # TODO(phlax): make this into a class
@@ -52,36 +230,55 @@ def plugin(output_descriptors):
     request.ParseFromString(sys.stdin.buffer.read())
     response = plugin_pb2.CodeGeneratorResponse()
     cprofile_enabled = os.getenv('CPROFILE_ENABLED')
+    params = None
+    if request.HasField("parameter"):
+        params = dict(param.split('=') for param in request.parameter.split(','))
+    cache = None
+    if os.getenv(CACHE_DIR_ENV):
+        cache = ResultCache(os.getenv(CACHE_DIR_ENV), params or {})
 
     # We use request.file_to_generate rather than request.file_proto here since we
     # are invoked inside a Bazel aspect, each node in the DAG will be visited once
     # by the aspect and we only want to generate docs for the current node.
-    for file_to_generate in request.file_to_generate:
-        # Find the FileDescriptorProto for the file we actually are generating.
-        file_proto = [pf for pf in request.proto_file if pf.name == file_to_generate][0]
+    proto_files = {pf.name: pf for pf in request.proto_file}
+    # Find the FileDescriptorProtos for the files we actually are generating.
+    file_protos = [proto_files[file_to_generate] for file_to_generate in request.file_to_generate]
+    generated = {}
+    profiles = {}
+    jobs = int(os.getenv(JOBS_ENV, '1'))
+    if jobs > 1:
+        generated, profiles = generate_parallel(
+            file_protos, output_descriptors, params, cache, jobs, cprofile_enabled)
+
+    for file_index, file_proto in enumerate(file_protos):
         if cprofile_enabled:
             pr = cProfile.Profile()
             pr.enable()
-        for od in output_descriptors:
+        for od_index, od in enumerate(output_descriptors):
             f = response.file.add()
             f.name = file_proto.name + od.output_suffix
             # Don't run API proto plugins on things like WKT types etc.
             if not file_proto.package.startswith('envoy.'):
                 continue
-            if request.HasField("parameter") and od.want_params:
-                params = dict(param.split('=') for param in request.parameter.split(','))
-                xformed_proto = od.xform(file_proto, params)
-                visitor_factory = od.visitor_factory(params)
-            else:
-                xformed_proto = od.xform(file_proto)
-                visitor_factory = od.visitor_factory()
-            f.content = traverse.traverse_file(
-                xformed_proto, visitor_factory) if xformed_proto else ''
+            if (file_index, od_index) in generated:
+                f.content = generated[(file_index, od_index)]
+                continue
+            if cache is None:
+                f.content = generate(file_proto, od, params)
+                continue
+            key = cache.key(file_proto, od)
+            content = cache.get(key)
+            if content is None:
+                content = generate(file_proto, od, params)
+                cache.put(key, content)
+            f.content = content
         if cprofile_enabled:
             pr.disable()
             stats_stream = io.StringIO()
+            # Outputs generated by pool workers are profiled there.
             ps = pstats.Stats(
-                pr, stream=stats_stream).sort_stats(os.getenv('CPROFILE_SORTBY', 'cumulative'))
+                *profiles.get(file_index, [pr]),
+                stream=stats_stream).sort_stats(os.getenv('CPROFILE_SORTBY', 'cumulative'))
             stats_file = response.file.add()
             stats_file.name = file_proto.name + '.profile'
             ps.print_stats()
@@ -24,56 +24,83 @@ class Comment(object):
             annotations.xform_annotation(self.raw, annotation_xforms), self.file_level_annotations)
 
 
+class _LocationComments(object):
+    """Comments of a SourceCodeInfo.Location, precomputed when indexing."""
+
+    __slots__ = ('location', 'leading_detached_comments', 'trailing_comment', 'leading_comment')
+
+    def __init__(self, location):
+        self.location = location
+        self.leading_detached_comments = []
+        self.trailing_comment = location.trailing_comments
+        # Comment object, created on first lookup as annotation parsing may fail.
+        self.leading_comment = None
+
+
 class SourceCodeInfo(object):
     """Wrapper for SourceCodeInfo proto."""
 
     def __init__(self, name, source_code_info):
         self.name = name
         self.proto = source_code_info
-        # Map from path to SourceCodeInfo.Location
-        self._locations = {str(location.path): location for location in self.proto.location}
+        # Map from path tuple to _LocationComments, built on first lookup since
+        # users like merge_active_shadow rewrite location paths before that.
+        self._index = None
         self._file_level_comments = None
         self._file_level_annotations = None
 
+    def _build_index(self):
+        index = {}
+        # The file level comment is the earliest detached comment, i.e. the
+        # detached comments of the first location with the lowest start line.
+        file_level_location = None
+        for location in self.proto.location:
+            index[tuple(location.path)] = _LocationComments(location)
+            if location.leading_detached_comments and (
+                    file_level_location is None
+                    or location.span[0] < file_level_location.span[0]):
+                file_level_location = location
+        self._file_level_comments = [] if file_level_location is None else (
+            file_level_location.leading_detached_comments)
+        for comments in index.values():
+            detached = comments.location.leading_detached_comments
+            if detached and detached != self._file_level_comments:
+                comments.leading_detached_comments = detached
+        self._index = index
+
+    def _lookup(self, path):
+        if self._index is None:
+            self._build_index()
+        return self._index.get(tuple(path), None)
+
     @property
     def file_level_comments(self):
         """Obtain inferred file level comment."""
-        if self._file_level_comments:
-            return self._file_level_comments
-        comments = []
-        # We find the earliest detached comment by first finding the maximum start
-        # line for any location and then scanning for any earlier locations with
-        # detached comments.
-        earliest_detached_comment = max(location.span[0] for location in self.proto.location) + 1
-        for location in self.proto.location:
-            if location.leading_detached_comments and location.span[0] < earliest_detached_comment:
-                comments = location.leading_detached_comments
-                earliest_detached_comment = location.span[0]
-        self._file_level_comments = comments
-        return comments
+        if self._index is None:
+            self._build_index()
+        return self._file_level_comments
 
     @property
     def file_level_annotations(self):
         """Obtain inferred file level annotations."""
-        if self._file_level_annotations:
-            return self._file_level_annotations
-        self._file_level_annotations = dict(
-            sum([
-                list(annotations.extract_annotations(c).items()) for c in self.file_level_comments
-            ], []))
+        if self._file_level_annotations is None:
+            self._file_level_annotations = {}
+            for c in self.file_level_comments:
+                self._file_level_annotations.update(annotations.extract_annotations(c))
         return self._file_level_annotations
 
     def location_path_lookup(self, path):
         """Lookup SourceCodeInfo.Location by path in SourceCodeInfo.
 
         Args:
-            path: a list of path indexes as per
+            path: a list or tuple of path indexes as per
               https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto#L717.
 
         Returns:
             SourceCodeInfo.Location object if found, otherwise None.
         """
-        return self._locations.get(str(path), None)
+        comments = self._lookup(path)
+        return None if comments is None else comments.location
 
     # TODO(htuch): consider integrating comment lookup with overall
     # FileDescriptorProto, perhaps via two passes.
@@ -81,46 +108,45 @@ class SourceCodeInfo(object):
         """Lookup leading comment by path in SourceCodeInfo.
 
         Args:
-            path: a list of path indexes as per
+            path: a list or tuple of path indexes as per
                https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto#L717.
 
         Returns:
             Comment object.
         """
-        location = self.location_path_lookup(path)
-        if location is not None:
-            return Comment(location.leading_comments, self.file_level_annotations)
-        return Comment('')
+        comments = self._lookup(path)
+        if comments is None:
+            return Comment('')
+        if comments.leading_comment is None:
+            comments.leading_comment = Comment(
+                comments.location.leading_comments, self.file_level_annotations)
+        return comments.leading_comment
 
     def leading_detached_comments_path_lookup(self, path):
         """Lookup leading detached comments by path in SourceCodeInfo.
 
         Args:
-            path: a list of path indexes as per
+            path: a list or tuple of path indexes as per
                https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto#L717.
 
         Returns:
             List of detached comment strings.
         """
-        location = self.location_path_lookup(path)
-        if location is not None and location.leading_detached_comments != self.file_level_comments:
-            return location.leading_detached_comments
-        return []
+        comments = self._lookup(path)
+        return [] if comments is None else comments.leading_detached_comments
 
     def trailing_comment_path_lookup(self, path):
         """Lookup trailing comment by path in SourceCodeInfo.
 
         Args:
-            path: a list of path indexes as per
+            path: a list or tuple of path indexes as per
                https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto#L717.
 
         Returns:
             Raw detached comment string
         """
-        location = self.location_path_lookup(path)
-        if location is not None:
-            return location.trailing_comments
-        return ''
+        comments = self._lookup(path)
+        return '' if comments is None else comments.trailing_comment
 
 
 class TypeContext(object):
@@ -134,10 +160,10 @@ class TypeContext(object):
         # SourceCodeInfo as per
         # https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto.
         self.source_code_info = source_code_info
-        # path: a list of path indexes as per
+        # path: a tuple of path indexes as per
         #  https://github.com/google/protobuf/blob/a08b03d4c00a5793b88b494f672513f6ad46a681/src/google/protobuf/descriptor.proto#L717.
         #  Extended as nested objects are traversed.
-        self.path = []
+        self.path = ()
         # Message/enum/field name. Extended as nested objects are traversed.
         self.name = name
         # Map from type name to the correct type annotation string, e.g. from
@@ -176,7 +202,7 @@ class TypeContext(object):
             name: message name.
             deprecated: is the message depreacted?
         """
-        return self._extend([4, index], 'message', name, deprecated)
+        return self._extend((4, index), 'message', name, deprecated)
 
     def extend_nested_message(self, index, name, deprecated):
         """Extend type context with a nested message.
@@ -186,7 +212,7 @@ class TypeContext(object):
             name: message name.
             deprecated: is the message depreacted?
         """
-        return self._extend([3, index], 'message', name, deprecated)
+        return self._extend((3, index), 'message', name, deprecated)
 
     def extend_field(self, index, name):
         """Extend type context with a field.
@@ -195,7 +221,7 @@ class TypeContext(object):
             index: field index in message.
             name: field name.
         """
-        return self._extend([2, index], 'field', name)
+        return self._extend((2, index), 'field', name)
 
     def extend_enum(self, index, name, deprecated):
         """Extend type context with an enum.
@@ -205,7 +231,7 @@ class TypeContext(object):
             name: enum name.
             deprecated: is the message depreacted?
         """
-        return self._extend([5, index], 'enum', name, deprecated)
+        return self._extend((5, index), 'enum', name, deprecated)
 
     def extend_service(self, index, name):
         """Extend type context with a service.
@@ -214,7 +240,7 @@ class TypeContext(object):
             index: service index in file.
             name: service name.
         """
-        return self._extend([6, index], 'service', name)
+        return self._extend((6, index), 'service', name)
 
     def extend_nested_enum(self, index, name, deprecated):
         """Extend type context with a nested enum.
@@ -224,7 +250,7 @@ class TypeContext(object):
       name: enum name.
       deprecated: is the message depreacted?
     """
-        return self._extend([4, index], 'enum', name, deprecated)
+        return self._extend((4, index), 'enum', name, deprecated)
 
     def extend_enum_value(self, index, name):
         """Extend type context with an enum enum.
@@ -233,7 +259,7 @@ class TypeContext(object):
             index: enum value index in enum.
             name: value name.
         """
-        return self._extend([2, index], 'enum_value', name)
+        return self._extend((2, index), 'enum_value', name)
 
     def extend_oneof(self, index, name):
         """Extend type context with an oneof declaration.
@@ -242,7 +268,7 @@ class TypeContext(object):
             index: oneof index in oneof_decl.
             name: oneof name.
         """
-        return self._extend([8, index], 'oneof', name)
+        return self._extend((8, index), 'oneof', name)
 
     def extend_method(self, index, name):
         """Extend type context with a service method declaration.
@@ -251,7 +277,7 @@ class TypeContext(object):
             index: method index in service.
             name: method name.
         """
-        return self._extend([2, index], 'method', name)
+        return self._extend((2, index), 'method', name)
 
     @property
     def location(self):
@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 
 import argparse
+import collections
 import common
+import difflib
 import functools
+import hashlib
+import header_order
+import json
 import multiprocessing
 import os
 import os.path
@@ -11,6 +16,7 @@ import re
 import subprocess
 import stat
 import sys
+import time
 import traceback
 import shutil
 import paths
@@ -164,7 +170,10 @@ BUILDIFIER_PATH = paths.get_buildifier()
 BUILDOZER_PATH = paths.get_buildozer()
 ENVOY_BUILD_FIXER_PATH = os.path.join(
     os.path.dirname(os.path.abspath(sys.argv[0])), "envoy_build_fixer.py")
-HEADER_ORDER_PATH = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "header_order.py")
+# Maximum number of files passed to a single clang-format invocation when fixing.
+CLANG_FORMAT_BATCH_SIZE = 200
+# Maximum number of files checked by a pool worker per task.
+CHECK_FORMAT_BATCH_SIZE = 64
 SUBDIR_SET = set(common.include_dir_order())
 INCLUDE_ANGLE = "#include <"
 INCLUDE_ANGLE_LEN = len(INCLUDE_ANGLE)
@@ -271,8 +280,90 @@ UNSORTED_FLAGS = {
   "envoy.reloadable_features.upstream_http2_flood_checks",
   "envoy.reloadable_features.header_map_correctly_coalesce_cookies",
 }
+
+# Every check in check_source_line fires only on lines containing one of these tokens, so a
+# single scan for them finds all the lines worth checking. check_format_test_helper.py runs the
+# checks over every line of the test data and fails on any failing line these tokens miss, so a new
+# check needs a token here and a failing sample in tools/testdata/check_format.
+SOURCE_LINE_TOKENS = (
+    ".  ", "\"x-envoy-", "#include <", "/_virtual_includes/", "\"google/protobuf",
+    "google::protobuf", "RealTimeSource", "RealTimeSystem", "std::chrono::system_clock::now",
+    "std::chrono::steady_clock::now", "std::this_thread::sleep_for", ".waitFor(", "uration(",
+    "Registry::RegisterFactory<", "REGISTER_FACTORY", "UnpackTo", "std::get_time",
+    "std::put_time", "gmtime", "mktime", "localtime", "strftime", "strptime", "strerror",
+    "std::unordered_map", "std::unordered_set", "std::atomic_", "std::any", "std::get_if",
+    "std::holds_alternative", "std::make_optional", "std::monostate", "std::optional",
+    "std::string_view", "toStdStringView", "std::variant", "std::visit", " try {",
+    "__attribute__((packed))", " ?: ", "using testing::Test", "TEST", "MOCK_METHOD",
+    "for_each_n(", "SerializeAsString", "JsonStringToMessage", "FromString(", "envoy::",
+    "HISTOGRAM(", "std::regex", "grpc_init()", "grpc_shutdown()", "memcpy(", "throw",
+    "lua_pushlightuserdata", "min_bytes") + tuple(PROTOBUF_TYPE_ERRORS) + tuple(
+        LIBCXX_REPLACEMENTS) + tuple(CODE_CONVENTION_REPLACEMENTS)
 # yapf: enable
 
+SOURCE_LINE_CANDIDATE_REGEX = re.compile(
+    "|".join([re.escape(token) for token in SOURCE_LINE_TOKENS]
+             + [DESIGNATED_INITIALIZER_REGEX.pattern]))
+
+
+# Returns the hex digest of the contents of the given file.
+def content_hash(file_path):
+    return hashlib.sha256(pathlib.Path(file_path).read_bytes()).hexdigest()
+
+
+class FormatCache:
+    """Persistent record of the files that last passed check_format, keyed by content hash.
+
+    Entries are only trusted when the fingerprint of the checker (its rule tables, sources,
+    arguments and external tool versions) matches the one they were recorded with. A record made
+    by a 'check' run is not trusted by a 'fix' run, since fixing may rewrite files that pass the
+    check (e.g. buildifier lint fixes).
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("fingerprint") == fingerprint:
+                self.entries = data.get("files", {})
+        except (IOError, ValueError):
+            pass
+
+    def is_clean(self, file_path, operation_type):
+        entry = self.entries.get(file_path)
+        if entry is not None and entry[0] == content_hash(file_path) and (
+                operation_type == "check" or entry[1] == "fix"):
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    # Records the result of checking a file. Only files without errors are cached; the contents
+    # are hashed after the check so that files rewritten by 'fix' are recorded as fixed.
+    def record(self, file_path, operation_type, error_messages):
+        if error_messages or not os.path.isfile(file_path):
+            self.entries.pop(file_path, None)
+        else:
+            self.entries[file_path] = [content_hash(file_path), operation_type]
+
+    def save(self):
+        self.entries = {k: v for k, v in self.entries.items() if os.path.isfile(k)}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "files": self.entries}, f)
+        os.replace(tmp_path, self.path)
+
+    def summary(self):
+        return "check_format cache: %d hits, %d misses" % (self.hits, self.misses)
+
 
 class FormatChecker:
 
@@ -294,6 +385,9 @@ class FormatChecker:
             "./tools/clang_tools",
         ]
         self.include_dir_order = args.include_dir_order
+        # Set once fix_source_paths has been run over the source files, so that check_format
+        # only checks them.
+        self.source_fixes_batched = False
 
     # Map a line transformation function across each line of a file,
     # writing the result lines as requested.
@@ -543,13 +637,39 @@ class FormatChecker:
                     error_messages.append("%s and %s are out of order\n" % (line, previous_flag))
             previous_flag = line
 
-    def check_file_contents(self, file_path, checker):
+    # Returns the numbers of the lines in text that contain a match for candidate_regex, in a
+    # single scan of the whole text. Each line is reported at most once.
+    def candidate_lines(self, text, candidate_regex):
+        line_numbers = set()
+        line_number = 0
+        line_start = 0
+        match = candidate_regex.search(text)
+        while match:
+            line_number += text.count("\n", line_start, match.start())
+            line_numbers.add(line_number)
+            line_start = text.find("\n", match.start())
+            if line_start == -1:
+                break
+            match = candidate_regex.search(text, line_start + 1)
+            line_number += 1
+            line_start += 1
+        return line_numbers
+
+    # Runs checker over the lines of a file. If candidate_regex is given, only lines matching it
+    # are passed to checker.
+    def check_file_contents(self, file_path, checker, candidate_regex=None):
         error_messages = []
         if file_path.endswith("source/common/runtime/runtime_features.cc"):
             # Do runtime alphabetical order checks.
             self.check_runtime_flags(file_path, error_messages)
 
+        candidates = None
+        if candidate_regex is not None:
+            candidates = self.candidate_lines(self.read_file(file_path), candidate_regex)
+
         def check_format_errors(line, line_number):
+            if candidates is not None and line_number not in candidates:
+                return
 
             def report_error(message):
                 error_messages.append("%s:%d: %s" % (file_path, line_number + 1, message))
@@ -954,15 +1074,12 @@ class FormatChecker:
         return error_messages
 
     def check_source_path(self, file_path):
-        error_messages = self.check_file_contents(file_path, self.check_source_line)
+        error_messages = self.check_file_contents(
+            file_path, self.check_source_line, SOURCE_LINE_CANDIDATE_REGEX)
 
         if not file_path.endswith(PROTO_SUFFIX):
             error_messages += self.check_namespace(file_path)
-            command = (
-                "%s --include_dir_order %s --path %s | diff %s -" %
-                (HEADER_ORDER_PATH, self.include_dir_order, file_path, file_path))
-            error_messages += self.execute_command(
-                command, "header_order.py check failed", file_path)
+            error_messages += self.check_header_order(file_path)
         command = ("%s %s | diff %s -" % (CLANG_FORMAT_PATH, file_path, file_path))
         error_messages += self.execute_command(command, "clang-format check failed", file_path)
 
@@ -997,10 +1114,31 @@ class FormatChecker:
                     error_messages.append("  %s:%s" % (file_path, num))
             return error_messages
 
+    def reorder_headers(self, file_path):
+        return header_order.reorder_headers(file_path, self.include_dir_order.split(","))
+
+    # Reports the lines at which the header order differs, in the same way as execute_command
+    # does for a diff against header_order.py output.
+    def check_header_order(self, file_path):
+        source = self.read_file(file_path)
+        reordered = self.reorder_headers(file_path)
+        if reordered == source:
+            return []
+        error_messages = ["header_order.py check failed for file: %s" % file_path]
+        matcher = difflib.SequenceMatcher(
+            None, source.split("\n"), reordered.split("\n"), autojunk=False)
+        for tag, i1, _, _, _ in matcher.get_opcodes():
+            if tag != "equal":
+                error_messages.append("  %s:%d" % (file_path, i1 if tag == "insert" else i1 + 1))
+        return error_messages
+
     def fix_header_order(self, file_path):
-        command = "%s --rewrite --include_dir_order %s --path %s" % (
-            HEADER_ORDER_PATH, self.include_dir_order, file_path)
-        if os.system(command) != 0:
+        try:
+            source = self.read_file(file_path)
+            reordered = self.reorder_headers(file_path)
+            if reordered != source:
+                pathlib.Path(file_path).write_text(reordered, encoding='utf-8')
+        except (OSError, UnicodeError):
             return ["header_order.py rewrite error: %s" % (file_path)]
         return []
 
@@ -1010,6 +1148,37 @@ class FormatChecker:
             return ["clang-format rewrite error: %s" % (file_path)]
         return []
 
+    # Runs a single clang-format over all of the given files. If that fails, the files are
+    # formatted one at a time to find the ones in error.
+    def clang_format_batch(self, file_paths):
+        if subprocess.call([CLANG_FORMAT_PATH, "-i"] + file_paths) == 0:
+            return []
+        return sum((self.clang_format(file_path) for file_path in file_paths), [])
+
+    # Batched equivalent of fix_source_path over a list of non-BUILD files, with one clang-format
+    # invocation per CLANG_FORMAT_BATCH_SIZE files.
+    def fix_source_paths(self, file_paths):
+        error_messages = []
+        for file_path in file_paths:
+            self.evaluate_lines(file_path, self.fix_source_line)
+            if not file_path.endswith(PROTO_SUFFIX):
+                error_messages += self.fix_header_order(file_path)
+        for i in range(0, len(file_paths), CLANG_FORMAT_BATCH_SIZE):
+            error_messages += self.clang_format_batch(file_paths[i:i + CLANG_FORMAT_BATCH_SIZE])
+        for file_path in file_paths:
+            if file_path.endswith(PROTO_SUFFIX) and self.is_api_file(file_path):
+                package_name, error_message = self.package_name_for_proto(file_path)
+                if package_name is None:
+                    error_messages += error_message
+        return error_messages
+
+    def fix_source_paths_return_trace_on_error(self, file_paths):
+        """Run fix_source_paths and return the traceback of any exception."""
+        try:
+            return self.fix_source_paths(file_paths)
+        except:
+            return traceback.format_exc().split("\n")
+
     def check_format(self, file_path):
         error_messages = []
         # Apply fixes first, if asked, and then run checks. If we wind up attempting to fix
@@ -1021,7 +1190,7 @@ class FormatChecker:
                 error_messages += self.fix_build_path(file_path)
             error_messages += self.check_build_path(file_path)
         else:
-            if try_to_fix:
+            if try_to_fix and not self.source_fixes_batched:
                 error_messages += self.fix_source_path(file_path)
             error_messages += self.check_source_path(file_path)
 
@@ -1029,6 +1198,53 @@ class FormatChecker:
             return ["From %s" % file_path] + error_messages
         return error_messages
 
+    # Returns a digest of everything that can change the outcome of check_format on an unchanged
+    # file: the rule tables, the checker sources, the arguments and the external tool versions.
+    def fingerprint(self):
+
+        def tool_version(path):
+            try:
+                return subprocess.check_output([path, "--version"],
+                                               stderr=subprocess.STDOUT).decode("utf-8")
+            except (OSError, subprocess.CalledProcessError):
+                return ""
+
+        rules = [
+            PROTOBUF_TYPE_ERRORS,
+            LIBCXX_REPLACEMENTS,
+            CODE_CONVENTION_REPLACEMENTS,
+            GOOGLE_PROTOBUF_ALLOWLIST,
+            REAL_TIME_ALLOWLIST,
+            REGISTER_FACTORY_TEST_ALLOWLIST,
+            SERIALIZE_AS_STRING_ALLOWLIST,
+            JSON_STRING_TO_MESSAGE_ALLOWLIST,
+            HISTOGRAM_WITH_SI_SUFFIX_ALLOWLIST,
+            STD_REGEX_ALLOWLIST,
+            GRPC_INIT_ALLOWLIST,
+            MEMCPY_WHITELIST,
+            EXCEPTION_DENYLIST,
+            RAW_TRY_ALLOWLIST,
+            STD_STRING_VIEW_ALLOWLIST,
+            EXCEPTION_ALLOWLIST,
+            BUILD_URLS_ALLOWLIST,
+            sorted(UNSORTED_FLAGS),
+            self.api_prefix,
+            self.api_shadow_root,
+            self.envoy_build_rule_check,
+            self.namespace_check,
+            self.namespace_check_excluded_paths,
+            self.build_fixer_check_excluded_paths,
+            self.include_dir_order,
+            tool_version(CLANG_FORMAT_PATH),
+            tool_version(BUILDIFIER_PATH),
+        ]
+        digest = hashlib.sha256(repr(rules).encode("utf-8"))
+        for source in (os.path.abspath(__file__), os.path.abspath(header_order.__file__),
+                       ENVOY_BUILD_FIXER_PATH):
+            if os.path.isfile(source):
+                digest.update(pathlib.Path(source).read_bytes())
+        return digest.hexdigest()
+
     def check_format_return_trace_on_error(self, file_path):
         """Run check_format and return the traceback of any exception."""
         try:
@@ -1067,21 +1283,19 @@ class FormatChecker:
         return error_messages
 
     def check_format_visitor(self, arg, dir_name, names):
-        """Run check_format in parallel for the given files.
+        """Collect the given files to be checked and check directory ownership.
     Args:
-      arg: a tuple (pool, result_list, owned_directories, error_messages)
-        pool and result_list are for starting tasks asynchronously.
+      arg: a tuple (file_paths, owned_directories, error_messages)
+        file_paths collects the paths of the files to run check_format on.
         owned_directories tracks directories listed in the CODEOWNERS file.
         error_messages is a list of string format errors.
       dir_name: the parent directory of the given files.
       names: a list of file names.
     """
 
-        # Unpack the multiprocessing.Pool process pool and list of results. Since
-        # python lists are passed as references, this is used to collect the list of
-        # async results (futures) from running check_format and passing them back to
-        # the caller.
-        pool, result_list, owned_directories, error_messages = arg
+        # Unpack the list of file paths. Since python lists are passed as references, this is
+        # used to pass the files to check back to the caller, which schedules them on the pool.
+        file_paths, owned_directories, error_messages = arg
 
         # Sanity check CODEOWNERS.  This doesn't need to be done in a multi-threaded
         # manner as it is a small and limited list.
@@ -1100,15 +1314,7 @@ class FormatChecker:
             top_level = pathlib.PurePath('/', *pathlib.PurePath(dir_name).parts[:2], '/')
             self.check_owners(str(top_level), owned_directories, error_messages)
 
-        for file_name in names:
-            if dir_name.startswith("./api") and self.is_starlark_file(file_name):
-                result = pool.apply_async(
-                    self.check_api_shadow_starlark_files,
-                    args=(dir_name + "/" + file_name, error_messages))
-                result_list.append(result)
-            result = pool.apply_async(
-                self.check_format_return_trace_on_error, args=(dir_name + "/" + file_name,))
-            result_list.append(result)
+        file_paths.extend(dir_name + "/" + file_name for file_name in names)
 
     # check_error_messages iterates over the list with error messages and prints
     # errors and returns a bool based on whether there were any errors.
@@ -1123,6 +1329,75 @@ class FormatChecker:
         return file_path in MEMCPY_WHITELIST
 
 
+# The FormatChecker of a pool worker. It is set once per worker by init_worker, rather than
+# being pickled with every task.
+worker_format_checker = None
+
+
+def init_worker(format_checker):
+    global worker_format_checker
+    worker_format_checker = format_checker
+
+
+# Runs fix_source_paths over a batch of files in a pool worker. Returns the worker pid, the time
+# spent and the error messages.
+def fix_batch(file_paths):
+    start = time.monotonic()
+    error_messages = worker_format_checker.fix_source_paths_return_trace_on_error(file_paths)
+    return os.getpid(), time.monotonic() - start, error_messages
+
+
+# Runs check_format over a batch of files in a pool worker. Returns the worker pid, the time spent
+# and a (file_path, error_messages, seconds) tuple per file.
+def check_batch(file_paths):
+    start = time.monotonic()
+    results = []
+    for file_path in file_paths:
+        file_start = time.monotonic()
+        error_messages = []
+        if file_path.startswith("./api") and worker_format_checker.is_starlark_file(file_path):
+            error_messages += worker_format_checker.check_api_shadow_starlark_files(file_path, [])
+        error_messages += worker_format_checker.check_format_return_trace_on_error(file_path)
+        results.append((file_path, error_messages, time.monotonic() - file_start))
+    return os.getpid(), time.monotonic() - start, results
+
+
+# Splits the files into batches, largest files first. Batches shrink along with the remaining work,
+# so that workers taking batches from the pool's queue as they go idle finish close together.
+def size_ordered_batches(file_paths, num_workers, max_batch_size):
+    file_paths = sorted(file_paths, key=os.path.getsize, reverse=True)
+    batches = []
+    start = 0
+    while start < len(file_paths):
+        batch_size = max(1, min(max_batch_size, (len(file_paths) - start) // (num_workers * 4)))
+        batches.append(file_paths[start:start + batch_size])
+        start += batch_size
+    return batches
+
+
+class PoolProfile:
+    """Busy time of each pool worker and time spent on each checked file during one pooled run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.workers = collections.defaultdict(lambda: [0, 0.0])
+        self.file_times = []
+
+    def add_batch(self, pid, seconds, file_times=()):
+        self.workers[pid][0] += 1
+        self.workers[pid][1] += seconds
+        self.file_times.extend(file_times)
+
+    def report(self):
+        lines = ["check_format workers (%s, %.2fs wall):" % (self.name, self.wall_time)]
+        for pid, (batches, busy) in sorted(self.workers.items()):
+            lines.append(
+                "  pid %d: %d batches, %.2fs busy, %.0f%% utilization" %
+                (pid, batches, busy, 100 * busy / self.wall_time if self.wall_time else 0))
+        return lines
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Check or fix file format.")
     parser.add_argument(
@@ -1183,6 +1458,18 @@ if __name__ == "__main__":
         type=str,
         default=",".join(common.include_dir_order()),
         help="specify the header block include directory order.")
+    parser.add_argument(
+        "--cache-path",
+        type=str,
+        default=None,
+        help="path of a persistent cache of files that passed; unchanged files are skipped. "
+        "Disabled by default.")
+    parser.add_argument(
+        "--report-slowest",
+        type=int,
+        default=0,
+        metavar="N",
+        help="report the utilization of each worker and the N slowest files.")
     args = parser.parse_args()
     if args.add_excluded_prefixes:
         EXCLUDED_PREFIXES += tuple(args.add_excluded_prefixes)
@@ -1249,46 +1536,109 @@ if __name__ == "__main__":
         except IOError:
             return []  # for the check format tests.
 
+    format_cache = None
+    if args.cache_path:
+        format_cache = FormatCache(args.cache_path, format_checker.fingerprint())
+
     # Calculate the list of owned directories once per run.
     error_messages = []
     owned_directories = owned_directories(error_messages)
     if os.path.isfile(args.target_path):
+        file_path = "./" + args.target_path
         if not args.target_path.startswith(EXCLUDED_PREFIXES) and args.target_path.endswith(
-                SUFFIXES):
-            error_messages += format_checker.check_format("./" + args.target_path)
+                SUFFIXES) and not (format_cache and format_cache.is_clean(file_path,
+                                                                          args.operation_type)):
+            file_errors = format_checker.check_format(file_path)
+            if format_cache:
+                format_cache.record(file_path, args.operation_type, file_errors)
+            error_messages += file_errors
     else:
         results = []
+        profiles = []
 
-        def pooled_check_format(path_predicate):
-            pool = multiprocessing.Pool(processes=args.num_workers)
-            # For each file in target_path, start a new task in the pool and collect the
-            # results (results is passed by reference, and is used as an output).
+        def pooled_check_format(name, path_predicate):
+            file_paths = []
             for root, _, files in os.walk(args.target_path):
                 _files = []
+                cached = False
                 for filename in files:
                     file_path = os.path.join(root, filename)
                     check_file = (
                         path_predicate(filename) and not file_path.startswith(EXCLUDED_PREFIXES)
                         and file_path.endswith(SUFFIXES))
-                    if check_file:
+                    if not check_file:
+                        continue
+                    # API .bzl files are also diffed against their shadow copies, so they are
+                    # always checked.
+                    cacheable = format_cache and not (
+                        root.startswith("./api") and format_checker.is_starlark_file(filename))
+                    if cacheable and format_cache.is_clean(file_path, args.operation_type):
+                        cached = True
+                    else:
                         _files.append(filename)
-                if not _files:
+                if not _files and not cached:
                     continue
                 format_checker.check_format_visitor(
-                    (pool, results, owned_directories, error_messages), root, _files)
-
-            # Close the pool to new tasks, wait for all of the running tasks to finish,
-            # then collect the error messages.
+                    (file_paths, owned_directories, error_messages), root, _files)
+
+            # When fixing, rewrite the source files in batches before checking them, so that
+            # clang-format runs once per batch rather than once per file.
+            source_files = []
+            if args.operation_type == "fix":
+                source_files = [
+                    file_path for file_path in file_paths if not (
+                        format_checker.is_build_file(file_path)
+                        or format_checker.is_starlark_file(file_path)
+                        or format_checker.is_workspace_file(file_path))
+                ]
+            format_checker.source_fixes_batched = bool(source_files)
+
+            profile = PoolProfile(name)
+            start = time.monotonic()
+            pool = multiprocessing.Pool(
+                processes=args.num_workers, initializer=init_worker, initargs=(format_checker,))
+            for pid, seconds, fix_errors in pool.imap(
+                    fix_batch,
+                    size_ordered_batches(source_files, args.num_workers, CLANG_FORMAT_BATCH_SIZE)):
+                profile.add_batch(pid, seconds)
+                error_messages.extend(fix_errors)
+            checked = {}
+            for pid, seconds, batch_results in pool.imap_unordered(
+                    check_batch,
+                    size_ordered_batches(file_paths, args.num_workers, CHECK_FORMAT_BATCH_SIZE)):
+                profile.add_batch(pid, seconds, [(s, f) for f, _, s in batch_results])
+                checked.update((f, e) for f, e, _ in batch_results)
             pool.close()
             pool.join()
+            profile.wall_time = time.monotonic() - start
+            profiles.append(profile)
+
+            # Report errors in the order the files were found.
+            results.extend((file_path, checked[file_path]) for file_path in file_paths)
 
         # We first run formatting on non-BUILD files, since the BUILD file format
         # requires analysis of srcs/hdrs in the BUILD file, and we don't want these
         # to be rewritten by other multiprocessing pooled processes.
-        pooled_check_format(lambda f: not format_checker.is_build_file(f))
-        pooled_check_format(lambda f: format_checker.is_build_file(f))
-
-        error_messages += sum((r.get() for r in results), [])
+        pooled_check_format("non-BUILD files", lambda f: not format_checker.is_build_file(f))
+        pooled_check_format("BUILD files", lambda f: format_checker.is_build_file(f))
+
+        for file_path, file_errors in results:
+            if format_cache and not (file_path.startswith("./api")
+                                     and format_checker.is_starlark_file(file_path)):
+                format_cache.record(file_path, args.operation_type, file_errors)
+            error_messages += file_errors
+
+        if args.report_slowest:
+            for profile in profiles:
+                print("\n".join(profile.report()))
+            print("check_format slowest files:")
+            file_times = sum((profile.file_times for profile in profiles), [])
+            for seconds, file_path in sorted(file_times, reverse=True)[:args.report_slowest]:
+                print("  %.3fs %s" % (seconds, file_path))
+
+    if format_cache:
+        format_cache.save()
+        print(format_cache.summary())
 
     if format_checker.check_error_messages(error_messages):
         print("ERROR: check format failed. run 'tools/code_format/check_format.py fix'")
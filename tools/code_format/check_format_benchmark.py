@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark for the per-line source checks of check_format.py. Runs the checks over a
+# corpus of source files both on every line and on the candidate lines found by
+# SOURCE_LINE_CANDIDATE_REGEX, and reports lines per second for each.
+#
+# Usage (from the root of the repository):
+#   tools/code_format/check_format_benchmark.py [--corpus ./source] [--repeat 3]
+
+import argparse
+import os
+import time
+
+import check_format
+import common
+
+BENCHMARK_SUFFIXES = (".cc", ".h", ".proto")
+
+
+def corpus_files(corpus):
+    files = []
+    for root, _, names in os.walk(corpus):
+        for name in names:
+            if name.endswith(BENCHMARK_SUFFIXES):
+                files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+# Returns the best wall-clock time of running check_file_contents over all files.
+def time_check(format_checker, files, candidate_regex, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for file_path in files:
+            format_checker.check_file_contents(
+                file_path, format_checker.check_source_line, candidate_regex)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark check_format.py source line checks.")
+    parser.add_argument(
+        "--corpus", type=str, default="./source", help="directory of files to check.")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="number of runs; the fastest one is reported.")
+    args = parser.parse_args()
+
+    format_checker = check_format.FormatChecker(
+        argparse.Namespace(
+            operation_type="check",
+            target_path=args.corpus,
+            api_prefix="./api/",
+            api_shadow_prefix="./generated_api_shadow/",
+            skip_envoy_build_rule_check=False,
+            namespace_check="Envoy",
+            namespace_check_excluded_paths=[],
+            build_fixer_check_excluded_paths=[],
+            include_dir_order=",".join(common.include_dir_order())))
+
+    files = corpus_files(args.corpus)
+    lines = sum(len(format_checker.read_lines(file_path)) for file_path in files)
+    print("%d files, %d lines" % (len(files), lines))
+    for name, candidate_regex in (("every line", None),
+                                  ("candidate lines",
+                                   check_format.SOURCE_LINE_CANDIDATE_REGEX)):
+        elapsed = time_check(format_checker, files, candidate_regex, args.repeat)
+        print("%-16s %8.2fs %12.0f lines/s" % (name, elapsed, lines / elapsed))
@@ -9,6 +9,7 @@ from __future__ import print_function
 
 from run_command import run_command
 import argparse
+import check_format as check_format_module
 import logging
 import os
 import shutil
@@ -138,6 +139,29 @@ def check_unfixable_error(filename, expected_substring):
     return errors
 
 
+# Checks a file twice against a fresh cache, expecting the second run to skip it. A file that is
+# then modified must be checked again.
+def check_cache_hit(filename):
+    cache_path = "check_format_cache.json"
+    command = check_format + " check " + get_input_file(filename) + " --cache-path " + cache_path
+    errors = 0
+    for expected in ("0 hits, 1 misses", "1 hits, 0 misses"):
+        status, stdout, stderr = run_command(command)
+        if status != 0 or not any(expected in line for line in stdout):
+            logging.error("%s: expected cache result '%s'" % (filename, expected))
+            emit_stdout_as_error(stdout + stderr)
+            errors += 1
+    with open(filename, "a") as f:
+        f.write("\n")
+    status, stdout, stderr = run_command(command)
+    if not any("0 hits, 1 misses" in line for line in stdout):
+        logging.error("%s: expected cache miss after modification" % filename)
+        emit_stdout_as_error(stdout + stderr)
+        errors += 1
+    os.remove(cache_path)
+    return errors
+
+
 def check_file_expecting_ok(filename):
     command, status, stdout = run_check_format("check", get_input_file(filename))
     if status != 0:
@@ -146,6 +170,46 @@ def check_file_expecting_ok(filename):
     return status + fix_file_expecting_no_change(filename)
 
 
+# Runs check_source_line over every line of the test data, as if each file were in several places
+# in the tree, and expects every line that fails a check to also be picked up by the candidate line
+# prefilter. Otherwise a check whose trigger is missing from SOURCE_LINE_TOKENS would never fire.
+def check_source_line_candidates():
+    checker = check_format_module.FormatChecker(
+        argparse.Namespace(
+            operation_type="check",
+            target_path=".",
+            api_prefix="./api/",
+            api_shadow_prefix="./generated_api_shadow/",
+            skip_envoy_build_rule_check=False,
+            namespace_check="Envoy",
+            namespace_check_excluded_paths=[],
+            build_fixer_check_excluded_paths=[],
+            include_dir_order=",".join(check_format_module.common.include_dir_order())))
+    file_paths = (
+        "./source/common/foo/foo.cc", "./source/common/foo/foo.h", "./envoy/foo/foo.h",
+        "./test/common/foo/foo_test.cc", "./api/envoy/foo/v3/foo.proto")
+    errors = 0
+    filenames = sorted(
+        os.path.relpath(os.path.join(root, name), src)
+        for root, _, names in os.walk(src)
+        for name in names)
+    for filename in filenames:
+        with open(os.path.join(src, filename), encoding="utf-8", errors="replace") as f:
+            lines = f.read().split("\n")
+        for line_number, line in enumerate(lines):
+            if check_format_module.SOURCE_LINE_CANDIDATE_REGEX.search(line):
+                continue
+            reported = []
+            for file_path in file_paths:
+                checker.check_source_line(line, file_path, reported.append)
+            if reported:
+                logging.error(
+                    "%s:%d: line is skipped by the candidate prefilter but fails: %s" %
+                    (filename, line_number + 1, reported[0]))
+                errors += 1
+    return errors
+
+
 def run_checks():
     errors = 0
 
@@ -312,6 +376,9 @@ def run_checks():
     errors += check_file_expecting_ok("duration_value_zero.cc")
     errors += check_file_expecting_ok("time_system_wait_for.cc")
     errors += check_file_expecting_ok("clang_format_off.cc")
+
+    errors += check_cache_hit("commented_throw.cc")
+    errors += check_source_line_candidates()
     return errors
 
 
@@ -19,7 +19,7 @@ import re
 import sys
 
 
-def reorder_headers(path):
+def reorder_headers(path, include_dir_order=common.include_dir_order()):
     source = pathlib.Path(path).read_text(encoding='utf-8')
 
     all_lines = iter(source.split('\n'))
@@ -115,7 +115,7 @@ if __name__ == '__main__':
     args = parser.parse_args()
     target_path = args.path
     include_dir_order = args.include_dir_order.split(',')
-    reorderd_source = reorder_headers(target_path)
+    reorderd_source = reorder_headers(target_path, include_dir_order)
     if args.rewrite:
         pathlib.Path(target_path).write_text(reorderd_source, encoding='utf-8')
     else:
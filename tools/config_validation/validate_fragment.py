@@ -4,15 +4,33 @@
 #
 # bazel run //tools/config_validation:validate_fragment -- \
 #   envoy.config.bootstrap.v3.Bootstrap $PWD/configs/envoyproxy_io_proxy.yaml
+#
+# Many fragments can be validated against a single descriptor load by running a validation
+# server, which reads one JSON request per line from stdin (--serve) or from each connection
+# to a Unix socket (--socket PATH):
+#
+#   {"id": 1, "type_name": "envoy.config.bootstrap.v3.Bootstrap", "content": "<YAML>"}
+#
+# and writes one JSON response per line, with a null error on success:
+#
+#   {"id": 1, "error": null}
 
+import functools
+import hashlib
 import json
+import os
 import pathlib
+import socket
+import stat
+import sys
+import tempfile
 
 import yaml
 
 from google.protobuf import descriptor_pb2
 from google.protobuf import descriptor_pool
 from google.protobuf import json_format
+from google.protobuf import message
 from google.protobuf import message_factory
 from google.protobuf import text_format
 
@@ -46,10 +64,113 @@ class IgnoredKey(yaml.YAMLObject):
         return dumper.represent_scalar(cls.yaml_tag, data.strval)
 
 
-def validate_yaml(type_name, content, descriptor_path=None):
+# Per-user directory of binary FileDescriptorSet caches of text format descriptor sets, keyed by
+# the content of the latter. Text parsing dominates the cost of loading the descriptors.
+DESCRIPTOR_CACHE_DIR = os.path.join(
+    os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'envoy', 'validate_fragment')
+
+
+# Whether a cache directory or file is owned by the current user and can't be modified by anyone
+# else, so that its content can be trusted.
+def is_private(path):
+    st = os.lstat(path)
+    return (
+        st.st_uid == os.getuid() and not stat.S_ISLNK(st.st_mode) and not st.st_mode & 0o022)
+
+
+def default_descriptor_path():
+    r = runfiles.Create()
+    return r.Rlocation('envoy/tools/type_whisperer/all_protos_with_ext_pb_text.pb_text')
+
+
+def load_descriptor_set(descriptor_path, cache_dir=DESCRIPTOR_CACHE_DIR):
+    """Load a text format FileDescriptorSet, using a binary cache of it when available.
+
+    Args:
+        descriptor_path: path to a text format FileDescriptorSet.
+        cache_dir: directory of binary descriptor set caches, or None to not use a cache.
+
+    Returns:
+        FileDescriptorSet.
+    """
+    content = pathlib.Path(descriptor_path).read_bytes()
+    file_desc_set = descriptor_pb2.FileDescriptorSet()
+    cache_path = None
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+            # Caches in a directory that others can write to are neither read nor written.
+            if is_private(cache_dir):
+                cache_path = os.path.join(cache_dir, hashlib.sha256(content).hexdigest() + '.pb')
+        except OSError:
+            pass
+    if cache_path:
+        try:
+            if is_private(cache_path):
+                file_desc_set.ParseFromString(pathlib.Path(cache_path).read_bytes())
+                return file_desc_set
+        except (OSError, message.DecodeError):
+            file_desc_set.Clear()
+
+    text_format.Parse(content.decode('utf-8'), file_desc_set, allow_unknown_extension=True)
+    if cache_path:
+        try:
+            # mkstemp() creates the file readable and writable by the current user only.
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(file_desc_set.SerializeToString())
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # The cache is an optimization only.
+            pass
+    return file_desc_set
+
+
+def register_yaml_tags():
     yaml.SafeLoader.add_constructor('!ignore', IgnoredKey.from_yaml)
     yaml.SafeDumper.add_multi_representer(IgnoredKey, IgnoredKey.to_yaml)
-    validate_fragment(type_name, yaml.safe_load(content), descriptor_path)
+
+
+class FragmentValidator(object):
+    """Validates fragments against the Envoy API proto3 types of a descriptor set.
+
+    The descriptor pool is built once, and message classes are created once per type.
+    """
+
+    def __init__(self, descriptor_path=None, cache_dir=DESCRIPTOR_CACHE_DIR):
+        file_desc_set = load_descriptor_set(
+            descriptor_path or default_descriptor_path(), cache_dir)
+        self.pool = descriptor_pool.DescriptorPool()
+        for f in file_desc_set.file:
+            self.pool.Add(f)
+        self._factory = message_factory.MessageFactory(pool=self.pool)
+        self._message_classes = {}
+
+    def message_class(self, type_name):
+        if type_name not in self._message_classes:
+            desc = self.pool.FindMessageTypeByName(type_name)
+            self._message_classes[type_name] = self._factory.GetPrototype(desc)
+        return self._message_classes[type_name]
+
+    def validate_fragment(self, type_name, fragment):
+        """Validate a dictionary representing a JSON/YAML fragment, see validate_fragment()."""
+        json_fragment = json.dumps(fragment, skipkeys=True)
+        msg = self.message_class(type_name)()
+        json_format.Parse(json_fragment, msg, descriptor_pool=self.pool)
+
+    def validate_yaml(self, type_name, content):
+        register_yaml_tags()
+        self.validate_fragment(type_name, yaml.safe_load(content))
+
+
+# Validators are shared by all validations in a process.
+@functools.lru_cache(maxsize=None)
+def get_validator(descriptor_path=None):
+    return FragmentValidator(descriptor_path)
+
+
+def validate_yaml(type_name, content, descriptor_path=None):
+    get_validator(descriptor_path).validate_yaml(type_name, content)
 
 
 def validate_fragment(type_name, fragment, descriptor_path=None):
@@ -64,23 +185,42 @@ def validate_fragment(type_name, fragment, descriptor_path=None):
         fragment: a dictionary representing the parsed JSON/YAML configuration
           fragment.
     """
-    json_fragment = json.dumps(fragment, skipkeys=True)
+    get_validator(descriptor_path).validate_fragment(type_name, fragment)
 
-    if not descriptor_path:
-        r = runfiles.Create()
-        descriptor_path = r.Rlocation(
-            'envoy/tools/type_whisperer/all_protos_with_ext_pb_text.pb_text')
 
-    file_desc_set = descriptor_pb2.FileDescriptorSet()
-    text_format.Parse(
-        pathlib.Path(descriptor_path).read_text(), file_desc_set, allow_unknown_extension=True)
+def serve(validator, infile, outfile):
+    """Serve validation requests, one JSON object per line, until the end of infile."""
+    for line in infile:
+        if not line.strip():
+            continue
+        response = {}
+        try:
+            request = json.loads(line)
+            response['id'] = request.get('id')
+            validator.validate_yaml(request['type_name'], request['content'])
+            response['error'] = None
+        except Exception as e:
+            response['error'] = f'{type(e).__name__}: {e}'
+        outfile.write(json.dumps(response) + '\n')
+        outfile.flush()
 
-    pool = descriptor_pool.DescriptorPool()
-    for f in file_desc_set.file:
-        pool.Add(f)
-    desc = pool.FindMessageTypeByName(type_name)
-    msg = message_factory.MessageFactory(pool=pool).GetPrototype(desc)()
-    json_format.Parse(json_fragment, msg, descriptor_pool=pool)
+
+def serve_unix_socket(validator, socket_path):
+    """Serve validation requests on a Unix socket, one connection at a time."""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    try:
+        server.listen()
+        while True:
+            conn, _ = server.accept()
+            with conn, conn.makefile('r', encoding='utf-8') as infile, conn.makefile(
+                    'w', encoding='utf-8') as outfile:
+                serve(validator, infile, outfile)
+    finally:
+        server.close()
+        os.unlink(socket_path)
 
 
 def parse_args():
@@ -88,15 +228,29 @@ def parse_args():
         description='Validate a YAML fragment against an Envoy API proto3 type.')
     parser.add_argument(
         'message_type',
+        nargs='?',
         help='a string providing the type name, e.g. envoy.config.bootstrap.v3.Bootstrap.')
     parser.add_argument('fragment_path', nargs='?', help='Path to a YAML configuration fragment.')
     parser.add_argument('-s', required=False, help='YAML configuration fragment.')
     parser.add_argument('--descriptor_path', nargs='?', help='Path to a protobuf descriptor file.')
-    return parser.parse_args()
+    parser.add_argument(
+        '--serve', action='store_true', help='Serve validation requests on stdin/stdout.')
+    parser.add_argument('--socket', help='Serve validation requests on this Unix socket path.')
+    parsed_args = parser.parse_args()
+    if not (parsed_args.serve or parsed_args.socket or parsed_args.message_type):
+        parser.error('the message_type argument is required')
+    return parsed_args
 
 
 if __name__ == '__main__':
     parsed_args = parse_args()
+    if parsed_args.serve or parsed_args.socket:
+        validator = get_validator(parsed_args.descriptor_path)
+        if parsed_args.socket:
+            serve_unix_socket(validator, parsed_args.socket)
+        else:
+            serve(validator, sys.stdin, sys.stdout)
+        sys.exit(0)
     message_type = parsed_args.message_type
     content = parsed_args.s if (parsed_args.fragment_path is None) else pathlib.Path(
         parsed_args.fragment_path).read_text()
@@ -3,11 +3,15 @@
 # Scan for any external dependencies that were last updated before known CVEs
 # (and near relatives). We also try a fuzzy match on version information.
 
+import argparse
 from collections import defaultdict, namedtuple
 import datetime as dt
 import gzip
+import io
 import json
+import os
 import re
+import sqlite3
 import sys
 import textwrap
 import urllib.request
@@ -68,6 +72,19 @@ IGNORES_CVES = set([
     'CVE-2021-22921',
 ])
 
+# Location of the NIST CVE JSON 1.1 feeds.
+NVD_FEEDS_URL = 'https://nvd.nist.gov/feeds/json/cve/1.1'
+
+# We only look back a few years, since we shouldn't have any ancient deps.
+FIRST_SCAN_YEAR = 2018
+
+# The NIST modified feed holds the CVEs changed in the last eight days; leave a day of slack.
+MODIFIED_FEED = 'nvdcve-1.1-modified'
+MODIFIED_FEED_WINDOW = dt.timedelta(days=7)
+
+DEFAULT_DB_PATH = os.path.join(
+    os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'envoy', 'cve_scan.sqlite')
+
 # Subset of CVE fields that are useful below.
 Cve = namedtuple(
     'Cve',
@@ -92,6 +109,46 @@ class Cpe(namedtuple('CPE', ['part', 'vendor', 'product', 'version'])):
         return Cpe(self.part, self.vendor, '*', '*')
 
 
+# This provides an over-approximation of possible CPEs affected by CVE nodes
+# metadata; it traverses the entire AND-OR tree and just gathers every CPE
+# observed. Generally we expect that most of Envoy's CVE-CPE matches to be
+# simple, plus it's interesting to consumers of this data to understand when a
+# CPE pops up, even in a conditional setting.
+def gather_cpes(nodes, cpe_set):
+    for node in nodes:
+        for cpe_match in node.get('cpe_match', []):
+            cpe_set.add(Cpe.from_string(cpe_match['cpe23Uri']))
+        gather_cpes(node.get('children', []), cpe_set)
+
+
+def parse_cve_date(date_str):
+    assert (date_str.endswith('Z'))
+    return dt.date.fromisoformat(date_str.split('T')[0])
+
+
+def parse_cve_item(cve):
+    """Parse a single CVE JSON dictionary from the CVE_Items of a NIST CVE feed.
+
+    Args:
+        cve: a NIST CVE item JSON dictionary.
+    Returns:
+        Cve object, or None if the CVE does not list any CPEs.
+    """
+    cve_id = cve['cve']['CVE_data_meta']['ID']
+    description = cve['cve']['description']['description_data'][0]['value']
+    cpe_set = set()
+    gather_cpes(cve['configurations']['nodes'], cpe_set)
+    if len(cpe_set) == 0:
+        return None
+    cvss_v3_score = cve['impact']['baseMetricV3']['cvssV3']['baseScore']
+    cvss_v3_severity = cve['impact']['baseMetricV3']['cvssV3']['baseSeverity']
+    published_date = parse_cve_date(cve['publishedDate'])
+    last_modified_date = parse_cve_date(cve['lastModifiedDate'])
+    return Cve(
+        cve_id, description, cpe_set, cvss_v3_score, cvss_v3_severity, published_date,
+        last_modified_date)
+
+
 def parse_cve_json(cve_json, cves, cpe_revmap):
     """Parse CVE JSON dictionary.
 
@@ -100,42 +157,222 @@ def parse_cve_json(cve_json, cves, cpe_revmap):
         cves: dictionary mapping CVE ID string to Cve object (output).
         cpe_revmap: a reverse map from vendor normalized CPE to CVE ID string.
     """
-
-    # This provides an over-approximation of possible CPEs affected by CVE nodes
-    # metadata; it traverses the entire AND-OR tree and just gathers every CPE
-    # observed. Generally we expect that most of Envoy's CVE-CPE matches to be
-    # simple, plus it's interesting to consumers of this data to understand when a
-    # CPE pops up, even in a conditional setting.
-    def gather_cpes(nodes, cpe_set):
-        for node in nodes:
-            for cpe_match in node.get('cpe_match', []):
-                cpe_set.add(Cpe.from_string(cpe_match['cpe23Uri']))
-            gather_cpes(node.get('children', []), cpe_set)
-
-    for cve in cve_json['CVE_Items']:
-        cve_id = cve['cve']['CVE_data_meta']['ID']
-        description = cve['cve']['description']['description_data'][0]['value']
-        cpe_set = set()
-        gather_cpes(cve['configurations']['nodes'], cpe_set)
-        if len(cpe_set) == 0:
+    for item in cve_json['CVE_Items']:
+        cve = parse_cve_item(item)
+        if cve is None:
             continue
-        cvss_v3_score = cve['impact']['baseMetricV3']['cvssV3']['baseScore']
-        cvss_v3_severity = cve['impact']['baseMetricV3']['cvssV3']['baseSeverity']
-
-        def parse_cve_date(date_str):
-            assert (date_str.endswith('Z'))
-            return dt.date.fromisoformat(date_str.split('T')[0])
-
-        published_date = parse_cve_date(cve['publishedDate'])
-        last_modified_date = parse_cve_date(cve['lastModifiedDate'])
-        cves[cve_id] = Cve(
-            cve_id, description, cpe_set, cvss_v3_score, cvss_v3_severity, published_date,
-            last_modified_date)
-        for cpe in cpe_set:
-            cpe_revmap[str(cpe.vendor_normalized())].add(cve_id)
+        cves[cve.id] = cve
+        for cpe in cve.cpes:
+            cpe_revmap[str(cpe.vendor_normalized())].add(cve.id)
     return cves, cpe_revmap
 
 
+def iter_cve_items(json_file, chunk_size=1 << 20):
+    """Incrementally parse the CVE_Items of a NIST CVE JSON feed.
+
+    Items are decoded one at a time as the feed is read, so memory use is bounded by the chunk
+    and item sizes rather than by the size of the feed.
+
+    Args:
+        json_file: text file object of a NIST CVE JSON feed.
+        chunk_size: number of characters to read at a time.
+    Yields:
+        NIST CVE item JSON dictionaries.
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = json_file.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    # Skip the feed header up to the start of the CVE_Items array.
+    while True:
+        items = buf.find('"CVE_Items"')
+        start = -1 if items == -1 else buf.find('[', items)
+        if start != -1:
+            pos = start + 1
+            break
+        if eof:
+            return
+        fill()
+
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Truncated NIST CVE JSON feed')
+            fill()
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # The item may continue in the next chunk.
+            if eof:
+                raise
+            fill()
+            continue
+        yield item
+
+
+def open_feed(feeds, name):
+    """Open a file of a NIST CVE feed, from a feeds URL or a local mirror directory."""
+    if feeds.startswith(('http://', 'https://')):
+        return urllib.request.urlopen(feeds.rstrip('/') + '/' + name)
+    return open(os.path.join(feeds, name), 'rb')
+
+
+def feed_stamp(feeds, feed_name):
+    """Return the sha256 of a NIST CVE feed from its .meta file, or None if unavailable."""
+    try:
+        with open_feed(feeds, f'{feed_name}.meta') as f:
+            meta = f.read().decode('utf-8')
+    except (OSError, ValueError):
+        return None
+    for line in meta.splitlines():
+        key, _, value = line.partition(':')
+        if key == 'sha256':
+            return value.strip()
+    return None
+
+
+class CveDatabase(object):
+    """On-disk index of NIST CVE feeds.
+
+    CVEs are stored in SQLite, along with a reverse map from vendor normalized CPEs to CVE IDs.
+    The cves and cpe_revmap attributes provide the same lookups as the dictionaries returned by
+    download_cve_data(), as used by cve_scan().
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cves (
+            id TEXT PRIMARY KEY, description TEXT, cpes TEXT, score REAL, severity TEXT,
+            published_date TEXT, last_modified_date TEXT);
+        CREATE TABLE IF NOT EXISTS cpe_revmap (
+            cpe TEXT, cve_id TEXT, PRIMARY KEY (cpe, cve_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS cpe_revmap_cve_id ON cpe_revmap (cve_id);
+        CREATE TABLE IF NOT EXISTS feeds (name TEXT PRIMARY KEY, stamp TEXT, checked TEXT);
+    """
+
+    def __init__(self, db_path):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path)
+        self._db.executescript(self.SCHEMA)
+        self.cves = _CveTable(self._db)
+        self.cpe_revmap = _CpeRevmap(self._db)
+
+    def close(self):
+        self._db.close()
+
+    def feed(self, name):
+        """Return the (stamp, last checked datetime) of a loaded feed, or None if never loaded."""
+        row = self._db.execute('SELECT stamp, checked FROM feeds WHERE name = ?',
+                               (name,)).fetchone()
+        return None if row is None else (row[0], dt.datetime.fromisoformat(row[1]))
+
+    def check_feed(self, name, now):
+        """Record that a loaded feed was found unchanged at the given datetime."""
+        with self._db:
+            self._db.execute(
+                'UPDATE feeds SET checked = ? WHERE name = ?', (now.isoformat(), name))
+
+    def load_feed(self, name, json_file, stamp, now):
+        """Insert or update the CVEs of a NIST CVE JSON feed, in a single transaction."""
+        with self._db:
+            for item in iter_cve_items(json_file):
+                self._upsert(item)
+            self._db.execute(
+                'INSERT OR REPLACE INTO feeds VALUES (?, ?, ?)', (name, stamp, now.isoformat()))
+
+    def _upsert(self, item):
+        cve = parse_cve_item(item)
+        cve_id = item['cve']['CVE_data_meta']['ID'] if cve is None else cve.id
+        self._db.execute('DELETE FROM cpe_revmap WHERE cve_id = ?', (cve_id,))
+        if cve is None:
+            self._db.execute('DELETE FROM cves WHERE id = ?', (cve_id,))
+            return
+        self._db.execute(
+            'INSERT OR REPLACE INTO cves VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (cve.id, cve.description, json.dumps(sorted(str(cpe) for cpe in cve.cpes)),
+             cve.score, cve.severity, cve.published_date.isoformat(),
+             cve.last_modified_date.isoformat()))
+        self._db.executemany(
+            'INSERT OR IGNORE INTO cpe_revmap VALUES (?, ?)',
+            ((str(cpe.vendor_normalized()), cve.id) for cpe in cve.cpes))
+
+
+class _CveTable(object):
+    """Read-only mapping of CVE ID string to Cve object in a CveDatabase."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def __getitem__(self, cve_id):
+        row = self._db.execute('SELECT * FROM cves WHERE id = ?', (cve_id,)).fetchone()
+        if row is None:
+            raise KeyError(cve_id)
+        return Cve(
+            row[0], row[1], set(map(Cpe.from_string, json.loads(row[2]))), row[3], row[4],
+            dt.date.fromisoformat(row[5]), dt.date.fromisoformat(row[6]))
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM cves').fetchone()[0]
+
+
+class _CpeRevmap(object):
+    """Read-only reverse map from vendor normalized CPE to CVE IDs in a CveDatabase."""
+
+    def __init__(self, db):
+        self._db = db
+
+    def get(self, cpe, default=None):
+        rows = self._db.execute('SELECT cve_id FROM cpe_revmap WHERE cpe = ?', (cpe,)).fetchall()
+        return set(row[0] for row in rows) if rows else default
+
+
+def update_cve_database(db, feeds, years, now=None):
+    """Bring a CveDatabase up to date with the NIST CVE feeds.
+
+    The modified feed, which covers the CVEs changed within the last eight days, is applied on
+    every update. Yearly feeds are (re)loaded when they were never loaded, or when the modified
+    feed alone can't cover the time since it was last checked and their .meta sha256 changed.
+    Feeds are skipped when their .meta sha256 matches the loaded one.
+
+    Args:
+        db: CveDatabase to update.
+        feeds: URL or local mirror directory of the NIST CVE JSON 1.1 feeds and .meta files.
+        years: years of the yearly feeds to index.
+        now: current datetime, for testing.
+    """
+    now = now or dt.datetime.now()
+    modified = db.feed(MODIFIED_FEED)
+    covered = modified is not None and now - modified[1] < MODIFIED_FEED_WINDOW
+    feed_names = [
+        name for name in (f'nvdcve-1.1-{year}' for year in years)
+        if not covered or db.feed(name) is None
+    ]
+    # Apply the modified feed last so that it has precedence.
+    for name in feed_names + [MODIFIED_FEED]:
+        stamp = feed_stamp(feeds, name)
+        loaded = db.feed(name)
+        if stamp is not None and loaded is not None and loaded[0] == stamp:
+            db.check_feed(name, now)
+            continue
+        print(f'Loading NIST CVE feed {name} from {feeds}...')
+        with open_feed(feeds, f'{name}.json.gz') as f:
+            with gzip.GzipFile(fileobj=f) as gz:
+                db.load_feed(name, io.TextIOWrapper(gz, encoding='utf-8'), stamp, now)
+
+
 def download_cve_data(urls):
     """Download NIST CVE JSON databases from given URLs and parse.
 
@@ -301,18 +538,35 @@ def cve_scan(cves, cpe_revmap, cve_allowlist, repository_locations):
     return possible_cves, cve_deps
 
 
-if __name__ == '__main__':
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Scan Envoy dependencies for CVEs in the NIST CVE database.')
+    parser.add_argument(
+        '--db-path', default=DEFAULT_DB_PATH, help='path of the local CVE index to maintain.')
+    parser.add_argument(
+        '--feeds',
+        default=NVD_FEEDS_URL,
+        help='URL or local mirror directory of the NIST CVE JSON 1.1 feeds and .meta files.')
+    parser.add_argument(
+        '--offline', action='store_true', help='scan the local CVE index without updating it.')
     # Allow local overrides for NIST CVE database URLs via args.
-    urls = sys.argv[1:]
-    if not urls:
-        # We only look back a few years, since we shouldn't have any ancient deps.
-        current_year = dt.datetime.now().year
-        scan_years = range(2018, current_year + 1)
-        urls = [
-            f'https://nvd.nist.gov/feeds/json/cve/1.1/nvdcve-1.1-{year}.json.gz'
-            for year in scan_years
-        ]
-    cves, cpe_revmap = download_cve_data(urls)
+    parser.add_argument(
+        'urls',
+        nargs='*',
+        help='NIST CVE JSON feed URLs to scan instead of the local CVE index.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.urls:
+        cves, cpe_revmap = download_cve_data(args.urls)
+    else:
+        db = CveDatabase(args.db_path)
+        if not args.offline:
+            years = range(FIRST_SCAN_YEAR, dt.datetime.now().year + 1)
+            update_cve_database(db, args.feeds, years)
+        cves, cpe_revmap = db.cves, db.cpe_revmap
     possible_cves, cve_deps = cve_scan(
         cves, cpe_revmap, IGNORES_CVES, dep_utils.repository_locations())
     if possible_cves:
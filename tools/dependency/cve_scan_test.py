@@ -3,6 +3,11 @@
 
 from collections import defaultdict
 import datetime as dt
+import gzip
+import io
+import json
+import os
+import tempfile
 import unittest
 
 import cve_scan
@@ -123,6 +128,117 @@ class CveScanTest(unittest.TestCase):
                 'cpe:2.3:a:wat:*:*': {'CVE-2020-1235'}
             })
 
+    def build_cve_item(self, cve_id, cpe_strs, score=1.0, published='2020-03-17T00:59Z'):
+        return {
+            'cve': {
+                'CVE_data_meta': {
+                    'ID': cve_id
+                },
+                'description': {
+                    'description_data': [{
+                        'value': f'{cve_id} description'
+                    }]
+                }
+            },
+            'configurations': {
+                'nodes': [{
+                    'cpe_match': [{
+                        'cpe23Uri': cpe_str
+                    } for cpe_str in cpe_strs],
+                }],
+            },
+            'impact': {
+                'baseMetricV3': {
+                    'cvssV3': {
+                        'baseScore': score,
+                        'baseSeverity': 'LOW'
+                    }
+                }
+            },
+            'publishedDate': published,
+            'lastModifiedDate': published
+        }
+
+    def build_feed(self, items):
+        return json.dumps({'CVE_data_type': 'CVE', 'CVE_Items': items}, indent=1)
+
+    def test_iter_cve_items(self):
+        items = [
+            self.build_cve_item('CVE-2020-1234', ['cpe:2.3:a:foo:bar:1.2.3']),
+            self.build_cve_item('CVE-2020-1235', ['cpe:2.3:a:foo:baz:*']),
+        ]
+        for chunk_size in (1, 7, 64, 1 << 20):
+            self.assertListEqual(
+                list(cve_scan.iter_cve_items(io.StringIO(self.build_feed(items)), chunk_size)),
+                items)
+        self.assertListEqual(list(cve_scan.iter_cve_items(io.StringIO(self.build_feed([])))), [])
+        with self.assertRaises(ValueError):
+            list(cve_scan.iter_cve_items(io.StringIO(self.build_feed(items)[:-20]), 7))
+
+    def write_feed(self, mirror, name, items, stamp):
+        with gzip.open(os.path.join(mirror, f'{name}.json.gz'), 'wt') as f:
+            f.write(self.build_feed(items))
+        with open(os.path.join(mirror, f'{name}.meta'), 'w') as f:
+            f.write(f'lastModifiedDate:2021-06-29T03:00:39-04:00\nsha256:{stamp}\n')
+
+    def test_cve_database(self):
+        with tempfile.TemporaryDirectory() as mirror:
+            now = dt.datetime(2021, 7, 1)
+            self.write_feed(
+                mirror, 'nvdcve-1.1-2020', [
+                    self.build_cve_item('CVE-2020-1234', ['cpe:2.3:a:foo:bar:1.2.3']),
+                    self.build_cve_item('CVE-2020-1235', ['cpe:2.3:a:foo:baz:*'])
+                ], 'A')
+            self.write_feed(
+                mirror, 'nvdcve-1.1-modified', [
+                    self.build_cve_item('CVE-2020-1235', ['cpe:2.3:a:wat:baz:*'], score=9.9),
+                ], 'B')
+            db = cve_scan.CveDatabase(os.path.join(mirror, 'cves.sqlite'))
+            cve_scan.update_cve_database(db, mirror, [2020], now)
+            self.assertEqual(len(db.cves), 2)
+            self.assertEqual(db.cpe_revmap.get('cpe:2.3:a:foo:*:*'), {'CVE-2020-1234'})
+            self.assertEqual(db.cpe_revmap.get('cpe:2.3:a:wat:*:*'), {'CVE-2020-1235'})
+            self.assertIsNone(db.cpe_revmap.get('cpe:2.3:a:nope:*:*'))
+            self.assertEqual(
+                db.cves['CVE-2020-1234'],
+                cve_scan.Cve(
+                    id='CVE-2020-1234',
+                    description='CVE-2020-1234 description',
+                    cpes=set([self.build_cpe('cpe:2.3:a:foo:bar:1.2.3')]),
+                    score=1.0,
+                    severity='LOW',
+                    published_date=dt.date(2020, 3, 17),
+                    last_modified_date=dt.date(2020, 3, 17)))
+            self.assertEqual(db.cves['CVE-2020-1235'].score, 9.9)
+
+            # Within the modified feed window, only the modified feed is applied.
+            self.write_feed(mirror, 'nvdcve-1.1-2020', [], 'C')
+            self.write_feed(
+                mirror, 'nvdcve-1.1-modified', [
+                    self.build_cve_item('CVE-2020-1236', ['cpe:2.3:a:foo:bar:*']),
+                ], 'D')
+            cve_scan.update_cve_database(db, mirror, [2020], now + dt.timedelta(days=1))
+            self.assertEqual(len(db.cves), 3)
+            self.assertEqual(
+                db.cpe_revmap.get('cpe:2.3:a:foo:*:*'), {'CVE-2020-1234', 'CVE-2020-1236'})
+
+            # Outside of the window, changed yearly feeds are reloaded too.
+            self.write_feed(
+                mirror, 'nvdcve-1.1-2020', [
+                    self.build_cve_item('CVE-2020-1234', []),
+                ], 'E')
+            cve_scan.update_cve_database(db, mirror, [2020], now + dt.timedelta(days=30))
+            self.assertEqual(len(db.cves), 2)
+            with self.assertRaises(KeyError):
+                db.cves['CVE-2020-1234']
+            self.assertEqual(db.cpe_revmap.get('cpe:2.3:a:foo:*:*'), {'CVE-2020-1236'})
+
+            possible_cves, cve_deps = cve_scan.cve_scan(
+                db.cves, db.cpe_revmap, [],
+                {'bar': self.build_dep('cpe:2.3:a:foo:bar:*', '1.2.3', '2020-01-01')})
+            self.assertListEqual(sorted(possible_cves.keys()), ['CVE-2020-1236'])
+            db.close()
+
     def build_cpe(self, cpe_str):
         return cve_scan.Cpe.from_string(cpe_str)
 
@@ -3,8 +3,16 @@
 
 This script verifies that bazel query of the build graph is consistent with
 the use_category metadata in bazel/repository_locations.bzl.
+
+The build graph is obtained with a single bazel query over all of the targets
+that are validated, and cached on disk keyed by the contents of the BUILD and
+.bzl files in the workspace.
 """
 
+import argparse
+import hashlib
+import json
+import os
 import re
 import subprocess
 import sys
@@ -34,6 +42,20 @@ REPOSITORY_LOCATIONS_SPEC.update(api_repository_locations.REPOSITORY_LOCATIONS_S
 
 BAZEL_QUERY_EXTERNAL_DEP_RE = re.compile('@(\w+)//')
 EXTENSION_LABEL_RE = re.compile('(//source/extensions/.*):')
+BAZEL_GRAPH_NODE_RE = re.compile(r'^\s*"([^"]+)"\s*$')
+BAZEL_GRAPH_EDGE_RE = re.compile(r'^\s*"([^"]+)"\s*->\s*"([^"]+)"')
+
+# Target patterns whose transitive dependencies make up the build graph. These
+# must cover all of the targets that are validated.
+BUILD_GRAPH_TARGETS = ['//source/...', '//test/...']
+
+# Files that the build graph is derived from; the graph cache is invalidated when they change.
+BUILD_FILE_NAMES = set(['BUILD', 'BUILD.bazel', 'WORKSPACE', '.bazelversion', '.bazelrc'])
+BUILD_FILE_SUFFIXES = ('.bzl',)
+
+DEFAULT_GRAPH_CACHE_PATH = os.path.join(
+    os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'envoy',
+    'dependency_graph.json')
 
 # We can safely ignore these as they are from Bazel or internal repository structure.
 IGNORE_DEPS = set([
@@ -99,11 +121,57 @@ class DependencyInfo(object):
         return REPOSITORY_LOCATIONS_SPEC.get(dependency)
 
 
+def build_files_hash(workspace_root):
+    """Hash the BUILD and .bzl files of a workspace.
+
+    Args:
+      workspace_root: path to the workspace.
+
+    Returns:
+      A hex digest of the paths and contents of the files that define the build graph.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(workspace_root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(('.', 'bazel-')))
+        for name in sorted(files):
+            if name in BUILD_FILE_NAMES or name.endswith(BUILD_FILE_SUFFIXES):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, workspace_root).encode() + b'\0')
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def pattern_package(pattern):
+    """Split a target pattern into its package and whether it is recursive (//pkg/...)."""
+    if pattern.endswith('/...'):
+        return pattern[2:-4], True
+    if pattern == '//...':
+        return '', True
+    return pattern[2:].split(':')[0], False
+
+
+def package_in(package, prefix):
+    return not prefix or package == prefix or package.startswith(prefix + '/')
+
+
 class BuildGraph(object):
-    """Models the Bazel build graph."""
+    """Models the Bazel build graph.
+
+    The transitive dependencies of BUILD_GRAPH_TARGETS are loaded with one bazel
+    query into an adjacency index, and the external dependencies reachable from
+    each target are memoized, so any number of queries for covered targets are
+    answered without running bazel again.
+    """
 
     def __init__(
-            self, ignore_deps=IGNORE_DEPS, repository_locations_spec=REPOSITORY_LOCATIONS_SPEC):
+            self,
+            ignore_deps=IGNORE_DEPS,
+            repository_locations_spec=REPOSITORY_LOCATIONS_SPEC,
+            targets=BUILD_GRAPH_TARGETS,
+            bazel='bazel',
+            cache_path=None,
+            workspace_root='.'):
         self._ignore_deps = ignore_deps
         # Reverse map from untracked dependencies implied by other deps back to the dep.
         self._implied_untracked_deps_revmap = {}
@@ -112,6 +180,130 @@ class BuildGraph(object):
             for untracked_dep in implied_untracked_deps:
                 assert (untracked_dep not in self._implied_untracked_deps_revmap)
                 self._implied_untracked_deps_revmap[untracked_dep] = dep
+        self._targets = targets
+        self._bazel = bazel
+        self._cache_path = cache_path
+        self._workspace_root = workspace_root
+        # Target labels, the indices of their direct dependencies and the labels in each
+        # package of the main repository.
+        self._labels = None
+        self._deps = None
+        self._packages = None
+        # Memoized external repositories reachable from each label index.
+        self._reachable = {}
+        self._interned = {}
+
+    def _query_graph(self):
+        deps_query = 'deps({})'.format(' + '.join(self._targets))
+        try:
+            output = subprocess.check_output(
+                [self._bazel, 'query', deps_query, '--output=graph', '--nograph:factored'],
+                stderr=subprocess.PIPE).decode()
+        except subprocess.CalledProcessError as exc:
+            print(
+                f'Bazel query failed with error code {exc.returncode} and std error: {exc.stderr.decode()}'
+            )
+            raise exc
+        index = {}
+        deps = []
+
+        def label_index(label):
+            if label not in index:
+                index[label] = len(deps)
+                deps.append([])
+            return index[label]
+
+        for line in output.splitlines():
+            match = BAZEL_GRAPH_EDGE_RE.match(line)
+            if match:
+                deps[label_index(match.group(1))].append(label_index(match.group(2)))
+                continue
+            match = BAZEL_GRAPH_NODE_RE.match(line)
+            if match:
+                label_index(match.group(1))
+        return list(index), deps
+
+    def _load(self):
+        if self._labels is not None:
+            return
+        key = None
+        if self._cache_path:
+            key = hashlib.sha256(
+                json.dumps([self._targets,
+                            build_files_hash(self._workspace_root)]).encode()).hexdigest()
+            try:
+                with open(self._cache_path) as f:
+                    cached = json.load(f)
+                if cached['key'] == key:
+                    self._labels, self._deps = cached['labels'], cached['deps']
+            except (OSError, ValueError, KeyError):
+                pass
+        if self._labels is None:
+            self._labels, self._deps = self._query_graph()
+            if key:
+                # The cache is only an optimization, failing to write it is not an error.
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(self._cache_path)), exist_ok=True)
+                    tmp_path = self._cache_path + '.tmp'
+                    with open(tmp_path, 'w') as f:
+                        json.dump(dict(key=key, labels=self._labels, deps=self._deps), f)
+                    os.replace(tmp_path, self._cache_path)
+                except OSError:
+                    pass
+        self._packages = {}
+        for n, label in enumerate(self._labels):
+            if label.startswith('//'):
+                self._packages.setdefault(label[2:].split(':')[0], []).append(n)
+
+    def _external_dep(self, n):
+        match = BAZEL_QUERY_EXTERNAL_DEP_RE.match(self._labels[n])
+        return match.group(1) if match else None
+
+    def _reachable_external_deps(self, root):
+        """External repositories reachable from a label index, visiting each target once."""
+        if root in self._reachable:
+            return self._reachable[root]
+        work = [(root, iter(self._deps[root]))]
+        in_progress = set([root])
+        while work:
+            n, deps = work[-1]
+            for d in deps:
+                if d not in self._reachable and d not in in_progress:
+                    in_progress.add(d)
+                    work.append((d, iter(self._deps[d])))
+                    break
+            else:
+                work.pop()
+                in_progress.discard(n)
+                reachable = set()
+                external_dep = self._external_dep(n)
+                if external_dep:
+                    reachable.add(external_dep)
+                for d in self._deps[n]:
+                    reachable.update(self._reachable.get(d, ()))
+                # Most targets reach the same few sets of repositories, share them.
+                reachable = frozenset(reachable)
+                self._reachable[n] = self._interned.setdefault(reachable, reachable)
+        return self._reachable[root]
+
+    def _covered(self, target):
+        package, _ = pattern_package(target)
+        for pattern in self._targets:
+            covering_package, recursive = pattern_package(pattern)
+            if target == pattern or (recursive and package_in(package, covering_package)):
+                return True
+        return False
+
+    def _match(self, target):
+        if not self._covered(target):
+            raise DependencyError(f'{target} is not covered by the build graph {self._targets}')
+        package, recursive = pattern_package(target)
+        if recursive:
+            return [
+                n for p, labels in self._packages.items() if package_in(p, package) for n in labels
+            ]
+        label = target if ':' in target else '{}:{}'.format(target, package.split('/')[-1])
+        return [n for n in self._packages.get(package, []) if self._labels[n] == label]
 
     def query_external_deps(self, *targets):
         """Query the build graph for transitive external dependencies.
@@ -122,29 +314,19 @@ class BuildGraph(object):
     Returns:
       A set of dependency identifiers that are reachable from targets.
     """
-        deps_query = 'deps(set({}))'.format(' '.join(targets))
-        try:
-            deps = subprocess.check_output(['bazel', 'query', deps_query],
-                                           stderr=subprocess.PIPE).decode().splitlines()
-        except subprocess.CalledProcessError as exc:
-            print(
-                f'Bazel query failed with error code {exc.returncode} and std error: {exc.stderr.decode()}'
-            )
-            raise exc
+        self._load()
         ext_deps = set()
-        implied_untracked_deps = set()
-        for d in deps:
-            match = BAZEL_QUERY_EXTERNAL_DEP_RE.match(d)
-            if match:
-                ext_dep = match.group(1)
-                if ext_dep in self._ignore_deps:
-                    continue
-                # If the dependency is untracked, add the source dependency that loaded
-                # it transitively.
-                if ext_dep in self._implied_untracked_deps_revmap:
-                    ext_dep = self._implied_untracked_deps_revmap[ext_dep]
-                ext_deps.add(ext_dep)
-        return set(ext_deps)
+        for target in targets:
+            for n in self._match(target):
+                for ext_dep in self._reachable_external_deps(n):
+                    if ext_dep in self._ignore_deps:
+                        continue
+                    # If the dependency is untracked, add the source dependency that loaded
+                    # it transitively.
+                    if ext_dep in self._implied_untracked_deps_revmap:
+                        ext_dep = self._implied_untracked_deps_revmap[ext_dep]
+                    ext_deps.add(ext_dep)
+        return ext_deps
 
     def list_extensions(self):
         """List all extensions.
@@ -305,14 +487,23 @@ class Validator(object):
         self.validate_data_plane_core_deps()
         self.validate_control_plane_deps()
         # Validate the marginal dependencies introduced for each extension.
-        for name, target in sorted(build_graph.list_extensions()):
+        for name, target in sorted(self._build_graph.list_extensions()):
             target_all = EXTENSION_LABEL_RE.match(target).group(1) + '/...'
             self.validate_extension_deps(name, target_all)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Validate the relationship between Envoy dependencies and core/extensions.')
+    parser.add_argument(
+        '--cache-path',
+        default=DEFAULT_GRAPH_CACHE_PATH,
+        help='path to cache the queried build graph at, or empty to disable caching.')
+    parser.add_argument('--bazel', default='bazel', help='bazel binary to query with.')
+    args = parser.parse_args()
+
     dep_info = DependencyInfo()
-    build_graph = BuildGraph()
+    build_graph = BuildGraph(bazel=args.bazel, cache_path=args.cache_path)
     validator = Validator(dep_info, build_graph)
     try:
         validator.validate_all()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 """Tests for validate.py"""
 
+import os
+import pathlib
+import stat
+import tempfile
 import unittest
 
 import validate
@@ -37,6 +41,105 @@ def fake_dep(use_category, extensions=[]):
     return {'use_category': use_category, 'extensions': extensions}
 
 
+# Canned bazel query --output=graph output, and a bazel stand-in that logs its arguments and
+# prints it.
+FAKE_BAZEL_GRAPH = """digraph mygraph {
+  node [shape=box];
+  "//source/common/http:codec_lib"
+  "//source/common/http:codec_lib" -> "//source/common/buffer:buffer_lib"
+  "//source/common/http:codec_lib" -> "@com_github_nghttp2_nghttp2//:all"
+  "//source/common/buffer:buffer_lib"
+  "//source/common/buffer:buffer_lib" -> "@com_google_absl//absl/strings:strings"
+  "//source/common/buffer:buffer_lib" -> "@bazel_tools//tools/cpp:toolchain"
+  "//source/extensions/filters/http/lua:config"
+  "//source/extensions/filters/http/lua:config" -> "//source/common/http:codec_lib"
+  "//source/extensions/filters/http/lua:config" -> "@luajit//:luajit"
+  "//test/common/http:codec_test"
+  "//test/common/http:codec_test" -> "//source/common/http:codec_lib"
+  "//test/common/http:codec_test" -> "@com_google_googletest//:gtest"
+  "@com_google_absl//absl/strings:strings"
+  "@com_github_nghttp2_nghttp2//:all"
+  "@com_google_googletest//:gtest"
+  "@luajit//:luajit"
+  "@bazel_tools//tools/cpp:toolchain"
+}
+"""
+
+FAKE_BAZEL = """#!/usr/bin/env python3
+import sys
+with open(sys.argv[0] + '.log', 'a') as f:
+    f.write(' '.join(sys.argv[1:]) + '\\n')
+sys.stdout.write({!r})
+""".format(FAKE_BAZEL_GRAPH)
+
+
+class BuildGraphTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._workspace = pathlib.Path(self._tmpdir.name, 'workspace')
+        self._workspace.joinpath('source').mkdir(parents=True)
+        self._workspace.joinpath('source', 'BUILD').write_text('# source\n')
+        self._bazel = pathlib.Path(self._tmpdir.name, 'bazel')
+        self._bazel.write_text(FAKE_BAZEL)
+        self._bazel.chmod(self._bazel.stat().st_mode | stat.S_IEXEC)
+        self._cache_path = os.path.join(self._tmpdir.name, 'cache', 'graph.json')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def build_graph(self):
+        return validate.BuildGraph(
+            repository_locations_spec={
+                'com_github_nghttp2_nghttp2': {
+                    'implied_untracked_deps': ['com_google_absl']
+                }
+            },
+            bazel=str(self._bazel),
+            cache_path=self._cache_path,
+            workspace_root=str(self._workspace))
+
+    def bazel_invocations(self):
+        log_path = pathlib.Path(str(self._bazel) + '.log')
+        return log_path.read_text().splitlines() if log_path.exists() else []
+
+    def test_query_external_deps(self):
+        build_graph = self.build_graph()
+        self.assertEqual(
+            build_graph.query_external_deps('//source/common/buffer/...'),
+            set(['com_github_nghttp2_nghttp2']))
+        self.assertEqual(
+            build_graph.query_external_deps('//source/extensions/filters/http/lua/...'),
+            set(['com_github_nghttp2_nghttp2', 'luajit']))
+        self.assertEqual(
+            build_graph.query_external_deps('//source/common/http:codec_lib'),
+            set(['com_github_nghttp2_nghttp2']))
+        self.assertEqual(
+            build_graph.query_external_deps('//source/...'),
+            set(['com_github_nghttp2_nghttp2', 'luajit']))
+        self.assertEqual(
+            build_graph.query_external_deps('//test/...', '//source/common/buffer/...'),
+            set(['com_github_nghttp2_nghttp2', 'com_google_googletest']))
+        self.assertEqual(build_graph.query_external_deps('//source/common/crypto/...'), set())
+        self.assertEqual(
+            self.bazel_invocations(),
+            ['query deps(//source/... + //test/...) --output=graph --nograph:factored'])
+
+    def test_uncovered_target(self):
+        self.assertRaises(
+            validate.DependencyError,
+            lambda: self.build_graph().query_external_deps('//tools/...'))
+
+    def test_graph_cache(self):
+        expected_deps = self.build_graph().query_external_deps('//source/...')
+        self.assertEqual(self.build_graph().query_external_deps('//source/...'), expected_deps)
+        self.assertEqual(len(self.bazel_invocations()), 1)
+        # Changes to BUILD files invalidate the cached graph.
+        self._workspace.joinpath('source', 'BUILD').write_text('# changed\n')
+        self.assertEqual(self.build_graph().query_external_deps('//source/...'), expected_deps)
+        self.assertEqual(len(self.bazel_invocations()), 2)
+
+
 class ValidateTest(unittest.TestCase):
 
     def build_validator(self, deps, reachable_deps, extensions=[]):
@@ -1,66 +1,479 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 """Wrapper for Envoy command-line that collects stats/log/profile.
 
 Example use:
 
-  ./tools/envoy_collect.py --output-path=./envoy.tar -c
+  ./tools/envoy_collect.py --output-path=./envoy.tar.gz -c
   ./configs/envoyproxy_io_proxy.yaml --service-node foo
   <Ctrl-C>
-  tar -tvf ./envoy.tar
+  tar -tzvf ./envoy.tar.gz
+  -rw------- htuch/eng      1551 2017-08-13 21:13 config.json
   -rw------- htuch/eng         0 2017-08-13 21:13 access_0.log
   -rw------- htuch/eng       876 2017-08-13 21:13 clusters.txt
+  -rw------- htuch/eng     54813 2017-08-13 21:13 config_dump.txt
   -rw------- htuch/eng        19 2017-08-13 21:13 listeners.txt
   -rw------- htuch/eng        70 2017-08-13 21:13 server_info.txt
   -rw------- htuch/eng      8443 2017-08-13 21:13 stats.txt
-  -rw------- htuch/eng      1551 2017-08-13 21:13 config.json
   -rw------- htuch/eng     32681 2017-08-13 21:13 envoy.log
 
 The Envoy process will execute as normal and will terminate when interrupted
 with SIGINT (ctrl-c on stdin), collecting the various stats/log/profile in the
---output-path tarball.
+--output-path tarball. The admin endpoint handlers are fetched concurrently and
+streamed to disk, and with --snapshot-interval they are also collected
+periodically while Envoy runs, into snapshot_<n>/ directories of the tarball.
+Artifacts are appended to the tarball as they are produced, compressed
+according to the --output-path extension (.tar, .tar.gz/.tgz, .tar.bz2,
+.tar.xz or .tar.zst, the latter with the zstd command).
+
+In --performance mode, Envoy runs under perf record and /stats?format=json is
+sampled every --stats-interval seconds into stats_samples/. Once Envoy exits,
+the perf data is post-processed into folded stacks (perf.folded), flamegraphs
+for all threads, the main thread and the workers (flamegraph*.svg), tables of
+the hottest functions per thread group (perf_top.txt) and the samples per
+thread group between consecutive stats samples (profile_timeline.json), with
+perf timestamps on CLOCK_MONOTONIC like the stats sample times.
 
 TODO(htuch):
   - Generate the full perf trace as well, since we may have a different version
     of perf local vs. remote.
   - Add a Bazel run wrapper.
   - Support v2 proto config in ModifyEnvoyConfig().
-  - Flamegraph generation in post-processing.
-  - Support other modes of data collection (e.g. snapshotting on SIGUSR,
-    periodic).
+  - Support snapshotting on SIGUSR.
   - Validate in performance mode that we're using an opt binary.
   - Consider handling other signals.
   - Optional real time logging while Envoy process is running.
-  - bz2 compress tarball.
   - Use freeze or something similar to build a static binary with embedded
     Python, ending need to have Python on remote host (and care about version).
 """
-from __future__ import print_function
-
 import argparse
+import bisect
+import collections
+import concurrent.futures
 import ctypes
 import ctypes.util
 import datetime
+import itertools
 import json
 import os
 import pipes
+import re
 import shutil
 import signal
 import subprocess as sp
 import sys
 import tarfile
 import tempfile
-from six.moves import urllib
+import threading
+import time
+import urllib.request
+import zlib
+from xml.sax.saxutils import escape
 
 DEFAULT_ENVOY_PATH = os.getenv('ENVOY_PATH', 'bazel-bin/source/exe/envoy-static')
 PERF_PATH = os.getenv('PERF_PATH', 'perf')
+ZSTD_PATH = os.getenv('ZSTD_PATH', 'zstd')
 
 PR_SET_PDEATHSIG = 1  # See prtcl(2).
 
-DUMP_HANDLERS = ['clusters', 'listeners', 'server_info', 'stats']
+DUMP_HANDLERS = ['clusters', 'config_dump', 'listeners', 'server_info', 'stats']
+
+# Default timeout in seconds of each blocking operation of an admin endpoint fetch.
+DEFAULT_ADMIN_TIMEOUT = 30
+
+# Admin responses are streamed to disk in chunks of this many bytes.
+FETCH_CHUNK_SIZE = 1 << 20
+
+# Default seconds between /stats?format=json samples in performance mode.
+DEFAULT_STATS_INTERVAL = 10
+
+# Number of functions listed per thread group in perf_top.txt, and per interval in
+# profile_timeline.json.
+TOP_FUNCTIONS = 30
+TIMELINE_TOP_FUNCTIONS = 5
+
+# perf script fields; stack frames are the indented lines following each sample header.
+PERF_SCRIPT_FIELDS = 'comm,pid,tid,time,ip,sym,dso'
+PERF_SAMPLE_HEADER_RE = re.compile(r'^\s*(.*?)\s+(\d+)/(\d+)\s+(\d+\.\d+):')
+PERF_SYMBOL_OFFSET_RE = re.compile(r'\+0x[0-9a-f]+$')
+
+# Flamegraph geometry, in pixels.
+FLAMEGRAPH_WIDTH = 1200
+FLAMEGRAPH_FRAME_HEIGHT = 16
+FLAMEGRAPH_MIN_FRAME_WIDTH = 0.1
+FLAMEGRAPH_CHAR_WIDTH = 7
+
+# How often the Envoy process is polled for exit while waiting for SIGINT or the next snapshot.
+POLL_SECONDS = 0.5
+
+# tarfile stream modes by --output-path extension; .tar.zst is piped through the zstd command.
+TAR_MODES = [
+    ('.tar.gz', 'w|gz'),
+    ('.tgz', 'w|gz'),
+    ('.tar.bz2', 'w|bz2'),
+    ('.tar.xz', 'w|xz'),
+    ('.tar.zst', 'w|'),
+    ('.tar', 'w|'),
+]
+
+
+def fetch_url(url, path, timeout=DEFAULT_ADMIN_TIMEOUT):
+    """Stream the response body of url to path, without holding it in memory.
+
+    Args:
+        url: URL to fetch.
+        path: file path to write the response body to.
+        timeout: timeout in seconds of connecting and of each read.
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response, open(path, 'wb') as f:
+        shutil.copyfileobj(response, f, FETCH_CHUNK_SIZE)
+
 
+class Archive(object):
+    """Streaming, optionally compressed, output tarball that artifacts are added to as they are
+    produced."""
 
-def fetch_url(url):
-    return urllib.request.urlopen(url).read().decode('utf-8')
+    def __init__(self, output_path):
+        mode = next((mode for ext, mode in TAR_MODES if output_path.endswith(ext)), 'w|')
+        self._output_path = output_path
+        self._zstd = None
+        if output_path.endswith('.tar.zst'):
+            self._zstd = sp.Popen([ZSTD_PATH, '-q', '-f', '-o', output_path], stdin=sp.PIPE)
+            self._tar = tarfile.open(fileobj=self._zstd.stdin, mode=mode)
+        else:
+            self._tar = tarfile.open(output_path, mode)
+
+    def add(self, path, arcname=None):
+        """Add a file to the archive, if it exists.
+
+        Args:
+            path: path of the file to add.
+            arcname: path in the archive, the file name by default.
+        """
+        if not os.path.exists(path):
+            print('%s not found' % path)
+            return
+        print('Adding %s to archive' % path)
+        self._tar.add(path, arcname=arcname or os.path.basename(path))
+
+    def close(self):
+        self._tar.close()
+        if self._zstd:
+            self._zstd.stdin.close()
+            if self._zstd.wait() != 0:
+                raise RuntimeError('%s failed compressing %s' % (ZSTD_PATH, self._output_path))
+
+
+class DumpCollector(object):
+    """Fetches the admin endpoint dump handlers concurrently and adds them to the archive."""
+
+    def __init__(self, archive, directory, admin_address_path, timeout=DEFAULT_ADMIN_TIMEOUT):
+        self._archive = archive
+        self._directory = directory
+        self._admin_address_path = admin_address_path
+        self._timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(DUMP_HANDLERS))
+        self._snapshots = 0
+
+    def admin_address(self):
+        """The admin endpoint URL, or None if Envoy hasn't written its address yet."""
+        try:
+            with open(self._admin_address_path, 'r') as f:
+                address = f.read().strip()
+        except OSError:
+            return None
+        return 'http://%s' % address if address else None
+
+    def collect(self, arcdir=''):
+        """Fetch all of the DUMP_HANDLERS and add them to the archive under arcdir.
+
+        Returns:
+            Whether the admin address was known, so that the dumps could be attempted.
+        """
+        admin_address = self.admin_address()
+        if admin_address is None:
+            print('Admin address not yet available at %s' % self._admin_address_path)
+            return False
+
+        def fetch(handler):
+            url = '%s/%s' % (admin_address, handler)
+            path = os.path.join(self._directory, '%s.txt' % handler)
+            print('Fetching %s' % url)
+            try:
+                fetch_url(url, path, self._timeout)
+            except (OSError, ValueError) as e:
+                print('Failed to fetch %s: %s' % (url, e))
+            return path
+
+        # Dumps are added in DUMP_HANDLERS order as they complete, and removed once archived.
+        for path in self._executor.map(fetch, DUMP_HANDLERS):
+            self._archive.add(path, os.path.join(arcdir, os.path.basename(path)))
+            if os.path.exists(path):
+                os.remove(path)
+        return True
+
+    def snapshot(self):
+        """Collect the DUMP_HANDLERS into the next snapshot_<n>/ directory of the archive."""
+        if self.collect('snapshot_%04d' % self._snapshots):
+            self._snapshots += 1
+
+    def close(self):
+        self._executor.shutdown()
+
+
+class StatsSampler(object):
+    """Samples /stats?format=json into the stats_samples/ directory of the archive, recording the
+    wall clock and monotonic time of each sample in stats_samples/index.json."""
+
+    def __init__(self, archive, directory, dump_collector, timeout=DEFAULT_ADMIN_TIMEOUT):
+        self._archive = archive
+        self._directory = directory
+        self._dump_collector = dump_collector
+        self._timeout = timeout
+        self.samples = []
+
+    def sample(self):
+        admin_address = self._dump_collector.admin_address()
+        if admin_address is None:
+            return
+        name = 'stats_%04d.json' % len(self.samples)
+        path = os.path.join(self._directory, name)
+        sample = {'time': time.time(), 'monotonic': time.monotonic()}
+        try:
+            fetch_url('%s/stats?format=json' % admin_address, path, self._timeout)
+        except (OSError, ValueError) as e:
+            print('Failed to sample stats: %s' % e)
+            return
+        sample['path'] = 'stats_samples/%s' % name
+        self._archive.add(path, sample['path'])
+        os.remove(path)
+        self.samples.append(sample)
+
+    def write_index(self):
+        """Add the index of the samples to the archive."""
+        path = os.path.join(self._directory, 'index.json')
+        with open(path, 'w') as f:
+            json.dump(self.samples, f, indent=2)
+        self._archive.add(path, 'stats_samples/index.json')
+
+
+def read_perf_samples(lines):
+    """Parse perf script output with PERF_SCRIPT_FIELDS and call graphs.
+
+    Args:
+        lines: iterable of perf script output lines.
+    Yields:
+        (comm, pid, tid, time, frames) for each sample, with the frames from the root to the leaf.
+    """
+    header = None
+    frames = []
+    # Both sample headers and frames may be indented, and samples are separated by blank lines.
+    for line in itertools.chain(lines, ['']):
+        match = PERF_SAMPLE_HEADER_RE.match(line)
+        if match or not line.strip():
+            if header:
+                yield header + (frames[::-1],)
+            header = None
+            frames = []
+            if match:
+                comm, pid, tid, timestamp = match.groups()
+                header = (comm, int(pid), int(tid), float(timestamp))
+        elif header:
+            # ip sym (dso), or ip [unknown] (dso) for frames without symbols.
+            fields = line.strip().split(' ', 1)
+            if len(fields) < 2:
+                continue
+            symbol, _, dso = fields[1].rpartition(' (')
+            symbol = PERF_SYMBOL_OFFSET_RE.sub('', symbol)
+            if symbol == '[unknown]':
+                symbol = '[%s]' % os.path.basename(dso.rstrip(')'))
+            frames.append(symbol.replace(';', ':'))
+
+
+def thread_group(comm, pid, tid):
+    """Whether a sample is from a worker, the main thread or another Envoy thread."""
+    if comm.startswith('wrk:'):
+        return 'workers'
+    if pid == tid:
+        return 'main'
+    return 'other'
+
+
+class Profile(object):
+    """Aggregates perf samples into folded stacks and per thread group function counts."""
+
+    GROUPS = ['main', 'workers', 'other']
+
+    def __init__(self, interval_starts=()):
+        self.folded = collections.Counter()
+        self.groups = collections.Counter()
+        self.self_counts = {group: collections.Counter() for group in self.GROUPS}
+        self.total_counts = {group: collections.Counter() for group in self.GROUPS}
+        # Samples by interval between consecutive monotonic interval_starts.
+        self._interval_starts = list(interval_starts)
+        self.intervals = [(collections.Counter(), collections.Counter())
+                          for _ in self._interval_starts]
+
+    def add(self, comm, pid, tid, timestamp, frames):
+        group = thread_group(comm, pid, tid)
+        self.folded[';'.join([group, comm] + frames)] += 1
+        self.groups[group] += 1
+        leaf = frames[-1] if frames else '[no stack]'
+        self.self_counts[group][leaf] += 1
+        self.total_counts[group].update(set(frames))
+        interval = bisect.bisect_right(self._interval_starts, timestamp) - 1
+        if interval >= 0:
+            groups, functions = self.intervals[interval]
+            groups[group] += 1
+            functions[leaf] += 1
+
+    def folded_stacks(self, group=None):
+        """The folded stacks of a thread group, without the group frame, or of all threads."""
+        if group is None:
+            return {stack.split(';', 1)[1]: count for stack, count in self.folded.items()}
+        prefix = group + ';'
+        return {
+            stack[len(prefix):]: count
+            for stack, count in self.folded.items()
+            if stack.startswith(prefix)
+        }
+
+    def write_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, count in sorted(self.folded_stacks().items()):
+                f.write('%s %d\n' % (stack, count))
+
+    def write_top(self, path):
+        with open(path, 'w') as f:
+            for group in self.GROUPS:
+                samples = self.groups[group]
+                f.write('%s: %d samples\n' % (group, samples))
+                if not samples:
+                    f.write('\n')
+                    continue
+                f.write('%8s %8s  %s\n' % ('self', 'total', 'function'))
+                for function, count in self.self_counts[group].most_common(TOP_FUNCTIONS):
+                    f.write(
+                        '%7.2f%% %7.2f%%  %s\n' % (100.0 * count / samples, 100.0 *
+                                                   self.total_counts[group][function] / samples,
+                                                   function))
+                f.write('\n')
+
+    def write_timeline(self, path, stats_samples):
+        timeline = []
+        for n, (groups, functions) in enumerate(self.intervals):
+            timeline.append({
+                'stats_sample': stats_samples[n]['path'],
+                'start': stats_samples[n]['monotonic'],
+                'end': stats_samples[n + 1]['monotonic'] if n + 1 < len(stats_samples) else None,
+                'samples': dict(groups),
+                'top_functions': functions.most_common(TIMELINE_TOP_FUNCTIONS),
+            })
+        with open(path, 'w') as f:
+            json.dump(timeline, f, indent=2)
+
+
+def write_flamegraph(folded_stacks, path, title):
+    """Render folded stacks as an SVG flamegraph, with the root frames at the bottom.
+
+    Args:
+        folded_stacks: map from ';' separated stack, root first, to sample count.
+        path: path to write the SVG to.
+        title: title of the flamegraph.
+    """
+    # Merge the stacks into a tree of [samples, {frame: child}].
+    root = [0, {}]
+    for stack, count in folded_stacks.items():
+        root[0] += count
+        node = root
+        for frame in stack.split(';'):
+            node = node[1].setdefault(frame, [0, {}])
+            node[0] += count
+
+    scale = FLAMEGRAPH_WIDTH / float(root[0] or 1)
+    frames = []
+    pending = [('all', root, 0.0, 0)]
+    while pending:
+        name, node, x, depth = pending.pop()
+        width = node[0] * scale
+        if width < FLAMEGRAPH_MIN_FRAME_WIDTH:
+            continue
+        frames.append((name, node[0], x, depth, width))
+        child_x = x
+        for child_name, child in sorted(node[1].items()):
+            pending.append((child_name, child, child_x, depth + 1))
+            child_x += child[0] * scale
+
+    max_depth = max(depth for _, _, _, depth, _ in frames)
+    height = (max_depth + 3) * FLAMEGRAPH_FRAME_HEIGHT
+    with open(path, 'w') as f:
+        f.write(
+            '<?xml version="1.0" standalone="no"?>\n'
+            '<svg version="1.1" width="%d" height="%d" xmlns="http://www.w3.org/2000/svg" '
+            'font-family="Verdana" font-size="12">\n' % (FLAMEGRAPH_WIDTH, height))
+        f.write(
+            '<text x="%d" y="%d" text-anchor="middle" font-size="16">%s</text>\n' %
+            (FLAMEGRAPH_WIDTH // 2, FLAMEGRAPH_FRAME_HEIGHT, escape(title)))
+        for name, samples, x, depth, width in frames:
+            y = height - (depth + 1) * FLAMEGRAPH_FRAME_HEIGHT
+            # Stable warm colors by frame name.
+            hue = zlib.crc32(name.encode())
+            color = 'rgb(%d,%d,%d)' % (205 + hue % 50, 80 + (hue >> 8) % 150, (hue >> 16) % 55)
+            label = name[:int(width / FLAMEGRAPH_CHAR_WIDTH)]
+            if len(label) < len(name):
+                label = label[:-2] + '..' if len(label) > 2 else ''
+            f.write(
+                '<g><title>%s (%d samples, %.2f%%)</title>'
+                '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s" rx="2"/>'
+                '<text x="%.1f" y="%d">%s</text></g>\n' %
+                (escape(name), samples, 100.0 * samples / root[0], x, y, width,
+                 FLAMEGRAPH_FRAME_HEIGHT - 1, color, x + 3, y + FLAMEGRAPH_FRAME_HEIGHT - 4,
+                 escape(label)))
+        f.write('</svg>\n')
+
+
+def profile_perf_data(perf_data_path, directory, stats_samples):
+    """Post-process a perf record capture into folded stacks, flamegraphs and tables.
+
+    Args:
+        perf_data_path: path of the perf.data file.
+        directory: directory path to write the generated files to.
+        stats_samples: StatsSampler samples, to attribute CPU samples to stats sample intervals.
+    Returns:
+        List of generated file paths.
+    """
+    if not os.path.exists(perf_data_path):
+        return []
+    print('Post-processing %s' % perf_data_path)
+    profile = Profile(sample['monotonic'] for sample in stats_samples)
+    # The perf script output is parsed as it is produced, holding only the aggregated stacks.
+    perf_script = sp.Popen([
+        PERF_PATH, 'script', '-i', perf_data_path, '-F', PERF_SCRIPT_FIELDS
+    ],
+                           stdout=sp.PIPE,
+                           universal_newlines=True,
+                           errors='replace')
+    for sample in read_perf_samples(perf_script.stdout):
+        profile.add(*sample)
+    if perf_script.wait() != 0:
+        print('perf script failed with exit code %d' % perf_script.returncode)
+        return []
+
+    paths = [
+        os.path.join(directory, name)
+        for name in ['perf.folded', 'perf_top.txt', 'profile_timeline.json']
+    ]
+    profile.write_folded(paths[0])
+    profile.write_top(paths[1])
+    profile.write_timeline(paths[2], stats_samples)
+    for group, title in [(None, 'Envoy'), ('main', 'Envoy main thread'),
+                         ('workers', 'Envoy workers')]:
+        folded_stacks = profile.folded_stacks(group)
+        if not folded_stacks:
+            continue
+        path = os.path.join(directory, 'flamegraph%s.svg' % ('_' + group if group else ''))
+        write_flamegraph(folded_stacks, path, title)
+        paths.append(path)
+    return paths
 
 
 def modify_envoy_config(config_path, perf, output_directory):
@@ -103,15 +516,15 @@ def modify_envoy_config(config_path, perf, output_directory):
     return modified_envoy_config_path, access_log_paths
 
 
-def run_envoy(envoy_shcmd_args, envoy_log_path, admin_address_path, dump_handlers_paths):
+def run_envoy(envoy_shcmd_args, envoy_log_path, dump_collector, periodic_tasks=()):
     """Run Envoy subprocess and trigger admin endpoint gathering on SIGINT.
 
     Args:
         envoy_shcmd_args: list of Envoy subprocess args.
         envoy_log_path: path to write Envoy stderr log to.
-        admin_address_path: path to where admin address is written by Envoy.
-        dump_handlers_paths: map from admin endpoint handler to path to where the respective contents
-           are to be written.
+        dump_collector: DumpCollector for the admin endpoint of the Envoy process.
+        periodic_tasks: list of (interval in seconds, function) to call periodically while Envoy
+           runs.
     Returns:
         The Envoy subprocess exit code.
     """
@@ -130,23 +543,24 @@ def run_envoy(envoy_shcmd_args, envoy_log_path, admin_address_path, dump_handler
         envoy_proc = sp.Popen(
             envoy_shcmd, stdin=sp.PIPE, stderr=envoy_log, preexec_fn=envoy_preexec_fn, shell=True)
 
-        def signal_handler(signum, frame):
-            # The read is deferred until the signal so that the Envoy process gets a
-            # chance to write the file out.
-            with open(admin_address_path, 'r') as f:
-                admin_address = 'http://%s' % f.read()
-            # Fetch from the admin endpoint.
-            for handler, path in dump_handlers_paths.items():
-                handler_url = '%s/%s' % (admin_address, handler)
-                print('Fetching %s' % handler_url)
-                with open(path, 'w') as f:
-                    f.write(fetch_url(handler_url))
-            # Send SIGINT to Envoy process, it should exit and execution will
-            # continue from the envoy_proc.wait() below.
-            print('Sending Envoy process (PID=%d) SIGINT...' % envoy_proc.pid)
-            envoy_proc.send_signal(signal.SIGINT)
-
-        signal.signal(signal.SIGINT, signal_handler)
+        # The handler only records the signal; the dumps are collected below, outside of it.
+        interrupted = threading.Event()
+        signal.signal(signal.SIGINT, lambda signum, frame: interrupted.set())
+
+        next_runs = [time.monotonic() + interval for interval, _ in periodic_tasks]
+        while envoy_proc.poll() is None:
+            if interrupted.wait(POLL_SECONDS):
+                dump_collector.collect()
+                # Send SIGINT to the Envoy process group, so that it reaches Envoy rather than only
+                # the shell (and perf) wrapping it. Envoy should exit and execution will continue
+                # from the envoy_proc.wait() below.
+                print('Sending Envoy process (PID=%d) SIGINT...' % envoy_proc.pid)
+                os.killpg(envoy_proc.pid, signal.SIGINT)
+                break
+            for n, (interval, task) in enumerate(periodic_tasks):
+                if time.monotonic() >= next_runs[n]:
+                    task()
+                    next_runs[n] = time.monotonic() + interval
         return envoy_proc.wait()
 
 
@@ -167,24 +581,27 @@ def envoy_collect(parse_result, unknown_args):
         # generate.
         modified_envoy_config_path, access_log_paths = modify_envoy_config(
             parse_result.config_path, perf, envoy_tmpdir)
-        dump_handlers_paths = {h: os.path.join(envoy_tmpdir, '%s.txt' % h) for h in DUMP_HANDLERS}
         envoy_log_path = os.path.join(envoy_tmpdir, 'envoy.log')
-        # The manifest of files that will be placed in the output .tar.
-        manifest = access_log_paths + list(
-            dump_handlers_paths.values()) + [modified_envoy_config_path, envoy_log_path]
+        # The manifest of files that will be placed in the output tarball once Envoy exits.
+        manifest = access_log_paths + [envoy_log_path]
         # This is where we will find out where the admin endpoint is listening.
         admin_address_path = os.path.join(envoy_tmpdir, 'admin_address.txt')
+        dumps_dir = os.path.join(envoy_tmpdir, 'dumps')
+        os.mkdir(dumps_dir)
 
         # Only run under 'perf record' in performance mode.
         if perf:
             perf_data_path = os.path.join(envoy_tmpdir, 'perf.data')
             manifest.append(perf_data_path)
+            # Sample timestamps on CLOCK_MONOTONIC line up with the stats sample times.
             perf_record_args = [
                 PERF_PATH,
                 'record',
                 '-o',
                 perf_data_path,
                 '-g',
+                '-k',
+                'CLOCK_MONOTONIC',
                 '--',
             ]
         else:
@@ -201,18 +618,29 @@ def envoy_collect(parse_result, unknown_args):
             admin_address_path,
         ] + unknown_args[1:]
 
-        # Run the Envoy process (under 'perf record' if needed).
-        return_code = run_envoy(
-            envoy_shcmd_args, envoy_log_path, admin_address_path, dump_handlers_paths)
-
-        # Collect manifest files and tar them.
-        with tarfile.TarFile(parse_result.output_path, 'w') as output_tar:
+        # Run the Envoy process (under 'perf record' if needed), adding the admin endpoint dumps
+        # to the output tarball as they are collected, followed by the manifest files.
+        archive = Archive(parse_result.output_path)
+        dump_collector = DumpCollector(
+            archive, dumps_dir, admin_address_path, parse_result.admin_timeout)
+        stats_sampler = StatsSampler(archive, dumps_dir, dump_collector, parse_result.admin_timeout)
+        periodic_tasks = []
+        if parse_result.snapshot_interval:
+            periodic_tasks.append((parse_result.snapshot_interval, dump_collector.snapshot))
+        if perf and parse_result.stats_interval:
+            periodic_tasks.append((parse_result.stats_interval, stats_sampler.sample))
+        try:
+            archive.add(modified_envoy_config_path)
+            return_code = run_envoy(
+                envoy_shcmd_args, envoy_log_path, dump_collector, periodic_tasks)
+            if perf:
+                stats_sampler.write_index()
+                manifest += profile_perf_data(perf_data_path, envoy_tmpdir, stats_sampler.samples)
             for path in manifest:
-                if os.path.exists(path):
-                    print('Adding %s to archive' % path)
-                    output_tar.add(path, arcname=os.path.basename(path))
-                else:
-                    print('%s not found' % path)
+                archive.add(path)
+        finally:
+            dump_collector.close()
+            archive.close()
 
         print('Wrote Envoy artifacts to %s' % parse_result.output_path)
     finally:
@@ -222,8 +650,12 @@ def envoy_collect(parse_result, unknown_args):
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Envoy wrapper to collect stats/log/profile.')
-    default_output_path = 'envoy-%s.tar' % datetime.datetime.now().isoformat('-')
-    parser.add_argument('--output-path', default=default_output_path, help='path to output .tar.')
+    default_output_path = 'envoy-%s.tar.gz' % datetime.datetime.now().isoformat('-')
+    parser.add_argument(
+        '--output-path',
+        default=default_output_path,
+        help='path to output .tar, compressed if ending in .tar.gz/.tgz, .tar.bz2, .tar.xz or '
+        '.tar.zst.')
     # We either need to interpret or override these, so we declare them in
     # envoy_collect.py and always parse and present them again when invoking
     # Envoy.
@@ -235,7 +667,23 @@ if __name__ == '__main__':
     parser.add_argument(
         '--performance',
         action='store_true',
-        help='Performance mode (collect perf trace, minimize log verbosity).')
+        help='Performance mode (collect perf trace and profile, minimize log verbosity).')
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=DEFAULT_STATS_INTERVAL,
+        help='seconds between /stats?format=json samples in performance mode (%d by default, 0 '
+        'to disable).' % DEFAULT_STATS_INTERVAL)
+    parser.add_argument(
+        '--snapshot-interval',
+        type=float,
+        help='also collect the admin endpoint handlers every this many seconds while Envoy runs.')
+    parser.add_argument(
+        '--admin-timeout',
+        type=float,
+        default=DEFAULT_ADMIN_TIMEOUT,
+        help='timeout in seconds of admin endpoint requests (%d by default).' %
+        DEFAULT_ADMIN_TIMEOUT)
     parser.add_argument(
         '--envoy-binary',
         default=DEFAULT_ENVOY_PATH,
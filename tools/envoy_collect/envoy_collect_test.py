@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Tests for envoy_collect.py"""
+
+import contextlib
+import http.server
+import io
+import json
+import os
+import tarfile
+import tempfile
+import threading
+import unittest
+import xml.etree.ElementTree as ET
+
+import envoy_collect
+
+# perf script -F comm,pid,tid,time,ip,sym,dso output with call graphs, leaf frames first: a main
+# thread sample, two worker samples and a sample of another thread before the first stats sample.
+PERF_SCRIPT_OUTPUT = """\
+envoy  1234/1234  100.500000:
+\t    7f1c2a3b4c5d epoll_wait+0x1a (/usr/lib/x86_64-linux-gnu/libc.so.6)
+\t    55d0c0a1b2c3 Envoy::Event::DispatcherImpl::run+0x13 (/usr/bin/envoy)
+\t    55d0c0a00000 main+0x20 (/usr/bin/envoy)
+
+wrk:worker_0  1234/1240  101.250000:
+\t    7f1c2a3b0000 [unknown] (/usr/lib/x86_64-linux-gnu/libc.so.6)
+\t    55d0c0b00040 Envoy::Http::ConnectionManagerImpl::onData+0x40 (/usr/bin/envoy)
+\t    7f1c2a000000 start_thread+0xd9 (/usr/lib/x86_64-linux-gnu/libpthread.so.0)
+
+wrk:worker_1  1234/1241  112.000000:
+\t    55d0c0c00008 std::vector<int>::push_back+0x8 (/usr/bin/envoy)
+\t    55d0c0b00040 Envoy::Http::ConnectionManagerImpl::onData+0x40 (/usr/bin/envoy)
+\t    7f1c2a000000 start_thread+0xd9 (/usr/lib/x86_64-linux-gnu/libpthread.so.0)
+
+envoy  1234/1250  95.000000:
+\t    7f00deadbeef [unknown] (/tmp/perf-1234.map)
+"""
+
+MAIN_FRAMES = ['main', 'Envoy::Event::DispatcherImpl::run', 'epoll_wait']
+WORKER_0_FRAMES = ['start_thread', 'Envoy::Http::ConnectionManagerImpl::onData', '[libc.so.6]']
+WORKER_1_FRAMES = [
+    'start_thread', 'Envoy::Http::ConnectionManagerImpl::onData', 'std::vector<int>::push_back'
+]
+
+STATS_SAMPLES = [
+    {
+        'path': 'stats_samples/stats_0000.json',
+        'monotonic': 100.0
+    },
+    {
+        'path': 'stats_samples/stats_0001.json',
+        'monotonic': 110.0
+    },
+]
+
+SVG_NS = '{http://www.w3.org/2000/svg}'
+
+# Seconds the fake admin endpoint's stalled handler is allowed before the fetch times out.
+ADMIN_TIMEOUT = 0.5
+
+# Larger than a fetch chunk, so that the dump is streamed to disk in several chunks.
+CONFIG_DUMP = b'{"configs": []}\n' * (envoy_collect.FETCH_CHUNK_SIZE // 8)
+
+
+class FakeAdminHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the DUMP_HANDLERS. /stats stalls past ADMIN_TIMEOUT, and /clusters and /listeners
+    only respond once both are being fetched, i.e. concurrently."""
+
+    def do_GET(self):
+        handler = self.path.lstrip('/')
+        if handler not in envoy_collect.DUMP_HANDLERS:
+            self.send_error(404)
+            return
+        if handler == 'stats':
+            self.server.release.wait(10 * ADMIN_TIMEOUT)
+            return
+        if handler in ('clusters', 'listeners'):
+            try:
+                self.server.barrier.wait()
+            except threading.BrokenBarrierError:
+                self.send_error(500)
+                return
+        body = CONFIG_DUMP if handler == 'config_dump' else ('%s body\n' % handler).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_profile():
+    profile = envoy_collect.Profile(sample['monotonic'] for sample in STATS_SAMPLES)
+    for sample in envoy_collect.read_perf_samples(io.StringIO(PERF_SCRIPT_OUTPUT)):
+        profile.add(*sample)
+    return profile
+
+
+class EnvoyCollectTest(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+
+    def path(self, name):
+        return os.path.join(self._tmp.name, name)
+
+    def test_read_perf_samples(self):
+        samples = list(envoy_collect.read_perf_samples(io.StringIO(PERF_SCRIPT_OUTPUT)))
+        self.assertEqual(
+            samples, [
+                ('envoy', 1234, 1234, 100.5, MAIN_FRAMES),
+                ('wrk:worker_0', 1234, 1240, 101.25, WORKER_0_FRAMES),
+                ('wrk:worker_1', 1234, 1241, 112.0, WORKER_1_FRAMES),
+                ('envoy', 1234, 1250, 95.0, ['[perf-1234.map]']),
+            ])
+
+    def test_thread_group(self):
+        self.assertEqual(envoy_collect.thread_group('wrk:worker_0', 1, 2), 'workers')
+        self.assertEqual(envoy_collect.thread_group('envoy', 1, 1), 'main')
+        self.assertEqual(envoy_collect.thread_group('envoy', 1, 2), 'other')
+
+    def test_folded_stacks(self):
+        profile = make_profile()
+        self.assertEqual(
+            profile.folded_stacks('workers'), {
+                ';'.join(['wrk:worker_0'] + WORKER_0_FRAMES): 1,
+                ';'.join(['wrk:worker_1'] + WORKER_1_FRAMES): 1,
+            })
+        self.assertEqual(profile.folded_stacks('main'), {';'.join(['envoy'] + MAIN_FRAMES): 1})
+        self.assertEqual(len(profile.folded_stacks()), 4)
+        profile.write_folded(self.path('perf.folded'))
+        with open(self.path('perf.folded')) as f:
+            self.assertIn('envoy;%s 1\n' % ';'.join(MAIN_FRAMES), f.read())
+
+    def test_write_top(self):
+        make_profile().write_top(self.path('perf_top.txt'))
+        with open(self.path('perf_top.txt')) as f:
+            top = f.read().split('\n\n')
+        self.assertEqual(
+            top[0].splitlines(), [
+                'main: 1 samples',
+                '    self    total  function',
+                ' 100.00%  100.00%  epoll_wait',
+            ])
+        workers = top[1].splitlines()
+        self.assertEqual(workers[0], 'workers: 2 samples')
+        self.assertEqual(
+            sorted(workers[2:]), [
+                '  50.00%   50.00%  [libc.so.6]',
+                '  50.00%   50.00%  std::vector<int>::push_back',
+            ])
+        self.assertEqual(top[2].splitlines()[0], 'other: 1 samples')
+
+    def test_write_timeline(self):
+        make_profile().write_timeline(self.path('profile_timeline.json'), STATS_SAMPLES)
+        with open(self.path('profile_timeline.json')) as f:
+            timeline = json.load(f)
+        # The sample of the other thread precedes the first interval and is not attributed.
+        self.assertEqual(
+            timeline, [
+                {
+                    'stats_sample': 'stats_samples/stats_0000.json',
+                    'start': 100.0,
+                    'end': 110.0,
+                    'samples': {
+                        'main': 1,
+                        'workers': 1
+                    },
+                    'top_functions': [['epoll_wait', 1], ['[libc.so.6]', 1]],
+                },
+                {
+                    'stats_sample': 'stats_samples/stats_0001.json',
+                    'start': 110.0,
+                    'end': None,
+                    'samples': {
+                        'workers': 1
+                    },
+                    'top_functions': [['std::vector<int>::push_back', 1]],
+                },
+            ])
+
+    def test_write_flamegraph(self):
+        folded_stacks = make_profile().folded_stacks()
+        envoy_collect.write_flamegraph(folded_stacks, self.path('flamegraph.svg'), 'Envoy <all>')
+        svg = ET.parse(self.path('flamegraph.svg')).getroot()
+        self.assertEqual(svg.tag, SVG_NS + 'svg')
+        self.assertEqual(svg.find(SVG_NS + 'text').text, 'Envoy <all>')
+        titles = [g.find(SVG_NS + 'title').text for g in svg.findall(SVG_NS + 'g')]
+        self.assertIn('all (4 samples, 100.00%)', titles)
+        # Stacks are merged by thread name, the first frame below the root.
+        self.assertIn('envoy (2 samples, 50.00%)', titles)
+        self.assertIn('std::vector<int>::push_back (1 samples, 25.00%)', titles)
+        # Every frame is drawn within the bounds of the graph.
+        height = int(svg.get('height'))
+        for rect in svg.iter(SVG_NS + 'rect'):
+            self.assertLessEqual(
+                float(rect.get('x')) + float(rect.get('width')),
+                envoy_collect.FLAMEGRAPH_WIDTH + 0.1)
+            self.assertLess(int(rect.get('y')), height)
+
+    def test_archive_round_trip(self):
+        with open(self.path('envoy.log'), 'w') as f:
+            f.write('log line\n')
+        output_path = self.path('envoy.tar.gz')
+        with contextlib.redirect_stdout(io.StringIO()):
+            archive = envoy_collect.Archive(output_path)
+            archive.add(self.path('envoy.log'))
+            archive.add(self.path('envoy.log'), 'snapshot_0000/envoy.log')
+            archive.add(self.path('missing.txt'))
+            archive.close()
+        with tarfile.open(output_path, 'r:gz') as tar:
+            self.assertEqual(tar.getnames(), ['envoy.log', 'snapshot_0000/envoy.log'])
+            self.assertEqual(tar.extractfile('snapshot_0000/envoy.log').read(), b'log line\n')
+
+    def start_admin_server(self):
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeAdminHandler)
+        server.daemon_threads = True
+        server.release = threading.Event()
+        server.barrier = threading.Barrier(2, timeout=10 * ADMIN_TIMEOUT)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(server.release.set)
+        return server
+
+    def test_dump_collector(self):
+        admin = self.start_admin_server()
+        admin_address_path = self.path('admin_address')
+        dump_directory = self.path('dumps')
+        os.mkdir(dump_directory)
+        output_path = self.path('envoy.tar.gz')
+        with contextlib.redirect_stdout(io.StringIO()):
+            archive = envoy_collect.Archive(output_path)
+            collector = envoy_collect.DumpCollector(
+                archive, dump_directory, admin_address_path, ADMIN_TIMEOUT)
+            # Nothing is collected, nor a snapshot numbered, until Envoy writes its admin address.
+            self.assertFalse(collector.collect())
+            collector.snapshot()
+            with open(admin_address_path, 'w') as f:
+                f.write('127.0.0.1:%d\n' % admin.server_port)
+            self.assertTrue(collector.collect())
+            collector.snapshot()
+            collector.snapshot()
+            collector.close()
+            archive.close()
+
+        # The stalled /stats dump times out without holding up the others, and the dumps are only
+        # left in the archive.
+        dumps = [
+            '%s.txt' % handler for handler in envoy_collect.DUMP_HANDLERS if handler != 'stats'
+        ]
+        with tarfile.open(output_path, 'r:gz') as tar:
+            self.assertEqual(
+                sorted(tar.getnames()),
+                sorted(
+                    [os.path.join(arcdir, dump)
+                     for arcdir in ('', 'snapshot_0000', 'snapshot_0001')
+                     for dump in dumps]))
+            self.assertEqual(tar.extractfile('snapshot_0000/config_dump.txt').read(), CONFIG_DUMP)
+            self.assertEqual(
+                tar.extractfile('snapshot_0001/clusters.txt').read(), b'clusters body\n')
+        self.assertEqual(os.listdir(dump_directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
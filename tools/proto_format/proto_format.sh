@@ -50,12 +50,12 @@ done
 TOOLS="$(dirname "$(dirname "$(realpath "$0")")")"
 # To satisfy dependency on api_proto_plugin.
 export PYTHONPATH="$TOOLS"
-# Build protoprint and merge_active_shadow_tools for use in proto_sync.py.
-bazel build "${BAZEL_BUILD_OPTIONS[@]}" //tools/protoxform:protoprint //tools/protoxform:merge_active_shadow
+# Build protoprint for use in proto_sync.py, which also merges active/shadow protos.
+bazel build "${BAZEL_BUILD_OPTIONS[@]}" //tools/protoxform:protoprint
 
 # Copy back the FileDescriptorProtos that protoxform emitted to the source tree. This involves
 # pretty-printing to format with protoprint and potentially merging active/shadow versions of protos
-# with merge_active_shadow.
+# as merge_active_shadow does.
 ./tools/proto_format/proto_sync.py "--mode=${PROTO_SYNC_CMD}" "${PROTO_TARGETS[@]}" --ci
 
 # Need to regenerate //versioning:active_protos before building type DB below if freezing.
@@ -9,7 +9,8 @@
 
 import argparse
 from collections import defaultdict
-import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor
+import json
 import os
 import pathlib
 import re
@@ -132,6 +133,12 @@ IGNORED_V2_PROTOS = [
     "envoy/service/trace/v2",
 ]
 
+PROTOPRINT_BATCH_ARGS = [
+    'bazel-bin/tools/protoxform/protoprint', '--batch',
+    './bazel-bin/tools/protoxform/protoprint.runfiles/envoy/tools/type_whisperer/api_type_db.pb_text',
+    'API_VERSION'
+]
+
 IMPORT_REGEX = re.compile('import "(.*)";')
 SERVICE_REGEX = re.compile('service \w+ {')
 PACKAGE_REGEX = re.compile('\npackage: "([^"]*)"')
@@ -202,57 +209,29 @@ def get_abs_rel_destination_path(dst_root, src):
     return dst, rel_dst_path
 
 
-def proto_print(src, dst):
-    """Pretty-print FileDescriptorProto to a destination file.
-
-    Args:
-        src: source path for FileDescriptorProto.
-        dst: destination path for formatted proto.
-    """
-    print('proto_print %s' % dst)
-    subprocess.check_output([
-        'bazel-bin/tools/protoxform/protoprint', src,
-        str(dst),
-        './bazel-bin/tools/protoxform/protoprint.runfiles/envoy/tools/type_whisperer/api_type_db.pb_text',
-        'API_VERSION'
-    ])
-
-
-def merge_active_shadow(active_src, shadow_src, dst):
-    """Merge active/shadow FileDescriptorProto to a destination file.
-
-    Args:
-        active_src: source path for active FileDescriptorProto.
-        shadow_src: source path for active FileDescriptorProto.
-        dst: destination path for FileDescriptorProto.
-    """
-    print('merge_active_shadow %s' % dst)
-    subprocess.check_output([
-        'bazel-bin/tools/protoxform/merge_active_shadow',
-        active_src,
-        shadow_src,
-        dst,
-    ])
+def proto_print_batch(dst_srcs):
+    """Pretty-print a batch of proto descriptors from protoxform.py Bazel cache artifacts.
 
-
-def sync_proto_file(dst_srcs):
-    """Pretty-print a proto descriptor from protoxform.py Bazel cache artifacts."
-
-    In the case where we are generating an Envoy internal shadow, it may be
+    A single protoprint process handles the whole batch, loading its dependencies
+    once. In the case where we are generating an Envoy internal shadow, it may be
     necessary to combine the current active proto, subject to hand editing, with
-    shadow artifacts from the previous verion; this is done via
-    merge_active_shadow().
+    shadow artifacts from the previous verion; protoprint does this in-process, as
+    in merge_active_shadow.py.
 
     Args:
-        dst_srcs: destination/sources path tuple.
+        dst_srcs: a list of destination/sources path tuples.
+
+    Returns:
+        A list of (destination path, error) tuples for the destinations that failed.
     """
-    dst, srcs = dst_srcs
-    assert (len(srcs) > 0)
-    # If we only have one candidate source for a destination, just pretty-print.
-    if len(srcs) == 1:
-        src = srcs[0]
-        proto_print(src, dst)
-    else:
+    requests = []
+    for dst, srcs in dst_srcs:
+        assert (len(srcs) > 0)
+        # If we only have one candidate source for a destination, just pretty-print.
+        if len(srcs) == 1:
+            print('proto_print %s' % dst)
+            requests.append(dict(srcs=srcs, dst=str(dst)))
+            continue
         # We should only see an active and next major version candidate from
         # previous version today.
         assert (len(srcs) == 2)
@@ -264,14 +243,44 @@ def sync_proto_file(dst_srcs):
         # candidate shadow with the potentially hand edited active version.
         if len(shadow_srcs) > 0:
             assert (len(shadow_srcs) == 1)
-            with tempfile.NamedTemporaryFile() as f:
-                merge_active_shadow(active_src, shadow_srcs[0], f.name)
-                proto_print(f.name, dst)
+            print('merge_active_shadow %s' % dst)
+            requests.append(dict(srcs=[active_src, shadow_srcs[0]], dst=str(dst)))
         else:
-            proto_print(active_src, dst)
-        src = active_src
-    rel_dst_path = get_destination_path(src)
-    return ['//%s:pkg' % str(rel_dst_path.parent)]
+            print('proto_print %s' % dst)
+            requests.append(dict(srcs=[active_src], dst=str(dst)))
+    completed = subprocess.run(
+        PROTOPRINT_BATCH_ARGS,
+        input=''.join(json.dumps(request) + '\n' for request in requests),
+        stdout=subprocess.PIPE,
+        encoding='utf-8',
+        check=True)
+    responses = [json.loads(line) for line in completed.stdout.splitlines() if line.strip()]
+    if len(responses) != len(requests):
+        raise ProtoSyncError('protoprint returned %d results for %d protos' %
+                             (len(responses), len(requests)))
+    return [(response['dst'], response['error'])
+            for response in responses
+            if response['error'] is not None]
+
+
+def sync_proto_files(dst_src_paths, jobs):
+    """Pretty-print proto descriptors with a protoprint worker per job.
+
+    Args:
+        dst_src_paths: a map from destination path to the list of source paths.
+        jobs: number of protoprint workers.
+    """
+    dst_srcs = sorted(dst_src_paths.items())
+    if not dst_srcs:
+        return
+    jobs = max(1, min(jobs, len(dst_srcs)))
+    batches = [dst_srcs[n::jobs] for n in range(jobs)]
+    with ThreadPoolExecutor(jobs) as executor:
+        results = executor.map(proto_print_batch, batches)
+        failures = [failure for result in results for failure in result]
+    if failures:
+        raise ProtoSyncError(''.join(
+            'Failed to pretty-print %s: %s\n' % failure for failure in sorted(failures)))
 
 
 def get_import_deps(proto_path):
@@ -477,7 +486,7 @@ def should_sync(path, api_proto_modified_files, py_tools_modified_files):
     return False
 
 
-def sync(api_root, mode, is_ci, labels, shadow):
+def sync(api_root, mode, is_ci, labels, shadow, jobs):
     api_proto_modified_files = git_modified_files('api', 'proto')
     py_tools_modified_files = git_modified_files('tools', 'py')
     with tempfile.TemporaryDirectory() as tmp:
@@ -499,8 +508,7 @@ def sync(api_root, mode, is_ci, labels, shadow):
                     print('Skipping sync of %s' % path)
                     src_path = str(pathlib.Path(api_root, rel_dst_path))
                     shutil.copy(src_path, abs_dst_path)
-        with mp.Pool() as p:
-            pkg_deps = p.map(sync_proto_file, dst_src_paths.items())
+        sync_proto_files(dst_src_paths, jobs)
         sync_build_files(mode, dst_dir)
 
         current_api_dir = pathlib.Path(tmp).joinpath("a")
@@ -558,8 +566,14 @@ if __name__ == '__main__':
     parser.add_argument('--api_root', default='./api')
     parser.add_argument('--api_shadow_root', default='./generated_api_shadow')
     parser.add_argument('--ci', action="store_true", default=False)
+    parser.add_argument(
+        '-j',
+        '--num-workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='number of protoprint worker processes.')
     parser.add_argument('labels', nargs='*')
     args = parser.parse_args()
 
-    sync(args.api_root, args.mode, args.ci, args.labels, False)
-    sync(args.api_shadow_root, args.mode, args.ci, args.labels, True)
+    sync(args.api_root, args.mode, args.ci, args.labels, False, args.num_workers)
+    sync(args.api_shadow_root, args.mode, args.ci, args.labels, True, args.num_workers)
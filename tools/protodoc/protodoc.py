@@ -126,8 +126,18 @@ EXTENSION_STATUS_VALUES = {
 
 r = runfiles.Create()
 
-EXTENSION_DB = utils.from_yaml(r.Rlocation("envoy/source/extensions/extensions_metadata.yaml"))
-CONTRIB_EXTENSION_DB = utils.from_yaml(r.Rlocation("envoy/contrib/extensions_metadata.yaml"))
+EXTENSION_DB_PATH = r.Rlocation("envoy/source/extensions/extensions_metadata.yaml")
+CONTRIB_EXTENSION_DB_PATH = r.Rlocation("envoy/contrib/extensions_metadata.yaml")
+V2_MAPPING_PATH = r.Rlocation('envoy/docs/v2_mapping.json')
+PROTODOC_MANIFEST_PATH = r.Rlocation('envoy/docs/protodoc_manifest.yaml')
+
+# The data files the generated RST depends on, besides the protos.
+DATA_FILES = [
+    EXTENSION_DB_PATH, CONTRIB_EXTENSION_DB_PATH, V2_MAPPING_PATH, PROTODOC_MANIFEST_PATH
+]
+
+EXTENSION_DB = utils.from_yaml(EXTENSION_DB_PATH)
+CONTRIB_EXTENSION_DB = utils.from_yaml(CONTRIB_EXTENSION_DB_PATH)
 
 
 # create an index of extension categories from extension db
@@ -694,13 +704,12 @@ class RstFormatVisitor(visitor.Visitor):
     """
 
     def __init__(self):
-        with open(r.Rlocation('envoy/docs/v2_mapping.json'), 'r') as f:
+        with open(V2_MAPPING_PATH, 'r') as f:
             self.v2_mapping = json.load(f)
 
         # Load as YAML, emit as JSON and then parse as proto to provide type
         # checking.
-        protodoc_manifest_untyped = utils.from_yaml(
-            r.Rlocation('envoy/docs/protodoc_manifest.yaml'))
+        protodoc_manifest_untyped = utils.from_yaml(PROTODOC_MANIFEST_PATH)
         self.protodoc_manifest = manifest_pb2.Manifest()
         json_format.Parse(json.dumps(protodoc_manifest_untyped), self.protodoc_manifest)
 
@@ -776,7 +785,8 @@ class RstFormatVisitor(visitor.Visitor):
 
 
 def main():
-    plugin.plugin([plugin.direct_output_descriptor('.rst', RstFormatVisitor)])
+    plugin.plugin(
+        [plugin.direct_output_descriptor('.rst', RstFormatVisitor, key_files=DATA_FILES)])
 
 
 if __name__ == '__main__':
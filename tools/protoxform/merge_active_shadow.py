@@ -84,7 +84,7 @@ def adjust_source_code_info(type_context, field_index, field_adjustment):
         return len(s) <= len(t) and all(p[0] == p[1] for p in zip(s, t))
 
     for loc in type_context.source_code_info.proto.location:
-        if has_path_prefix(type_context.path + [2], loc.path):
+        if has_path_prefix(type_context.path + (2,), loc.path):
             path_field_index = len(type_context.path) + 1
             if path_field_index < len(loc.path) and loc.path[path_field_index] >= field_index:
                 loc.path[path_field_index] += field_adjustment
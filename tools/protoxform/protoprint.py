@@ -7,11 +7,20 @@
 #
 # Usage: protoprint.py <source file path> <type database path> <load type db path>
 #                      <api version file path>
+#        protoprint.py --batch <load type db path> <api version file path>
+#
+# In --batch mode, protoprint reads JSON requests, one per line, from stdin:
+#   {"srcs": [<source file path>[, <shadow source file path>]], "dst": <destination path>}
+# With two sources, the active proto is first merged with the next major version candidate
+# shadow, as in merge_active_shadow.py. Dependencies are loaded once for the whole batch and the
+# results are clang-formatted in a few invocations. A {"dst": ..., "error": ...} response line is
+# written for each request once the batch is complete.
 
 from collections import deque
 import copy
 import functools
 import io
+import json
 import os
 import pathlib
 import re
@@ -20,7 +29,7 @@ import sys
 
 from tools.api_proto_plugin import annotations, traverse, visitor
 from tools.api_versioning import utils as api_version_utils
-from tools.protoxform import options as protoxform_options, utils
+from tools.protoxform import merge_active_shadow, options as protoxform_options, utils
 from tools.type_whisperer import type_whisperer, types_pb2
 
 from google.protobuf import descriptor_pb2
@@ -38,6 +47,9 @@ NEXT_FREE_FIELD_MIN = 5
 
 ENVOY_DEPRECATED_UNAVIALABLE_NAME = 'DEPRECATED_AND_UNAVAILABLE_DO_NOT_USE'
 
+# Maximum number of files passed to a single clang-format invocation in --batch mode.
+CLANG_FORMAT_BATCH_SIZE = 128
+
 
 class ProtoPrintError(Exception):
     """Base error class for the protoprint module."""
@@ -89,6 +101,24 @@ def clang_format(contents):
         stdout=subprocess.PIPE).stdout
 
 
+def clang_format_files(paths):
+    """Run proto-style oriented clang-format in place over .proto files.
+
+    Args:
+        paths: a list of .proto file paths.
+
+    Returns:
+        A list of the paths that failed to format.
+    """
+    failed = []
+    for n in range(0, len(paths), CLANG_FORMAT_BATCH_SIZE):
+        batch = [str(path) for path in paths[n:n + CLANG_FORMAT_BATCH_SIZE]]
+        if subprocess.run(['clang-format', '-i', '--style=%s' % CLANG_FORMAT_STYLE] +
+                          batch).returncode != 0:
+            failed.extend(batch)
+    return failed
+
+
 def format_block(block):
     """Append \n to a .proto section (e.g.
 
@@ -582,12 +612,13 @@ class ProtoFormatVisitor(visitor.Visitor):
     See visitor.Visitor for visitor method docs comments.
     """
 
-    def __init__(self, api_version_file_path, frozen_proto):
-        current_api_version = api_version_utils.get_api_version(api_version_file_path)
+    def __init__(self, api_version_file_path, frozen_proto, format_output=True):
+        current_api_version = load_api_version(api_version_file_path)
         self._deprecated_annotation_version_value = '{}.{}'.format(
             current_api_version.major, current_api_version.minor)
         self._requires_deprecation_annotation_import = False
         self._frozen_proto = frozen_proto
+        self._format_output = format_output
 
     def _add_deprecation_version(self, field_or_evalue, deprecation_tag, disallowed_tag):
         """Adds a deprecation version annotation if needed to the given field or enum value.
@@ -711,23 +742,83 @@ class ProtoFormatVisitor(visitor.Visitor):
         formatted_services = format_block('\n'.join(services))
         formatted_enums = format_block('\n'.join(enums))
         formatted_msgs = format_block('\n'.join(msgs))
-        return clang_format(header + formatted_services + formatted_enums + formatted_msgs)
+        contents = header + formatted_services + formatted_enums + formatted_msgs
+        if self._format_output:
+            return clang_format(contents)
+        return contents.encode('utf-8')
 
 
-if __name__ == '__main__':
-    proto_desc_path = sys.argv[1]
+@functools.lru_cache(maxsize=None)
+def load_api_version(api_version_file_path):
+    return api_version_utils.get_api_version(api_version_file_path)
 
-    utils.load_protos(PROTO_PACKAGES)
 
-    file_proto = descriptor_pb2.FileDescriptorProto()
+def load_file_proto(proto_desc_path):
+    """Load a FileDescriptorProto in text format, returning None for an empty file."""
     input_text = pathlib.Path(proto_desc_path).read_text()
     if not input_text:
-        sys.exit(0)
+        return None
+    file_proto = descriptor_pb2.FileDescriptorProto()
     text_format.Merge(input_text, file_proto)
-    dst_path = pathlib.Path(sys.argv[2])
-    utils.load_type_db(sys.argv[3])
-    api_version_file_path = pathlib.Path(sys.argv[4])
+    return file_proto
+
+
+def print_file_proto(file_proto, dst_path, api_version_file_path, format_output=True):
     frozen_proto = file_proto.options.Extensions[
         status_pb2.file_status].package_version_status == status_pb2.FROZEN
-    dst_path.write_bytes(
-        traverse.traverse_file(file_proto, ProtoFormatVisitor(api_version_file_path, frozen_proto)))
+    pathlib.Path(dst_path).write_bytes(
+        traverse.traverse_file(
+            file_proto, ProtoFormatVisitor(api_version_file_path, frozen_proto, format_output)))
+
+
+def print_batch(requests, api_version_file_path):
+    """Merge and pretty-print a batch of protos, see --batch in the usage above.
+
+    Args:
+        requests: an iterable of request dictionaries.
+        api_version_file_path: path to the API_VERSION file.
+
+    Returns:
+        A list of response dictionaries.
+    """
+    responses = []
+    printed = []
+    for request in requests:
+        error = None
+        try:
+            file_proto = load_file_proto(request['srcs'][0])
+            if file_proto is not None and len(request['srcs']) > 1:
+                # An empty shadow merges as an empty proto, as in merge_active_shadow.py.
+                shadow_proto = load_file_proto(request['srcs'][1])
+                if shadow_proto is None:
+                    shadow_proto = descriptor_pb2.FileDescriptorProto()
+                file_proto = merge_active_shadow.merge_active_shadow_file(file_proto, shadow_proto)
+            if file_proto is not None:
+                print_file_proto(file_proto, request['dst'], api_version_file_path, False)
+                printed.append(request['dst'])
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+        responses.append(dict(dst=request['dst'], error=error))
+    failed = set(clang_format_files(printed))
+    for response in responses:
+        if response['error'] is None and response['dst'] in failed:
+            response['error'] = 'clang-format failed'
+    return responses
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == '--batch':
+        utils.load_protos(PROTO_PACKAGES + merge_active_shadow.PROTO_PACKAGES)
+        utils.load_type_db(sys.argv[2])
+        requests = [json.loads(line) for line in sys.stdin if line.strip()]
+        for response in print_batch(requests, pathlib.Path(sys.argv[3])):
+            sys.stdout.write(json.dumps(response) + '\n')
+        sys.exit(0)
+
+    utils.load_protos(PROTO_PACKAGES)
+
+    file_proto = load_file_proto(sys.argv[1])
+    if file_proto is None:
+        sys.exit(0)
+    utils.load_type_db(sys.argv[3])
+    print_file_proto(file_proto, sys.argv[2], pathlib.Path(sys.argv[4]))
@@ -1,10 +1,13 @@
 import importlib
+import os
 
+from tools.type_whisperer import api_type_db_index
 from tools.type_whisperer.api_type_db_pb2 import TypeDb
 
 from google.protobuf import text_format
 
 _typedb = None
+_typedb_path = None
 
 
 def get_type_db():
@@ -13,10 +16,19 @@ def get_type_db():
 
 
 def load_type_db(type_db_path):
-    global _typedb
-    _typedb = TypeDb()
-    with open(type_db_path, 'r') as f:
-        text_format.Merge(f.read(), _typedb)
+    global _typedb, _typedb_path
+    if type_db_path == _typedb_path:
+        return
+    # Prefer the indexed type database generated alongside the text proto, which is opened in
+    # constant time and only parses the entries that are looked up.
+    index_path = api_type_db_index.type_db_index_path(type_db_path)
+    if os.path.exists(index_path):
+        _typedb = api_type_db_index.TypeDbIndex(index_path)
+    else:
+        _typedb = TypeDb()
+        with open(type_db_path, 'r') as f:
+            text_format.Merge(f.read(), _typedb)
+    _typedb_path = type_db_path
 
 
 def load_protos(packages):
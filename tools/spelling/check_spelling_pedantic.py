@@ -3,12 +3,16 @@
 from __future__ import print_function
 
 import argparse
+import hashlib
+import json
 import locale
 import math
+import multiprocessing
 import os
 import re
 import subprocess
 import sys
+import threading
 
 from functools import partial
 from itertools import chain
@@ -44,14 +48,11 @@ SPELLCHECK_ON = "SPELLCHECKER(on)"  # (re-)enable
 SPELLCHECK_SKIP_FILE = "SPELLCHECKER(skip-file)"  # disable checking this entire file
 SPELLCHECK_SKIP_BLOCK = "SPELLCHECKER(skip-block)"  # disable to end of comment
 
-# Single line comments: // comment OR /* comment */
-# Limit the characters that may precede // to help filter out some code
-# mistakenly processed as a comment.
-INLINE_COMMENT = re.compile(r'(?:^|[^:"])//( .*?$|$)|/\*+(.*?)\*+/')
-
-# Multi-line comments: /* comment */ (multiple lines)
-MULTI_COMMENT_START = re.compile(r'/\*(.*?)$')
-MULTI_COMMENT_END = re.compile(r'^(.*?)\*/')
+# Start of a comment: // comment OR /* comment */. A // comment must be
+# followed by a space or the end of the line, and the characters that may
+# precede it are limited to help filter out some code mistakenly processed
+# as a comment.
+COMMENT_START = re.compile(r'//|/\*')
 
 # Envoy TODO comment style.
 TODO = re.compile(r'(TODO|NOTE)\s*\(@?[A-Za-z0-9-]+\):?')
@@ -126,6 +127,12 @@ SMART_QUOTES = {
 # Valid dictionary words. Anything else crashes aspell.
 DICTIONARY_WORD = re.compile(r"^[A-Za-z']+$")
 
+# Words of plain lines: ASCII text without apostrophes, digits, underscores, hyphens, slashes,
+# '@' or '.' within a word. Aspell splits such lines into the same runs of letters, and none of
+# their words is skipped by its url filter. Other lines are only ever checked whole by aspell.
+PLAIN_LINE_EXCLUDED = re.compile(r"[^\x00-\x7f]|['\\/@_0-9-]|\.(?!\s|$)")
+PLAIN_WORD = re.compile(r"[A-Za-z]+")
+
 DEBUG = 0
 COLOR = True
 MARK = False
@@ -157,8 +164,22 @@ class SpellChecker:
         self.suffixes = []
         self.prefix_re = None
         self.suffix_re = None
+        # Verdict per word of plain lines: None when it is spelled correctly, otherwise aspell's
+        # suggestions.
+        self.verdicts = {}
+        # Aspell's errors per other line.
+        self.line_verdicts = {}
+        # Verdicts obtained from aspell since the last call to take_new_verdicts.
+        self.new_verdicts = {}
+        self.new_line_verdicts = {}
 
     def start(self):
+        self.load()
+        self.start_aspell()
+
+    # Loads the dictionary and generates the aspell personal dictionary. This is done once, even
+    # when several aspell processes are started from it.
+    def load(self):
         words, prefixes, suffixes = self.load_dictionary()
 
         self.prefixes = prefixes
@@ -173,7 +194,9 @@ class SpellChecker:
             f.write("personal_ws-1.1 en %d\n" % (len(words)))
             f.writelines(words)
 
+    def start_aspell(self):
         # Start an aspell process.
+        pws = os.path.join(CURR_DIR, '.aspell.en.pws')
         aspell_args = ["aspell", "pipe", "--lang=en_US", "--encoding=utf-8", "--personal=" + pws]
         self.aspell = subprocess.Popen(
             aspell_args,
@@ -195,19 +218,124 @@ class SpellChecker:
         self.aspell = None
 
     def check(self, line):
-        if line.strip() == '':
-            return []
+        return self.check_lines([line])[0]
+
+    # Checks each of the given lines, returning a list of errors per line. Only lines with a word
+    # or, for lines that aren't plain, the line itself without a verdict yet are sent to aspell.
+    def check_lines(self, lines):
+        results = [None] * len(lines)
+        pending = []
+        for n, line in enumerate(lines):
+            if PLAIN_LINE_EXCLUDED.search(line) is None:
+                words = [(word.group(0), word.start()) for word in PLAIN_WORD.finditer(line)]
+                if all(word in self.verdicts for word, _ in words):
+                    results[n] = [(word, offset, self.verdicts[word])
+                                  for word, offset in words
+                                  if self.verdicts[word] is not None]
+                    continue
+            elif line in self.line_verdicts:
+                results[n] = [tuple(error) for error in self.line_verdicts[line]]
+                continue
+            pending.append(n)
+
+        unique = list({lines[n]: None for n in pending})
+        answers = dict(zip(unique, self.query(unique)))
+        for line, errors in answers.items():
+            self.learn(line, errors)
+        for n in pending:
+            results[n] = answers[lines[n]]
+        return results
+
+    # Records aspell's errors for a line. The verdicts of the words of a plain line are derived
+    # from them, provided that every error is one of the words; otherwise the line itself is
+    # recorded.
+    def learn(self, line, errors):
+        if PLAIN_LINE_EXCLUDED.search(line) is None:
+            words = {word.start(): word.group(0) for word in PLAIN_WORD.finditer(line)}
+            if all(words.get(offset) == word for word, offset, _ in errors):
+                reported = {offset: suggestions for _, offset, suggestions in errors}
+                for offset, word in words.items():
+                    self.verdicts[word] = self.new_verdicts[word] = reported.get(offset)
+                return
+        self.line_verdicts[line] = self.new_line_verdicts[line] = errors
+
+    # Sends each of the given lines to aspell, returning a list of errors per line. Many lines are
+    # sent in one request: aspell answers each line in turn, so they are written from a separate
+    # thread while the answers are read, which keeps both pipes from filling up.
+    def query(self, lines):
+        requests = [line.rstrip("\r\n") for line in lines if line.strip() != '']
+        if not requests:
+            return [[] for line in lines]
 
         self.aspell.poll()
         if self.aspell.returncode is not None:
             print("aspell quit unexpectedly: return code %d" % (self.aspell.returncode))
             sys.exit(2)
 
-        debug1("ASPELL< %s" % (line))
-
-        self.aspell.stdin.write(line + os.linesep)
+        writer = None
+        if len(requests) == 1:
+            self.write_lines(requests)
+        else:
+            writer = threading.Thread(target=self.write_lines, args=(requests,))
+            writer.start()
+
+        results = [self.read_errors() for _ in requests]
+        if writer is not None:
+            writer.join()
+
+        results = iter(results)
+        return [next(results) if line.strip() != '' else [] for line in lines]
+
+    def take_new_verdicts(self):
+        new_verdicts = (self.new_verdicts, self.new_line_verdicts)
+        self.new_verdicts = {}
+        self.new_line_verdicts = {}
+        return new_verdicts
+
+    def add_verdicts(self, verdicts):
+        words, lines = verdicts
+        self.verdicts.update(words)
+        self.line_verdicts.update(lines)
+
+    # The verdicts are only valid for the dictionary and aspell version they were obtained with.
+    def cache_key(self):
+        digest = hashlib.sha256()
+        with open(self.dictionary_file, 'rb') as f:
+            digest.update(f.read())
+        try:
+            digest.update(subprocess.check_output(["aspell", "--version"]))
+        except (OSError, subprocess.CalledProcessError):
+            pass
+        return digest.hexdigest()
+
+    def load_cache(self, cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+        except (IOError, ValueError):
+            return
+        if cache.get("key") == self.cache_key():
+            self.verdicts.update(cache.get("words", {}))
+            self.line_verdicts.update(cache.get("lines", {}))
+
+    def save_cache(self, cache_path):
+        tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "key": self.cache_key(),
+                "words": self.verdicts,
+                "lines": self.line_verdicts
+            }, f)
+        os.replace(tmp_path, cache_path)
+
+    def write_lines(self, lines):
+        for line in lines:
+            debug1("ASPELL< %s" % (line))
+            self.aspell.stdin.write(line + os.linesep)
         self.aspell.stdin.flush()
 
+    # Reads aspell's answer for one line.
+    def read_errors(self):
         errors = []
         while True:
             result = self.aspell.stdout.readline().strip()
@@ -294,6 +422,16 @@ class SpellChecker:
         with open(self.dictionary_file, 'w') as f:
             f.writelines(lines)
 
+        # Added words may now be spelled correctly, and the suggestions for others may change.
+        self.verdicts = {
+            word: verdict for word, verdict in self.verdicts.items() if verdict is None
+        }
+        self.line_verdicts = {
+            line: errors for line, errors in self.line_verdicts.items() if not errors
+        }
+        self.new_verdicts = {}
+        self.new_line_verdicts = {}
+
         self.stop()
         self.start()
 
@@ -321,7 +459,7 @@ def check_camel_case(checker, err):
         split_err = checker.check(part)
         if split_err:
             debug("    -> not found in dictionary")
-            split_errs += [(part, word_offset + part_offset, split_err[0][2])]
+            split_errs.append((part, word_offset + part_offset, split_err[0][2]))
         part_offset += len(part)
 
     return split_errs
@@ -377,10 +515,9 @@ def mask_with_regex(comment, regex, group, secondary=None):
     return (comment, found)
 
 
-# Checks the comment at offset against the spell checker. Result is an array
-# of tuples where each tuple is the misspelled word, it's offset from the
-# start of the line, and an array of possible replacements.
-def check_comment(checker, offset, comment):
+# Masks the parts of a comment that should not be spell checked with spaces, preserving
+# offsets. Returns None if nothing is left to check.
+def mask_comment(checker, comment):
     # Strip smart quotes which cause problems sometimes.
     for sq, q in SMART_QUOTES.items():
         comment = comment.replace(sq, q)
@@ -439,14 +576,17 @@ def check_comment(checker, offset, comment):
 
     # Everything got masked, return early.
     if comment == "" or comment.strip() == "":
-        return []
+        return None
 
     # Mask leading punctuation.
     if not comment[0].isalnum():
         comment = ' ' + comment[1:]
 
-    errors = checker.check(comment)
+    return comment
+
 
+# Resolves the errors aspell found in a masked comment at offset.
+def resolve_errors(checker, offset, errors):
     # Fix up offsets relative to the start of the line vs start of the comment.
     errors = [(w, o + offset, s) for (w, o, s) in errors]
 
@@ -458,6 +598,24 @@ def check_comment(checker, offset, comment):
     return errors
 
 
+# Checks the comment at offset against the spell checker. Result is an array
+# of tuples where each tuple is the misspelled word, it's offset from the
+# start of the line, and an array of possible replacements.
+def check_comment(checker, offset, comment):
+    return check_comments(checker, [(offset, comment)])[0]
+
+
+# Checks many (offset, comment) pairs in a single aspell request. Result is an
+# array of errors per comment, as for check_comment.
+def check_comments(checker, comments):
+    masked = [mask_comment(checker, comment) for _, comment in comments]
+    results = checker.check_lines([comment or '' for comment in masked])
+    return [
+        resolve_errors(checker, offset, errors)
+        for (offset, _), errors in zip(comments, results)
+    ]
+
+
 def print_error(file, line_offset, lines, errors):
     # Highlight misspelled words.
     line = lines[line_offset]
@@ -518,7 +676,7 @@ def fix_error(checker, file, line_offset, lines, errors):
     for (word, offset, suggestions) in errors:
         if word in fixed:
             # Same typo was repeated in a line, so just reuse the previous choice.
-            replacements += [fixed[word]]
+            replacements.append(fixed[word])
             continue
 
         print_fix_options(word, suggestions)
@@ -573,10 +731,10 @@ def fix_error(checker, file, line_offset, lines, errors):
                     print("Invalid choice: '%s'" % (choice))
 
         fixed[word] = replacement
-        replacements += [replacement]
+        replacements.append(replacement)
         if add:
             if re.match(DICTIONARY_WORD, add):
-                additions += [add]
+                additions.append(add)
             else:
                 print(
                     "Cannot add %s to the dictionary: it may only contain letter and apostrophes"
@@ -604,6 +762,8 @@ def fix_error(checker, file, line_offset, lines, errors):
 class Comment:
     """Comment represents a comment at a location within a file."""
 
+    __slots__ = ('line', 'col', 'text', 'last_on_line')
+
     def __init__(self, line, col, text, last_on_line):
         self.line = line
         self.col = col
@@ -611,42 +771,111 @@ class Comment:
         self.last_on_line = last_on_line
 
 
-# Extract comments from lines. Returns an array of Comment.
-def extract_comments(lines):
-    in_comment = False
+# Finds the single-line comments in text[start:end], the line that begins at
+# line_start, from last onwards. Returns a list of (col, text) pairs, the end
+# of the text of the last one (or last) and the offset at which the next one
+# could start.
+def inline_comments(text, line_start, end, last):
     comments = []
-    for line_idx, line in enumerate(lines):
+    consumed = last
+    pos = last
+    while True:
+        m = COMMENT_START.search(text, pos, end)
+        if m is None:
+            break
+        c = m.start()
+        if text[c + 1] == '/':
+            # Single-line // comment, to the end of the line.
+            if (c == line_start or
+                (c - 1 >= consumed and text[c - 1] not in ':"')) and (c + 2 == end
+                                                                       or text[c + 2] == ' '):
+                comments.append((c + 2 - line_start, text[c + 2:end]))
+                return comments, end, end
+            pos = c + 1
+            continue
+
+        # Single-line /* ... */ comment. Any run of '*' is part of the delimiters.
+        body = c + 2
+        while body < end and text[body] == '*':
+            body += 1
+        close = text.find('*/', body, end)
+        if close != -1:
+            body_end = close
+            while body_end > body and text[body_end - 1] == '*':
+                body_end -= 1
+            close += 2
+        elif body > c + 2 and body < end and text[body] == '/':
+            # e.g. /**/: the last '*' belongs to the closing delimiter.
+            body = body_end = body - 1
+            close = body + 2
+        else:
+            pos = c + 1
+            continue
+        comments.append((body - line_start, text[body:body_end]))
+        last = body_end
+        consumed = pos = close
+    return comments, last, consumed
+
+
+# Tokenizes the comments in a file in a single pass over its text, yielding a
+# Comment for each. Lines without comments are skipped over by searching for
+# the start of the next comment in the whole buffer.
+def tokenize_comments(text):
+    line = 0
+    line_start = 0
+    in_comment = False
+    size = len(text)
+    while line_start < size:
+        if not in_comment:
+            # Skip to the next line that may contain a comment.
+            m = COMMENT_START.search(text, line_start)
+            if m is None:
+                return
+            next_line_start = text.rfind('\n', line_start, m.start()) + 1
+            if next_line_start > line_start:
+                line += text.count('\n', line_start, next_line_start)
+                line_start = next_line_start
+
+        line_end = text.find('\n', line_start)
+        if line_end == -1:
+            line_end = next_line_start = size
+        else:
+            next_line_start = line_end + 1
+
         line_comments = []
-        last = 0
+        last = line_start
         if in_comment:
-            mc_end = MULTI_COMMENT_END.search(line)
-            if mc_end is None:
+            mc_end = text.find('*/', line_start, line_end)
+            if mc_end == -1:
                 # Full line is within a multi-line comment.
-                line_comments.append((0, line))
+                line_comments.append((0, text[line_start:next_line_start]))
             else:
                 # Start of line is the end of a multi-line comment.
-                line_comments.append((0, mc_end.group(1)))
-                last = mc_end.end()
+                line_comments.append((0, text[line_start:mc_end]))
+                last = mc_end + 2
                 in_comment = False
 
         if not in_comment:
-            for inline in INLINE_COMMENT.finditer(line, last):
-                # Single-line comment.
-                m = inline.lastindex  # 1 is //, 2 is /* ... */
-                line_comments.append((inline.start(m), inline.group(m)))
-                last = inline.end(m)
-
-            if last < len(line):
-                mc_start = MULTI_COMMENT_START.search(line, last)
-                if mc_start is not None:
-                    # New multi-lie comment starts at end of line.
-                    line_comments.append((mc_start.start(1), mc_start.group(1)))
+            comments, last, _ = inline_comments(text, line_start, line_end, last)
+            line_comments.extend(comments)
+
+            if last < next_line_start:
+                mc_start = text.find('/*', last, line_end)
+                if mc_start != -1:
+                    # New multi-line comment starts at end of line.
+                    line_comments.append((mc_start + 2 - line_start, text[mc_start + 2:line_end]))
                     in_comment = True
 
-        for idx, line_comment in enumerate(line_comments):
-            col, text = line_comment
-            last_on_line = idx + 1 >= len(line_comments)
-            comments.append(Comment(line=line_idx, col=col, text=text, last_on_line=last_on_line))
+        for idx, (col, comment_text) in enumerate(line_comments):
+            yield Comment(line, col, comment_text, idx + 1 >= len(line_comments))
+
+        line += 1
+        line_start = next_line_start
+
+
+# Extract comments from lines. Returns an array of Comment.
+def extract_comments(lines):
+    comments = list(tokenize_comments(''.join(lines)))
 
     # Handle control statements and filter out comments that are part of
     # RST code block directives.
@@ -718,9 +947,10 @@ def check_file(checker, file, lines, error_handler):
     num_errors = 0
 
     comments = extract_comments(lines)
+    comment_errors = check_comments(checker, [(comment.col, comment.text) for comment in comments])
     errors = []
-    for comment in comments:
-        errors += check_comment(checker, comment.col, comment.text)
+    for comment, errs in zip(comments, comment_errors):
+        errors.extend(errs)
         if comment.last_on_line and len(errors) > 0:
             # Handle all the errors in a line.
             num_errors += len(errors)
@@ -730,30 +960,75 @@ def check_file(checker, file, lines, error_handler):
     return (len(comments), num_errors)
 
 
-def execute(files, dictionary_file, fix):
-    checker = SpellChecker(dictionary_file)
-    checker.start()
+# The SpellChecker of a pool worker, which runs its own aspell process.
+worker_checker = None
+
+
+def start_worker(checker):
+    global worker_checker
+    worker_checker = checker
+    worker_checker.start_aspell()
+
+
+# Checks a file in a pool worker. The errors are returned rather than printed so that
+# the output is in file order.
+def check_path(path):
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    line_errors = []
+    num_comments, num_errors = check_file(
+        worker_checker, path, lines, lambda file, line_offset, lines, errors: line_errors.append(
+            (line_offset, errors)))
+    return (
+        path, num_comments, num_errors, lines if line_errors else None, line_errors,
+        worker_checker.take_new_verdicts())
+
 
-    handler = print_error
-    if fix:
-        handler = partial(fix_error, checker)
+def execute(files, dictionary_file, fix, jobs=1, cache_path=None):
+    checker = SpellChecker(dictionary_file)
+    if cache_path:
+        checker.load_cache(cache_path)
 
     total_files = 0
     total_comments = 0
     total_errors = 0
-    for path in files:
-        with open(path, 'r') as f:
-            lines = f.readlines()
-            total_files += 1
-            (num_comments, num_errors) = check_file(checker, path, lines, handler)
-            total_comments += num_comments
-            total_errors += num_errors
-
-        if fix and num_errors > 0:
-            with open(path, 'w') as f:
-                f.writelines(lines)
-
-    checker.stop()
+    if fix or jobs <= 1:
+        checker.start()
+
+        handler = print_error
+        if fix:
+            handler = partial(fix_error, checker)
+
+        for path in files:
+            with open(path, 'r') as f:
+                lines = f.readlines()
+                total_files += 1
+                (num_comments, num_errors) = check_file(checker, path, lines, handler)
+                total_comments += num_comments
+                total_errors += num_errors
+
+            if fix and num_errors > 0:
+                with open(path, 'w') as f:
+                    f.writelines(lines)
+
+        checker.stop()
+    else:
+        # Shard the files over a pool of workers, each with its own aspell process. Fixing is
+        # interactive, so it always runs in this process.
+        checker.load()
+        chunksize = max(1, min(16, len(files) // (jobs * 4)))
+        with multiprocessing.Pool(jobs, initializer=start_worker, initargs=(checker,)) as pool:
+            for path, num_comments, num_errors, lines, line_errors, verdicts in pool.imap(
+                    check_path, files, chunksize):
+                checker.add_verdicts(verdicts)
+                total_files += 1
+                total_comments += num_comments
+                total_errors += num_errors
+                for line_offset, errors in line_errors:
+                    print_error(path, line_offset, lines, errors)
+
+    if cache_path:
+        checker.save_cache(cache_path)
 
     print(
         "Checked %d file(s) and %d comment(s), found %d error(s)." %
@@ -800,6 +1075,20 @@ if __name__ == "__main__":
         dest='test_ignore_exts',
         action='store_true',
         help="For testing, ignore file extensions.")
+    parser.add_argument(
+        '-j',
+        '--num-workers',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help="number of worker processes, each with its own aspell, to use when checking; "
+        "defaults to one per core.")
+    parser.add_argument(
+        '--cache-path',
+        type=str,
+        default=None,
+        help="path of a persistent cache of aspell verdicts per word and per line, so that only "
+        "lines with new words are sent to aspell. It is discarded when the dictionary or aspell "
+        "version changes.")
     args = parser.parse_args()
 
     COLOR = args.color == "on" or (args.color == "auto" and sys.stdout.isatty())
@@ -832,7 +1121,9 @@ if __name__ == "__main__":
         if os.path.isfile(p) and (exts is None or os.path.splitext(p)[1] in exts):
             target_paths += [p]
 
-    rv = execute(target_paths, args.dictionary, args.operation_type == 'fix')
+    rv = execute(
+        target_paths, args.dictionary, args.operation_type == 'fix', args.num_workers,
+        args.cache_path)
 
     if args.operation_type == 'check':
         if not rv:
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark for the comment tokenizer of check_spelling_pedantic.py. Runs extract_comments
+# over a corpus of source files and reports comments per second. No aspell process is needed.
+#
+# Usage (from the root of the repository):
+#   tools/spelling/check_spelling_pedantic_benchmark.py [--repeat 3] [./api ./source ...]
+
+import argparse
+import os
+import time
+
+import check_spelling_pedantic
+
+BENCHMARK_SUFFIXES = (".cc", ".h", ".proto")
+DEFAULT_CORPUS = ["./api", "./include", "./source", "./test", "./tools"]
+
+
+def corpus_files(corpus):
+    files = []
+    for path in corpus:
+        for root, _, names in os.walk(path):
+            for name in names:
+                if name.endswith(BENCHMARK_SUFFIXES):
+                    files.append(os.path.join(root, name))
+    return sorted(files)
+
+
+def read_corpus(files):
+    contents = []
+    for path in files:
+        try:
+            with open(path, 'r') as f:
+                contents.append(f.readlines())
+        except UnicodeDecodeError:
+            continue
+    return contents
+
+
+# Returns the best wall-clock time and the number of comments of running extract_comments over
+# all files.
+def time_extract(contents, repeat):
+    best = None
+    num_comments = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_comments = 0
+        for lines in contents:
+            num_comments += len(check_spelling_pedantic.extract_comments(lines))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, num_comments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark check_spelling_pedantic.py comments.")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="number of runs; the fastest one is reported.")
+    parser.add_argument(
+        "corpus", type=str, nargs="*", default=DEFAULT_CORPUS, help="directories to scan.")
+    args = parser.parse_args()
+
+    contents = read_corpus(corpus_files(args.corpus))
+    lines = sum(len(file_lines) for file_lines in contents)
+    elapsed, num_comments = time_extract(contents, args.repeat)
+    print("%d files, %d lines, %d comments" % (len(contents), lines, num_comments))
+    print(
+        "extract_comments %8.2fs %12.0f comments/s %12.0f lines/s" %
+        (elapsed, num_comments / elapsed, lines / elapsed))
@@ -9,6 +9,7 @@ import argparse
 import logging
 import os
 import sys
+import tempfile
 
 curr_dir = os.path.dirname(os.path.realpath(__file__))
 tools = os.path.dirname(curr_dir)
@@ -19,8 +20,8 @@ check_spelling = sys.executable + " " + os.path.join(curr_dir, 'check_spelling_p
 # Runs the 'check_spelling_pedanic' operation, on the specified file,
 # printing the comamnd run and the status code as well as the stdout,
 # and returning all of that to the caller.
-def run_check_format(operation, filename):
-    command = check_spelling + " --test-ignore-exts " + operation + " " + filename
+def run_check_format(operation, filename, extra_args=""):
+    command = check_spelling + " --test-ignore-exts " + extra_args + " " + operation + " " + filename
     status, stdout, stderr = run_command(command)
     return (command, status, stdout + stderr)
 
@@ -53,21 +54,21 @@ def expect_error(filename, status, stdout, expected_substrings):
     return errors
 
 
-def check_file_expecting_errors(filename, expected_substrings):
-    command, status, stdout = run_check_format("check", get_input_file(filename))
+def check_file_expecting_errors(filename, expected_substrings, extra_args=""):
+    command, status, stdout = run_check_format("check", get_input_file(filename), extra_args)
     return expect_error(filename, status, stdout, expected_substrings)
 
 
-def check_file_path_expecting_ok(filename):
-    command, status, stdout = run_check_format("check", filename)
+def check_file_path_expecting_ok(filename, extra_args=""):
+    command, status, stdout = run_check_format("check", filename, extra_args)
     if status != 0:
         logging.error("Expected %s to have no errors; status=%d, output:\n" % (filename, status))
         emit_stdout_as_error(stdout)
     return status
 
 
-def check_file_expecting_ok(filename):
-    return check_file_path_expecting_ok(get_input_file(filename))
+def check_file_expecting_ok(filename, extra_args=""):
+    return check_file_path_expecting_ok(get_input_file(filename), extra_args)
 
 
 def run_checks():
@@ -88,6 +89,22 @@ def run_checks():
     errors += check_file_expecting_errors("rst_code_block", ["speelinga", "speelingb"])
     errors += check_file_expecting_errors("word_splitting", ["Speeled", "Korrectly"])
 
+    # Sharded over several aspell workers.
+    errors += check_file_expecting_errors(
+        "", ["spacific", "speelinga", "speelinge", "Korrectly", "Checked 8 file(s)"],
+        extra_args="--num-workers 2")
+
+    # With a persistent word verdict cache, cold and then warm.
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_args = "--cache-path " + os.path.join(tmp, "cache.json")
+        for _ in range(2):
+            errors += check_file_expecting_errors(
+                "typos", ["spacific", "reelistic", "Awwful", "combeenations", "woork"],
+                extra_args=cache_args)
+            errors += check_file_expecting_errors(
+                "word_splitting", ["Speeled", "Korrectly"], extra_args=cache_args)
+            errors += check_file_expecting_ok("valid", extra_args=cache_args)
+
     return errors
 
 
@@ -11,17 +11,90 @@
 # In each case this script will add file and line information to any backtrace log
 # lines found and echo back all non-Backtrace lines untouched.
 
+from collections import OrderedDict
 import re
 import subprocess
 import sys
+import threading
+
+# Maximum number of backtrace frames to resolve in one addr2line request.
+ADDR2LINE_BATCH_SIZE = 256
+
+# Maximum number of resolved addresses to remember.
+ADDR2LINE_CACHE_SIZE = 1 << 16
+
+# Header of the addr2line -a output for an address, e.g. "0x0000000000001150: ".
+ADDR2LINE_ADDRESS_RE = re.compile(r'^(0x[0-9a-fA-F]+): ')
+
+
+class Addr2line(object):
+    """A persistent addr2line coprocess for an object file.
+
+    Addresses are resolved in batches over the coprocess pipes, and the results are kept in an
+    LRU cache, so that the debug information of the object file is only loaded once.
+    """
+
+    def __init__(self, obj_file, cache_size=ADDR2LINE_CACHE_SIZE):
+        # -a prefixes the output for each address with the address, which delimits the output
+        # for an address from that for the next one, as the number of (inlined by) lines varies.
+        self._process = subprocess.Popen(["addr2line", "-Cpaie", obj_file],
+                                         stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE,
+                                         universal_newlines=True)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def close(self):
+        self._process.stdin.close()
+        self._process.wait()
+
+    # Returns the `addr2line -Cpie` output for each address (hex strings).
+    def resolve(self, addresses):
+        missing = [address for address in dict.fromkeys(addresses) if address not in self._cache]
+        if missing:
+            for address, output in zip(missing, self._query(missing)):
+                self._cache[address] = output
+        results = []
+        for address in addresses:
+            self._cache.move_to_end(address)
+            results.append(self._cache[address])
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return results
+
+    def _query(self, addresses):
+        # The address 0x0 never resolves and ends the request, so that reading its output
+        # tells that all of the requested addresses were resolved. Requests are written from
+        # another thread as addr2line may fill the output pipe before reading all of them.
+        request = ''.join(address + '\n' for address in addresses) + '0x0\n'
+        writer = threading.Thread(target=self._write, args=(request,))
+        writer.start()
+        outputs = []
+        while True:
+            line = self._process.stdout.readline()
+            if line == '':
+                raise RuntimeError('addr2line exited unexpectedly')
+            header = ADDR2LINE_ADDRESS_RE.match(line)
+            if header:
+                if len(outputs) == len(addresses):
+                    break
+                outputs.append(line[header.end():])
+            else:
+                outputs[-1] += line
+        writer.join()
+        return outputs
+
+    def _write(self, request):
+        self._process.stdin.write(request)
+        self._process.stdin.flush()
 
 
 # Process the log output looking for stacktrace snippets, for each line found to
 # contain backtrace output extract the address and call add2line to get the file
-# and line information. Output appended to end of original backtrace line. Output
-# any nonmatching lines unmodified. End when EOF received.
+# and line information. Consecutive backtrace lines are resolved in a batch by a
+# single addr2line process. Output appended to end of original backtrace line.
+# Output any nonmatching lines unmodified. End when EOF received.
 def decode_stacktrace_log(object_file, input_source, address_offset=0):
-    traces = {}
     # Match something like:
     #     [backtrace] [bazel-out/local-dbg/bin/source/server/_virtual_includes/backtrace_lib/server/backtrace.h:84]
     backtrace_marker = "\[backtrace\] [^\s]+"
@@ -34,10 +107,30 @@ def decode_stacktrace_log(object_file, input_source, address_offset=0):
     #     #10 0xLOCATION (BINARY+0xADDR)
     asan_re = re.compile(" *#\d+ *0x[0-9a-fA-F]+ *\([^+]*\+(0x[0-9a-fA-F]+)\)")
 
+    addr2line = None
+    # Backtrace lines and addresses, resolved together when the backtrace ends.
+    frames = []
+
+    def write_frames():
+        nonlocal addr2line
+        if not frames:
+            return
+        if addr2line is None:
+            addr2line = Addr2line(object_file)
+        resolved = addr2line.resolve([address for _, address in frames])
+        for (line, address), file_and_line_number in zip(frames, resolved):
+            file_and_line_number = trim_proc_cwd(file_and_line_number)
+            if address_offset != 0:
+                sys.stdout.write("%s->[%s] %s" % (line.strip(), address, file_and_line_number))
+            else:
+                sys.stdout.write("%s %s" % (line.strip(), file_and_line_number))
+        frames.clear()
+
     try:
         while True:
             line = input_source.readline()
             if line == "":
+                write_frames()
                 return  # EOF
             stackaddr_match = stackaddr_re.search(line)
             if not stackaddr_match:
@@ -46,27 +139,19 @@ def decode_stacktrace_log(object_file, input_source, address_offset=0):
                 address = stackaddr_match.groups()[0]
                 if address_offset != 0:
                     address = hex(int(address, 16) - address_offset)
-                file_and_line_number = run_addr2line(object_file, address)
-                file_and_line_number = trim_proc_cwd(file_and_line_number)
-                if address_offset != 0:
-                    sys.stdout.write("%s->[%s] %s" % (line.strip(), address, file_and_line_number))
-                else:
-                    sys.stdout.write("%s %s" % (line.strip(), file_and_line_number))
+                frames.append((line, address))
+                if len(frames) >= ADDR2LINE_BATCH_SIZE:
+                    write_frames()
                 continue
             else:
+                write_frames()
                 # Pass through print all other log lines:
                 sys.stdout.write(line)
     except KeyboardInterrupt:
         return
-
-
-# Execute addr2line with a particular object file and input string of addresses
-# to resolve, one per line.
-#
-# Returns list of result lines
-def run_addr2line(obj_file, addr_to_resolve):
-    return subprocess.check_output(["addr2line", "-Cpie", obj_file,
-                                    addr_to_resolve]).decode('utf-8')
+    finally:
+        if addr2line is not None:
+            addr2line.close()
 
 
 # Because of how bazel compiles, addr2line reports file names that begin with
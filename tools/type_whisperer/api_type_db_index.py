@@ -0,0 +1,142 @@
+# Indexed binary format for the API type database (tools.type_whisperer.TypeDb).
+#
+# Parsing the text format type database dominates the startup of tools that only look up the
+# handful of types used by a single .proto. The index stores every map entry of the database as a
+# serialized proto behind a table of keys sorted by name, so it can be memory mapped when opened and
+# looked up by binary search, parsing only the entries that are actually read.
+#
+# Layout, with little endian integers:
+#   header: magic, then (record offset, record count) for the types and next_version_protos maps.
+#   records: (key offset, key length, value offset, value length) for each map entry, by key.
+#   data: the UTF-8 keys and serialized values the records point at.
+
+import mmap
+import os
+import struct
+
+from tools.type_whisperer.api_type_db_pb2 import NextVersionFileDescription, TypeDbDescription
+
+TYPE_DB_INDEX_EXTENSION = '.pb_index'
+
+MAGIC = b'ENVOYTDB'
+HEADER = struct.Struct('<8sQQQQ')
+RECORD = struct.Struct('<QIQI')
+
+
+def type_db_index_path(type_db_path):
+    """Path of the index that accompanies a text format type database."""
+    return os.path.splitext(type_db_path)[0] + TYPE_DB_INDEX_EXTENSION
+
+
+def write_type_db_index(type_db, path):
+    """Write a tools.type_whisperer.TypeDb proto in indexed binary format.
+
+    Args:
+        type_db: tools.type_whisperer.TypeDb proto.
+        path: filesystem path to write the index to.
+    """
+    maps = [
+        sorted((key.encode(), value.SerializeToString()) for key, value in entries.items())
+        for entries in (type_db.types, type_db.next_version_protos)
+    ]
+    records = bytearray()
+    data = bytearray()
+    data_offset = HEADER.size + RECORD.size * sum(len(entries) for entries in maps)
+    header = [MAGIC]
+    for entries in maps:
+        header.extend([HEADER.size + len(records), len(entries)])
+        for key, value in entries:
+            key_offset = data_offset + len(data)
+            data += key
+            records += RECORD.pack(key_offset, len(key), data_offset + len(data), len(value))
+            data += value
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(*header))
+        f.write(records)
+        f.write(data)
+
+
+class IndexedMap(object):
+    """Read-only view of a map in a type database index.
+
+    Like protobuf message maps, looking up a missing key yields a default entry.
+    """
+
+    def __init__(self, buf, offset, count, message_class):
+        self._buf = buf
+        self._offset = offset
+        self._count = count
+        self._message_class = message_class
+        self._entries = {}
+
+    def _record(self, n):
+        return RECORD.unpack_from(self._buf, self._offset + n * RECORD.size)
+
+    def _key(self, n):
+        key_offset, key_length, _, _ = self._record(n)
+        return self._buf[key_offset:key_offset + key_length]
+
+    def _find(self, key):
+        if key not in self._entries:
+            encoded_key = key.encode()
+            lo, hi = 0, self._count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._key(mid) < encoded_key:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            entry = None
+            if lo < self._count and self._key(lo) == encoded_key:
+                _, _, value_offset, value_length = self._record(lo)
+                entry = self._message_class()
+                entry.ParseFromString(self._buf[value_offset:value_offset + value_length])
+            self._entries[key] = entry
+        return self._entries[key]
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __getitem__(self, key):
+        entry = self._find(key)
+        return self._message_class() if entry is None else entry
+
+    def get(self, key, default=None):
+        entry = self._find(key)
+        return default if entry is None else entry
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for n in range(self._count):
+            yield self._key(n).decode()
+
+    def keys(self):
+        return iter(self)
+
+    def values(self):
+        for key in self:
+            yield self[key]
+
+    def items(self):
+        for key in self:
+            yield key, self[key]
+
+
+class TypeDbIndex(object):
+    """Type database backed by a memory mapped index.
+
+    Provides the types and next_version_protos maps of tools.type_whisperer.TypeDb.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, types_offset, types_count, protos_offset, protos_count = HEADER.unpack_from(
+            self._buf)
+        if magic != MAGIC:
+            raise ValueError('{} is not a type database index'.format(path))
+        self.types = IndexedMap(self._buf, types_offset, types_count, TypeDbDescription)
+        self.next_version_protos = IndexedMap(
+            self._buf, protos_offset, protos_count, NextVersionFileDescription)
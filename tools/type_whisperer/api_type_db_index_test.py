@@ -0,0 +1,81 @@
+import os
+import tempfile
+import unittest
+
+from tools.type_whisperer import api_type_db_index
+from tools.type_whisperer.api_type_db_pb2 import TypeDb, TypeDbDescription
+
+
+class ApiTypeDbIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.type_db = TypeDb()
+        for type_name, proto_path, next_version_type_name in [
+            ('envoy.api.v2.Cluster', 'envoy/api/v2/cluster.proto',
+             'envoy.config.cluster.v3.Cluster'),
+            ('envoy.api.v2.Listener', 'envoy/api/v2/listener.proto',
+             'envoy.config.listener.v3.Listener'),
+            ('envoy.type.Percent', 'envoy/type/percent.proto', ''),
+            # Non-ASCII names sort by their UTF-8 encoding.
+            ('envoy.type.Zé', 'envoy/type/ze.proto', ''),
+        ]:
+            description = self.type_db.types[type_name]
+            description.qualified_package = type_name.rsplit('.', 1)[0]
+            description.proto_path = proto_path
+            description.next_version_type_name = next_version_type_name
+        for proto_path, next_version_package, next_version_proto_path in [
+            ('envoy/api/v2/cluster.proto', 'envoy.config.cluster.v3',
+             'envoy/config/cluster/v3/cluster.proto'),
+            ('envoy/api/v2/listener.proto', 'envoy.config.listener.v3',
+             'envoy/config/listener/v3/listener.proto'),
+        ]:
+            next_version = self.type_db.next_version_protos[proto_path]
+            next_version.qualified_package = next_version_package
+            next_version.proto_path = next_version_proto_path
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'api_type_db.pb_index')
+        api_type_db_index.write_type_db_index(self.type_db, self.path)
+        self.index = api_type_db_index.TypeDbIndex(self.path)
+
+    def assert_map_equal(self, indexed, expected):
+        self.assertEqual(len(indexed), len(expected))
+        self.assertEqual(list(indexed), sorted(expected, key=lambda key: key.encode()))
+        self.assertEqual(list(indexed.values()), [expected[key] for key in indexed])
+        for key, value in expected.items():
+            self.assertIn(key, indexed)
+            self.assertEqual(indexed[key], value)
+            self.assertEqual(indexed.get(key), value)
+
+    def test_types(self):
+        self.assert_map_equal(self.index.types, self.type_db.types)
+
+    def test_next_version_protos(self):
+        self.assert_map_equal(self.index.next_version_protos, self.type_db.next_version_protos)
+
+    def test_missing_key(self):
+        for key in ['envoy.api.v2.Bogus', 'a', 'zzz', '']:
+            self.assertNotIn(key, self.index.types)
+            self.assertIsNone(self.index.types.get(key))
+            self.assertEqual(self.index.types.get(key, 'default'), 'default')
+            # Like protobuf maps, a missing key yields a default entry.
+            self.assertEqual(self.index.types[key], TypeDbDescription())
+        self.assertNotIn('envoy/type/percent.proto', self.index.next_version_protos)
+
+    def test_empty(self):
+        api_type_db_index.write_type_db_index(TypeDb(), self.path)
+        index = api_type_db_index.TypeDbIndex(self.path)
+        self.assertEqual(len(index.types), 0)
+        self.assertEqual(list(index.next_version_protos.values()), [])
+        self.assertNotIn('envoy.api.v2.Cluster', index.types)
+
+    def test_not_an_index(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * api_type_db_index.HEADER.size)
+        with self.assertRaises(ValueError):
+            api_type_db_index.TypeDbIndex(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
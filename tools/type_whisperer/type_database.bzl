@@ -16,11 +16,17 @@ def _type_database_impl(ctx):
         executable = ctx.executable._type_db_gen,
         arguments = args,
         inputs = type_db_deps,
-        outputs = [ctx.outputs.pb_text],
+        outputs = [ctx.outputs.pb_text, ctx.outputs.pb_index],
         mnemonic = "TypeDbGen",
         use_default_shell_env = True,
     )
 
+    # The text proto is the default output; the index is only consumed by the Python proto tools.
+    return [
+        DefaultInfo(files = depset([ctx.outputs.pb_text])),
+        OutputGroupInfo(pb_index = depset([ctx.outputs.pb_index])),
+    ]
+
 type_database = rule(
     attrs = {
         "targets": attr.label_list(
@@ -38,6 +44,7 @@ type_database = rule(
         ),
     },
     outputs = {
+        "pb_index": "%{name}.pb_index",
         "pb_text": "%{name}.pb_text",
     },
     implementation = _type_database_impl,
@@ -7,6 +7,7 @@ import sys
 
 from google.protobuf import text_format
 
+from tools.type_whisperer.api_type_db_index import type_db_index_path, write_type_db_index
 from tools.type_whisperer.api_type_db_pb2 import TypeDb
 from tools.type_whisperer.types_pb2 import Types, TypeDescription
 
@@ -92,45 +93,77 @@ def load_types(path):
     return types
 
 
-def next_version_upgrade(type_name, type_map, next_version_upgrade_memo, visited=None):
-    """Does a given type require upgrade between major version?
+def api_type_dependencies(type_name, type_map):
+    """Dependencies of a type that can force its upgrade, i.e. the API (envoy) types."""
+    return [d for d in type_map[type_name].type_dependencies if d.startswith('envoy')]
 
-    Performs depth-first search through type dependency graph for any upgraded
-    types that will force type_name to be upgraded.
+
+def next_version_upgrades(type_map):
+    """Determine which types require upgrade between major versions.
+
+    A type requires upgrade if it is in a package that we force upgrade, is marked
+    for next version upgrade itself, or transitively depends on a type that
+    requires upgrade. Non-API types never require upgrade.
+
+    This is an iterative Tarjan strongly connected components pass over the type
+    dependency graph, linear in the number of types and dependencies. Components
+    are completed in reverse topological order, so the dependencies outside a
+    component are always resolved before it, and all types in a dependency loop
+    share a result.
 
     Args:
-        type_name: fully qualified type name.
         type_map: map from type name to tools.type_whisperer.TypeDescription.
-           next_version_upgrade_memo: a memo dictionary to avoid revisiting nodes
-           across invocations.
-        visited: a set of visited nodes in the current search, used to detect loops.
 
     Returns:
-        A boolean indicating whether the type requires upgrade.
+        A set of the names of the types that require upgrade.
     """
-    if not visited:
-        visited = set([])
-    # Ignore non-API types.
-    if not type_name.startswith('envoy'):
-        return False
-    # If we have a loop, we can't learn anything new by circling around again.
-    if type_name in visited:
-        return False
-    visited = visited.union(set([type_name]))
-    # If we have seen this type in a previous next_version_upgrade(), use that
-    # result.
-    if type_name in next_version_upgrade_memo:
-        return next_version_upgrade_memo[type_name]
-    type_desc = type_map[type_name]
-    # Force upgrade packages that we enumerate.
-    if type_desc.qualified_package in PKG_FORCE_UPGRADE:
-        return True
-    # Recurse and memoize.
-    should_upgrade = type_desc.next_version_upgrade or any(
-        next_version_upgrade(d, type_map, next_version_upgrade_memo, visited)
-        for d in type_desc.type_dependencies)
-    next_version_upgrade_memo[type_name] = should_upgrade
-    return should_upgrade
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    upgrades = set()
+
+    def visit(type_name):
+        index[type_name] = lowlink[type_name] = len(index)
+        stack.append(type_name)
+        on_stack.add(type_name)
+        return (type_name, iter(api_type_dependencies(type_name, type_map)))
+
+    for root in type_map:
+        if root in index or not root.startswith('envoy'):
+            continue
+        work = [visit(root)]
+        while work:
+            type_name, deps = work[-1]
+            for d in deps:
+                if d not in index:
+                    work.append(visit(d))
+                    break
+                if d in on_stack:
+                    lowlink[type_name] = min(lowlink[type_name], index[d])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[type_name])
+                if lowlink[type_name] != index[type_name]:
+                    continue
+                component = []
+                while True:
+                    t = stack.pop()
+                    on_stack.remove(t)
+                    component.append(t)
+                    if t == type_name:
+                        break
+                # The component requires upgrade if any of its types is in a package
+                # that we force upgrade, is marked for upgrade or depends on an
+                # upgraded component.
+                if any(type_map[t].qualified_package in PKG_FORCE_UPGRADE or
+                       type_map[t].next_version_upgrade or
+                       any(d in upgrades for d in api_type_dependencies(t, type_map))
+                       for t in component):
+                    upgrades.update(component)
+    return upgrades
 
 
 if __name__ == '__main__':
@@ -139,30 +172,34 @@ if __name__ == '__main__':
 
     # Load type descriptors for each type whisper
     type_desc_paths = sys.argv[2:]
-    type_whispers = map(load_types, type_desc_paths)
 
     # Aggregate type descriptors to a single type map.
-    type_map = dict(sum([list(t.types.items()) for t in type_whispers], []))
+    type_map = {}
+    for type_desc_path in type_desc_paths:
+        type_map.update(load_types(type_desc_path).types.items())
     all_pkgs = set([type_desc.qualified_package for type_desc in type_map.values()])
 
-    # Determine via DFS on each type descriptor and its deps which packages require upgrade.
-    next_version_upgrade_memo = {}
-    next_versions_pkgs = set([
-        type_desc.qualified_package
-        for type_name, type_desc in type_map.items()
-        if next_version_upgrade(type_name, type_map, next_version_upgrade_memo)
-    ]).union(set(['envoy.config.retry.previous_priorities', 'envoy.config.cluster.redis']))
-
-    # Generate type map entries for upgraded types. We run this twice to allow
-    # things like a v2 deprecated map field's synthesized map entry to forward
-    # propagate to v4alpha (for shadowing purposes).
+    # Determine from the type dependency graph which packages require upgrade.
+    next_versions_pkgs = set(
+        type_map[type_name].qualified_package for type_name in next_version_upgrades(type_map))
+    next_versions_pkgs.update(
+        ['envoy.config.retry.previous_priorities', 'envoy.config.cluster.redis'])
+
+    # Generate type map entries for upgraded types. The entries generated for
+    # the original types are upgraded once more, to allow things like a v2
+    # deprecated map field's synthesized map entry to forward propagate to
+    # v4alpha (for shadowing purposes).
+    pending = list(type_map)
     for _ in range(2):
-        type_map.update([
-            upgraded_type_with_description(type_name, type_desc)
-            for type_name, type_desc in type_map.items()
-            if type_desc.qualified_package in next_versions_pkgs and (
-                type_desc.active or type_desc.deprecated_type or type_desc.map_entry)
-        ])
+        upgraded = [
+            upgraded_type_with_description(type_name, type_map[type_name])
+            for type_name in pending
+            if type_map[type_name].qualified_package in next_versions_pkgs and
+            (type_map[type_name].active or type_map[type_name].deprecated_type or
+             type_map[type_name].map_entry)
+        ]
+        type_map.update(upgraded)
+        pending = [type_name for type_name, _ in upgraded]
 
     # Generate the type database proto. To provide some stability across runs, in
     # terms of the emitted proto binary blob that we track in git, we sort before
@@ -185,6 +222,7 @@ if __name__ == '__main__':
             type_db.next_version_protos[proto_path].proto_path = next_proto_path
             type_db.next_version_protos[proto_path].qualified_package = next_package
 
-    # Write out proto text.
+    # Write out proto text, and the index used for lookups by the proto tools.
     with open(out_path, 'w') as f:
         f.write(str(type_db))
+    write_type_db_index(type_db, type_db_index_path(out_path))